@@ -0,0 +1,88 @@
+"""
+Request backends for the GGUF inference server.
+
+A backend is what an endpoint talks to for the duration of one request:
+tokenization and generation against a single model. ``LocalBackend``
+runs in this process on a leased model; the worker-process mode in
+``workers`` provides a backend with the same interface.
+"""
+
+import logging
+from typing import List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from .batching import batch_engines
+from .config import settings
+from .embeddings import embed
+from .inference import InferenceEngine
+from .model_manager import ModelLease
+
+logger = logging.getLogger(__name__)
+
+
+def check_token_ids(tokens: Sequence[int], n_vocab: int) -> None:
+    """
+    Reject token ids outside the model's vocabulary before they reach llama.cpp,
+    which would assert or index past its embedding table.
+
+    Raises:
+        ValueError: An id is negative or not below ``n_vocab``
+    """
+    if tokens and (min(tokens) < 0 or max(tokens) >= n_vocab):
+        bad = next(token for token in tokens if not 0 <= token < n_vocab)
+        raise ValueError(f"Token id {bad} is outside the model's vocabulary (0-{n_vocab - 1})")
+
+
+class LocalBackend:
+    """Serves a request in-process from a leased model replica."""
+
+    def __init__(self, model_name: str, lease: ModelLease):
+        self.model_name = model_name
+        self.lease = lease
+
+    @property
+    def model(self):
+        return self.lease.model
+
+    async def tokenize(self, text: str) -> List[int]:
+        """Tokenize a prompt exactly as generation would."""
+        return await InferenceEngine.tokenize(self.model, text)
+
+    async def tokenize_chat(self, messages: List[dict]) -> List[int]:
+        """Tokenize a conversation through the per-message tokenization cache."""
+        return await InferenceEngine.tokenize_chat(self.model, messages, model_name=self.model_name)
+
+    async def count_tokens(self, text: str) -> int:
+        """Count tokens in plain text."""
+        return await InferenceEngine.get_token_count(self.model, text)
+
+    def check_tokens(self, tokens: Sequence[int]) -> None:
+        """Raise ``ValueError`` for client-supplied token ids outside the model's vocabulary."""
+        check_token_ids(tokens, self.model.n_vocab())
+
+    async def generate(self, prompt: Union[str, List[int]], session: Optional[str] = None, **kwargs):
+        """
+        Run generation on the continuous batching engine or the per-request engine.
+
+        Chat session turns always use the per-request engine, which runs
+        on the model's own context where session states are restored.
+
+        Returns a result dictionary, or an async generator of token
+        dictionaries when ``stream=True``.
+        """
+        if settings.enable_continuous_batching and session is None:
+            engine = batch_engines.get(self.model_name, self.model)
+            return await engine.generate_completion(prompt=prompt, **kwargs)
+        return await InferenceEngine.generate_completion(model=self.model, prompt=prompt, session=session, **kwargs)
+
+    async def embed(self, inputs: List[Union[str, List[int]]], normalize: bool = True) -> Tuple[np.ndarray, int]:
+        """Embed texts or token id lists; the lease must be on the model's embedding instance."""
+        for item in inputs:
+            if not isinstance(item, str):
+                self.check_tokens(item)
+        return await embed(self.model, inputs, normalize)
+
+    async def release(self) -> None:
+        """Return the model lease (idempotent)."""
+        await self.lease.release()
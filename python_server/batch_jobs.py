@@ -0,0 +1,560 @@
+"""
+Offline batch jobs over JSONL files of completion and chat requests.
+
+A job runs in the background at lower priority than interactive traffic:
+each of its requests is admitted only while no interactive request is
+waiting for the model. Requests are ordered by model and prompt, so the
+ones sharing a prefix (a system prompt, a conversation history) run back
+to back and reuse its KV state through the model's context and prefix
+cache. Results are appended to an output JSONL as they finish; that file
+is also the checkpoint, so a job interrupted by a shutdown resumes with
+the requests it has not answered yet.
+
+Jobs live under ``cache_dir/batches/<job id>/`` as ``input.jsonl``,
+``output.jsonl`` and ``job.json`` (status and counters).
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from pydantic import ValidationError
+
+from .backends import LocalBackend
+from .cancellation import DEADLINE, CancelToken, request_registry
+from .config import settings
+from .model_manager import ModelLoading, ModelMemoryExhausted, model_manager
+from .sampling import result_choices
+from .scheduler import request_scheduler
+from .schemas import (
+    ChatCompletionChoice,
+    ChatCompletionRequest,
+    ChatCompletionResponse,
+    ChatMessage,
+    CompletionChoice,
+    CompletionRequest,
+    CompletionResponse,
+)
+from .workers import WorkerCrashed, worker_pool
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, COMPLETED, FAILED, CANCELLED = "queued", "running", "completed", "failed", "cancelled"
+
+CHAT, COMPLETION = "chat", "completion"
+_KIND_BY_URL = {"/v1/chat/completions": CHAT, "/v1/completions": COMPLETION}
+
+# Request fields passed on to generation (chat requests have no repeat_penalty)
+SAMPLING_PARAMS = ("temperature", "top_p", "top_k", "repeat_penalty", "seed")
+
+# Wait before retrying a request whose model could not be served yet
+RETRY_SECONDS = 5.0
+
+
+class BatchInputError(ValueError):
+    """Raised for a batch input file that cannot be parsed or validated."""
+
+
+def parse_batch_input(data: bytes, default_model: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Validate a JSONL batch input.
+
+    Each line is either an OpenAI-style batch entry (``custom_id``, ``url``
+    and ``body``) or a bare request body, which is a chat request if it
+    has ``messages`` and a completion otherwise. ``stream`` and
+    ``session_id`` are ignored.
+
+    Args:
+        data: Raw file content
+        default_model: Model for requests naming none (None = ``default_model`` setting)
+
+    Returns:
+        Normalized entries: ``line``, ``custom_id``, ``kind``, ``model`` and ``body``
+
+    Raises:
+        BatchInputError: A line is not valid JSON or not a valid request
+    """
+    entries = []
+    for number, raw in enumerate(data.decode("utf-8").splitlines(), start=1):
+        if not raw.strip():
+            continue
+        try:
+            item = json.loads(raw)
+        except json.JSONDecodeError as e:
+            raise BatchInputError(f"Line {number}: invalid JSON ({e})")
+        if not isinstance(item, dict):
+            raise BatchInputError(f"Line {number}: expected a JSON object")
+
+        if "body" in item:
+            body = item["body"]
+            kind = _KIND_BY_URL.get(item.get("url", "/v1/chat/completions"))
+            if kind is None:
+                raise BatchInputError(f"Line {number}: unsupported url {item['url']}")
+        else:
+            body = {key: value for key, value in item.items() if key != "custom_id"}
+            kind = CHAT if "messages" in body else COMPLETION
+        if not isinstance(body, dict):
+            raise BatchInputError(f"Line {number}: body must be a JSON object")
+
+        schema = ChatCompletionRequest if kind == CHAT else CompletionRequest
+        try:
+            request = schema(**{**body, "stream": False})
+        except ValidationError as e:
+            raise BatchInputError(f"Line {number}: {e.errors()[0]['msg']}")
+        samples = request.best_of or request.n
+        if samples < request.n or samples > settings.max_choices:
+            raise BatchInputError(f"Line {number}: best_of must be between n and {settings.max_choices}")
+
+        entries.append({
+            "line": number,
+            "custom_id": item.get("custom_id", f"line-{number}"),
+            "kind": kind,
+            "model": request.model or default_model or settings.default_model,
+            "body": request.model_dump(exclude={"model", "stream", "session_id"}),
+        })
+    if not entries:
+        raise BatchInputError("Batch input has no requests")
+    if len(entries) > settings.batch_job_max_requests:
+        raise BatchInputError(f"Batch input exceeds {settings.batch_job_max_requests} requests")
+    return entries
+
+
+def _processing_key(entry: Dict[str, Any]) -> Tuple[str, str]:
+    """Sort key grouping requests by model, then by prompt so shared prefixes are adjacent."""
+    prompt = entry["body"]["messages"] if entry["kind"] == CHAT else entry["body"]["prompt"]
+    return entry["model"], json.dumps(prompt, ensure_ascii=False)
+
+
+class BatchJob:
+    """One batch job: its files, status and throughput counters."""
+
+    def __init__(self, directory: Path, meta: Dict[str, Any]):
+        self.directory = directory
+        self.id: str = meta["id"]
+        self.status: str = meta["status"]
+        self.total: int = meta["total"]
+        self.created_at: float = meta["created_at"]
+        self.started_at: Optional[float] = meta.get("started_at")
+        self.finished_at: Optional[float] = meta.get("finished_at")
+        self.error: Optional[str] = meta.get("error")
+        # Seconds spent running, over all runs of a resumed job
+        self.run_seconds: float = meta.get("run_seconds", 0.0)
+        self.completed = 0
+        self.failed = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.run_started: Optional[float] = None
+        self.cancels: Dict[int, CancelToken] = {}
+
+    @property
+    def input_path(self) -> Path:
+        return self.directory / "input.jsonl"
+
+    @property
+    def output_path(self) -> Path:
+        return self.directory / "output.jsonl"
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (COMPLETED, FAILED, CANCELLED)
+
+    def elapsed(self) -> float:
+        running = time.monotonic() - self.run_started if self.run_started is not None else 0.0
+        return self.run_seconds + running
+
+    def save(self) -> None:
+        """Write ``job.json`` atomically."""
+        meta = {
+            "id": self.id,
+            "status": self.status,
+            "total": self.total,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "run_seconds": self.elapsed(),
+        }
+        tmp = self.directory / "job.json.tmp"
+        tmp.write_text(json.dumps(meta))
+        os.replace(tmp, self.directory / "job.json")
+
+    def load_progress(self) -> Set[int]:
+        """
+        Recount finished requests from the output file.
+
+        A partially written last line (from a crash mid-write) is cut off.
+
+        Returns:
+            Input line numbers already answered
+        """
+        done: Set[int] = set()
+        self.completed = self.failed = self.prompt_tokens = self.completion_tokens = 0
+        if not self.output_path.exists():
+            return done
+        with open(self.output_path, "rb+") as f:
+            data = f.read()
+            end = data.rfind(b"\n") + 1
+            if end < len(data):
+                f.truncate(end)
+        for raw in data[:end].splitlines():
+            record = json.loads(raw)
+            self._count(record)
+            done.add(record["line"])
+        return done
+
+    def iter_output(self, chunk_bytes: int = 1024 * 1024) -> Iterator[bytes]:
+        """
+        The output file as written so far, in chunks.
+
+        Stops at the last complete line present when iteration starts, so a
+        download never includes a half-written record.
+        """
+        if not self.output_path.exists():
+            return
+        with open(self.output_path, "rb") as f:
+            remaining = os.fstat(f.fileno()).st_size
+            while remaining > 0:
+                chunk = f.read(min(chunk_bytes, remaining))
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+                if remaining == 0:
+                    chunk = chunk[:chunk.rfind(b"\n") + 1]
+                yield chunk
+
+    def _count(self, record: Dict[str, Any]) -> None:
+        if record.get("error") is not None:
+            self.failed += 1
+            return
+        self.completed += 1
+        usage = record["response"]["body"]["usage"]
+        self.prompt_tokens += usage["prompt_tokens"]
+        self.completion_tokens += usage["completion_tokens"]
+
+    def status_dict(self) -> Dict[str, Any]:
+        elapsed = self.elapsed()
+        answered = self.completed + self.failed
+        return {
+            "id": self.id,
+            "object": "batch",
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "request_counts": {"total": self.total, "completed": self.completed, "failed": self.failed},
+            "usage": {"prompt_tokens": self.prompt_tokens, "completion_tokens": self.completion_tokens},
+            "elapsed_seconds": round(elapsed, 3),
+            "requests_per_second": round(answered / elapsed, 3) if elapsed > 0 else 0.0,
+            "tokens_per_second": round(self.completion_tokens / elapsed, 2) if elapsed > 0 else 0.0,
+        }
+
+
+class BatchJobManager:
+    """
+    Stores batch jobs and runs them one at a time, in submission order.
+
+    Within a job, up to ``concurrency`` requests are in flight; each holds
+    a background admission ticket, so interactive requests for the same
+    model always go first.
+    """
+
+    def __init__(self, directory: Path, concurrency: int = 1):
+        """
+        Initialize the manager.
+
+        Args:
+            directory: Directory holding one subdirectory per job
+            concurrency: Requests of the running job in flight at once
+        """
+        self.directory = Path(directory)
+        self.concurrency = max(1, concurrency)
+        self._jobs: "OrderedDict[str, BatchJob]" = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._runner: Optional[asyncio.Task] = None
+        self._current: Optional[BatchJob] = None
+
+    async def start(self) -> None:
+        """Load stored jobs and start the runner; unfinished jobs are queued to resume."""
+        self._queue = asyncio.Queue()
+        jobs = await asyncio.to_thread(self._load_jobs)
+        for job in jobs:
+            self._jobs[job.id] = job
+            if not job.finished:
+                logger.info(f"Resuming batch job {job.id} ({job.completed + job.failed}/{job.total} done)")
+                self._queue.put_nowait(job)
+        self._runner = asyncio.create_task(self._run_forever())
+
+    def _load_jobs(self) -> List[BatchJob]:
+        jobs = []
+        if not self.directory.exists():
+            return jobs
+        for meta_path in self.directory.glob("*/job.json"):
+            try:
+                job = BatchJob(meta_path.parent, json.loads(meta_path.read_text()))
+                job.load_progress()
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Skipping unreadable batch job {meta_path.parent.name}: {e}")
+                continue
+            jobs.append(job)
+        jobs.sort(key=lambda job: job.created_at)
+        return jobs
+
+    async def close(self) -> None:
+        """Stop the runner; the running job stays ``running`` on disk and resumes on next start."""
+        if self._runner is not None:
+            self._runner.cancel()
+            await asyncio.gather(self._runner, return_exceptions=True)
+            self._runner = None
+        if self._current is not None:
+            self._current.run_seconds = self._current.elapsed()
+            self._current.run_started = None
+            self._current.save()
+
+    async def submit(self, data: bytes, default_model: Optional[str] = None) -> BatchJob:
+        """
+        Create a job from a JSONL input and queue it.
+
+        Raises:
+            BatchInputError: The input is invalid
+        """
+        entries = parse_batch_input(data, default_model)
+        job_id = f"batch_{uuid.uuid4().hex}"
+        job = BatchJob(self.directory / job_id, {
+            "id": job_id,
+            "status": QUEUED,
+            "total": len(entries),
+            "created_at": time.time(),
+        })
+
+        def _write() -> None:
+            job.directory.mkdir(parents=True, exist_ok=True)
+            with open(job.input_path, "w") as f:
+                for entry in entries:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            job.save()
+
+        await asyncio.to_thread(_write)
+        self._jobs[job_id] = job
+        self._queue.put_nowait(job)
+        logger.info(f"Queued batch job {job_id} with {job.total} requests")
+        return job
+
+    def get(self, job_id: str) -> Optional[BatchJob]:
+        return self._jobs.get(job_id)
+
+    def list_jobs(self) -> List[Dict[str, Any]]:
+        """Status of every job, newest first."""
+        return [job.status_dict() for job in reversed(self._jobs.values())]
+
+    def cancel(self, job_id: str) -> Optional[BatchJob]:
+        """
+        Cancel a queued or running job; requests in flight stop within one token.
+
+        Returns:
+            The job, or None if there is no such job
+        """
+        job = self._jobs.get(job_id)
+        if job is None or job.finished:
+            return job
+        job.status = CANCELLED
+        job.finished_at = time.time()
+        for cancel in list(job.cancels.values()):
+            cancel.cancel()
+        if job is not self._current:
+            job.save()
+        return job
+
+    async def _run_forever(self) -> None:
+        while True:
+            job = await self._queue.get()
+            if job.finished:
+                continue
+            self._current = job
+            try:
+                await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Batch job {job.id} failed: {e}", exc_info=True)
+                job.status = FAILED
+                job.error = str(e)
+            finally:
+                if job.run_started is not None:
+                    job.run_seconds = job.elapsed()
+                    job.run_started = None
+            if job.finished:
+                job.finished_at = job.finished_at or time.time()
+                await asyncio.to_thread(job.save)
+                self._current = None
+                logger.info(f"Batch job {job.id} {job.status}: {job.status_dict()['request_counts']}")
+
+    async def _run(self, job: BatchJob) -> None:
+        """Answer every request of ``job`` not in its output yet."""
+        done = await asyncio.to_thread(job.load_progress)
+        entries = await asyncio.to_thread(self._read_input, job)
+        pending = sorted((entry for entry in entries if entry["line"] not in done), key=_processing_key)
+
+        job.status = RUNNING
+        job.started_at = job.started_at or time.time()
+        job.run_started = time.monotonic()
+        await asyncio.to_thread(job.save)
+
+        work: asyncio.Queue = asyncio.Queue()
+        for entry in pending:
+            work.put_nowait(entry)
+        with open(job.output_path, "a", encoding="utf-8") as output:
+
+            async def _drain() -> None:
+                while not work.empty() and job.status == RUNNING:
+                    entry = work.get_nowait()
+                    record = await self._answer(job, entry)
+                    if record is None:
+                        continue
+                    output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    output.flush()
+                    job._count(record)
+
+            await asyncio.gather(*(_drain() for _ in range(self.concurrency)))
+
+        if job.status == RUNNING:
+            job.status = COMPLETED
+
+    @staticmethod
+    def _read_input(job: BatchJob) -> List[Dict[str, Any]]:
+        with open(job.input_path, encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    async def _answer(self, job: BatchJob, entry: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Run one request of a job at background priority.
+
+        Models that cannot be served yet (loading, out of memory, crashed
+        worker) are retried. Returns the output record, or None when the
+        job was cancelled meanwhile.
+        """
+        while job.status == RUNNING:
+            try:
+                body = await self._generate(job, entry)
+            except (ModelLoading, ModelMemoryExhausted, WorkerCrashed) as e:
+                logger.info(f"Batch job {job.id}: retrying line {entry['line']} in {RETRY_SECONDS:.0f}s ({e})")
+                await asyncio.sleep(RETRY_SECONDS)
+                continue
+            except Exception as e:
+                return self._record(job, entry, error={"code": type(e).__name__, "message": str(e)})
+            if body is None:
+                return None
+            return self._record(job, entry, response={"status_code": 200, "body": body})
+        return None
+
+    @staticmethod
+    def _record(job: BatchJob, entry: Dict[str, Any], response=None, error=None) -> Dict[str, Any]:
+        return {
+            "id": f"{job.id}-{entry['line']}",
+            "custom_id": entry["custom_id"],
+            "line": entry["line"],
+            "response": response,
+            "error": error,
+        }
+
+    async def _generate(self, job: BatchJob, entry: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        body = entry["body"]
+        model_name = entry["model"]
+        samples = body.get("best_of") or body["n"]
+        max_tokens = body["max_tokens"] * samples
+
+        ticket = await request_scheduler.acquire_background(model_name, max_tokens)
+        backend = None
+        cancel = None
+        try:
+            if settings.worker_processes:
+                backend = await worker_pool.session(model_name)
+            else:
+                backend = LocalBackend(model_name, await model_manager.acquire_model(model_name))
+
+            if entry["kind"] == CHAT:
+                prompt_tokens = await backend.tokenize_chat(body["messages"])
+            elif isinstance(body["prompt"], list):
+                prompt_tokens = body["prompt"]
+                backend.check_tokens(prompt_tokens)
+            else:
+                prompt_tokens = await backend.tokenize(body["prompt"])
+            if len(prompt_tokens) + body["max_tokens"] > settings.context_length:
+                raise ValueError("Prompt exceeds context length")
+
+            request_id = f"{job.id}-{entry['line']}"
+            cancel = job.cancels[entry["line"]] = request_registry.open(request_id, max_tokens, ticket.remaining())
+            sampling = {key: body[key] for key in SAMPLING_PARAMS if key in body}
+            start = time.monotonic()
+            result = await backend.generate(
+                prompt=prompt_tokens,
+                max_tokens=body["max_tokens"],
+                choices=samples,
+                stream=False,
+                cancel=cancel,
+                **sampling,
+            )
+            cancel.generated = result["tokens_used"]
+            ticket.record(result["tokens_used"], time.monotonic() - start)
+        finally:
+            if cancel is not None:
+                job.cancels.pop(entry["line"], None)
+                request_registry.close(cancel)
+            if backend is not None:
+                await backend.release()
+            ticket.release()
+
+        if cancel.reason == DEADLINE:
+            raise TimeoutError("Request exceeded deadline")
+        if cancel.reason is not None:
+            return None
+
+        usage = {
+            "prompt_tokens": len(prompt_tokens),
+            "completion_tokens": result["tokens_used"],
+            "total_tokens": result["total_tokens"],
+        }
+        choices = result_choices(result, body["n"])
+        if entry["kind"] == CHAT:
+            response = ChatCompletionResponse(
+                id=request_id,
+                created=int(time.time()),
+                model=model_name,
+                choices=[
+                    ChatCompletionChoice(
+                        index=choice["index"],
+                        message=ChatMessage(role="assistant", content=choice["text"].strip()),
+                        finish_reason=choice["finish_reason"],
+                    )
+                    for choice in choices
+                ],
+                usage=usage,
+            )
+        else:
+            response = CompletionResponse(
+                id=request_id,
+                created=int(time.time()),
+                model=model_name,
+                choices=[
+                    CompletionChoice(index=choice["index"], text=choice["text"], finish_reason=choice["finish_reason"])
+                    for choice in choices
+                ],
+                usage=usage,
+            )
+        return response.model_dump()
+
+    def stats(self) -> Dict[str, Any]:
+        counts: Dict[str, int] = {}
+        for job in self._jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {"jobs": counts, "running": self._current.id if self._current is not None else None}
+
+
+# Global batch job manager
+batch_jobs = BatchJobManager(Path(settings.cache_dir) / "batches", settings.batch_job_concurrency)
@@ -0,0 +1,583 @@
+"""
+Continuous batching engine for GGUF models.
+
+Serves many concurrent sequences from one llama.cpp context through the
+low-level batch API. New requests join the running decode batch at token
+boundaries, and long prompts are prefilled in chunks interleaved with
+decode steps so they never stall other users. A request for several
+choices evaluates its prompt once, then forks the prompt's KV cells into
+one sequence per choice, each with its own sampler.
+"""
+
+import asyncio
+import codecs
+import logging
+import threading
+import time
+from collections import deque
+from typing import AsyncGenerator, Deque, Dict, FrozenSet, List, Optional, Union
+
+import llama_cpp
+import numpy as np
+from llama_cpp import Llama
+from llama_cpp._internals import (
+    _LlamaBatch,
+    _LlamaContext,
+    _LlamaSamplingContext,
+    _LlamaSamplingParams,
+)
+
+from .cancellation import CancelToken
+from .config import settings
+from .executor import inference_executor, pin_current_thread
+from .sampling import log_normalizer
+
+logger = logging.getLogger(__name__)
+
+
+class _Finished:
+    """Final queue item for a sequence, carrying its usage summary."""
+
+    def __init__(
+        self,
+        finish_reason: str,
+        prompt_tokens: int,
+        completion_tokens: int,
+        index: int = 0,
+        logprob: float = 0.0,
+    ):
+        self.finish_reason = finish_reason
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.index = index
+        self.logprob = logprob
+
+
+class _Failure:
+    """Wraps an engine-side exception for re-raising on the event loop."""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class _Sequence:
+    """Decoding state of one request inside the shared batch."""
+
+    def __init__(
+        self,
+        prompt: Union[str, List[int]],
+        max_tokens: int,
+        sampling: _LlamaSamplingParams,
+        loop: asyncio.AbstractEventLoop,
+        cancel: Optional[CancelToken] = None,
+        choices: int = 1,
+    ):
+        self.prompt = prompt
+        self.max_tokens = max_tokens
+        self.sampling = sampling
+        self.sampler = _LlamaSamplingContext(params=sampling)
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+        self.seq_id: Optional[int] = None
+        self.prompt_tokens: List[int] = []
+        self.n_prefilled = 0
+        self.n_past = 0
+        self.n_generated = 0
+        self.last_token: Optional[int] = None
+        self.logits_index: Optional[int] = None
+        self.cancelled = False
+        self.cancel = cancel
+
+        # Parallel sampling: this sequence is choice 0 and forks the others
+        # (into the reserved seq ids) once its prompt is evaluated
+        self.choices = choices
+        self.index = 0
+        self.parent: Optional["_Sequence"] = None
+        self.reserved: List[int] = []
+        self.logprob = 0.0
+
+    @property
+    def prefilling(self) -> bool:
+        return self.n_prefilled < len(self.prompt_tokens)
+
+    @property
+    def abandoned(self) -> bool:
+        """Whether the consumer of this sequence (or of its group) has left."""
+        return self.cancelled or (self.parent is not None and self.parent.cancelled)
+
+    def fork(self, seq_id: int, index: int) -> "_Sequence":
+        """A sibling choice sharing this sequence's evaluated prompt and output queue."""
+        child = _Sequence(self.prompt, self.max_tokens, self.sampling, self.loop, self.cancel)
+        child.queue = self.queue
+        child.parent = self
+        child.index = index
+        child.seq_id = seq_id
+        child.prompt_tokens = self.prompt_tokens
+        child.n_prefilled = self.n_prefilled
+        child.n_past = self.n_past
+        child.logits_index = self.logits_index
+        child.sampler.prev = list(self.prompt_tokens)
+        return child
+
+    def emit(self, item) -> None:
+        """Hand an item to the waiting coroutine (thread-safe)."""
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+        except RuntimeError:
+            # Event loop closed; the consumer is gone
+            self.cancelled = True
+
+
+class ContinuousBatchingEngine:
+    """
+    Token-level scheduler over a dedicated llama.cpp context.
+
+    The engine creates its own context on the loaded model's weights with
+    room for ``max_sequences`` sequences of ``n_ctx_per_sequence`` tokens.
+    A background thread repeatedly builds one batch containing the next
+    token of every decoding sequence plus prompt chunks of sequences still
+    being prefilled, runs ``llama_decode`` once, and samples per sequence.
+    """
+
+    def __init__(
+        self,
+        model: Llama,
+        max_sequences: int = 8,
+        n_ctx_per_sequence: int = 2048,
+        n_batch: int = 512,
+        prefill_chunk: int = 128,
+        cpus: Optional[FrozenSet[int]] = None,
+    ):
+        """
+        Initialize the engine and start its decode thread.
+
+        Args:
+            model: Loaded Llama model whose weights the engine shares
+            max_sequences: Maximum sequences decoded together
+            n_ctx_per_sequence: Context window available to each sequence
+            n_batch: Maximum tokens submitted per decode step
+            prefill_chunk: Maximum prompt tokens per sequence per step
+            cpus: CPUs the decode thread is pinned to (None = any CPU)
+        """
+        self.model = model
+        self.max_sequences = max_sequences
+        self.n_ctx_per_sequence = n_ctx_per_sequence
+        self.n_batch = n_batch
+        self.prefill_chunk = min(prefill_chunk, n_batch)
+        self.cpus = cpus
+
+        params = type(model.context_params).from_buffer_copy(model.context_params)
+        params.n_ctx = n_ctx_per_sequence * max_sequences
+        params.n_batch = n_batch
+        params.n_seq_max = max_sequences
+        params.logits_all = False
+
+        self._ctx = _LlamaContext(model=model._model, params=params, verbose=model.verbose)
+        self._batch = _LlamaBatch(n_tokens=n_batch, embd=0, n_seq_max=1, verbose=model.verbose)
+
+        self._free_seq_ids: Deque[int] = deque(range(max_sequences))
+        self._n_vocab = model.n_vocab()
+        self._pending: Deque[_Sequence] = deque()
+        self._active: List[_Sequence] = []
+        self._cond = threading.Condition()
+        self._running = True
+
+        self._thread = threading.Thread(target=self._run, name="batch-engine", daemon=True)
+        self._thread.start()
+
+        logger.info(
+            f"Continuous batching engine started: sequences={max_sequences}, "
+            f"n_ctx={params.n_ctx}, n_batch={n_batch}, prefill_chunk={self.prefill_chunk}"
+        )
+
+    # ------------------------------------------------------------------
+    # Engine thread
+    # ------------------------------------------------------------------
+
+    def _run(self) -> None:
+        """Decode loop: admit, build one batch, decode, sample, repeat."""
+        pin_current_thread(self.cpus)
+        while True:
+            with self._cond:
+                while self._running and not self._pending and not self._active:
+                    self._cond.wait()
+                if not self._running:
+                    break
+                admitted = self._admit()
+
+            for seq in admitted:
+                self._prepare(seq)
+
+            self._drop_cancelled()
+            if not self._active:
+                continue
+
+            try:
+                self._step()
+            except Exception as e:
+                logger.error(f"Batch decode failed: {e}", exc_info=True)
+                for seq in list(self._active):
+                    seq.emit(_Failure(e))
+                    self._retire(seq)
+
+        for seq in list(self._active) + list(self._pending):
+            seq.emit(_Failure(RuntimeError("Batching engine stopped")))
+        self._active.clear()
+        self._pending.clear()
+
+    def _admit(self) -> List[_Sequence]:
+        """
+        Move pending sequences into free slots (caller holds the condition).
+
+        A multi-choice request is admitted only once a slot is free for
+        every choice, and keeps its place at the head of the queue.
+        """
+        admitted = []
+        while self._pending:
+            seq = self._pending[0]
+            if seq.cancelled:
+                self._pending.popleft()
+                continue
+            if len(self._free_seq_ids) < seq.choices:
+                break
+            self._pending.popleft()
+            seq.seq_id = self._free_seq_ids.popleft()
+            seq.reserved = [self._free_seq_ids.popleft() for _ in range(seq.choices - 1)]
+            admitted.append(seq)
+        return admitted
+
+    def _prepare(self, seq: _Sequence) -> None:
+        """Tokenize the prompt (unless given as ids) and activate the sequence."""
+        try:
+            if isinstance(seq.prompt, list):
+                seq.prompt_tokens = list(seq.prompt)
+            else:
+                seq.prompt_tokens = self.model.tokenize(seq.prompt.encode(), add_bos=True, special=True)
+        except Exception as e:
+            seq.emit(_Failure(e))
+            self._release_seq_id(seq)
+            return
+
+        if len(seq.prompt_tokens) + seq.max_tokens > self.n_ctx_per_sequence:
+            seq.emit(_Failure(ValueError("Prompt exceeds context length")))
+            self._release_seq_id(seq)
+            return
+
+        # Repetition penalties look back over the prompt as well
+        seq.sampler.prev = list(seq.prompt_tokens)
+        self._active.append(seq)
+
+    def _drop_cancelled(self) -> None:
+        for seq in [s for s in self._active if s.abandoned]:
+            logger.debug(f"Dropping cancelled sequence {seq.seq_id} after {seq.n_generated} tokens")
+            self._retire(seq)
+        # Requests cancelled or past their deadline end with what they have so far
+        for seq in [s for s in self._active if s.cancel is not None and s.cancel.cancelled]:
+            logger.debug(f"Stopping sequence {seq.seq_id} ({seq.cancel.reason}) after {seq.n_generated} tokens")
+            self._finish(seq, "cancelled")
+
+    def _step(self) -> None:
+        """Run one decode step over all active sequences."""
+        self._batch.reset()
+        batch = self._batch.batch
+        n = 0
+
+        # Decoding sequences contribute exactly one token each
+        for seq in self._active:
+            if seq.prefilling:
+                continue
+            self._add(batch, n, seq.last_token, seq.n_past, seq.seq_id, True)
+            seq.logits_index = n
+            seq.n_past += 1
+            n += 1
+
+        # Remaining room goes to prompt chunks, so prefill never starves decode
+        for seq in self._active:
+            if not seq.prefilling:
+                continue
+            room = min(self.n_batch - n, self.prefill_chunk)
+            if room <= 0:
+                break
+            chunk = seq.prompt_tokens[seq.n_prefilled:seq.n_prefilled + room]
+            for token in chunk:
+                seq.n_prefilled += 1
+                is_last = not seq.prefilling
+                self._add(batch, n, token, seq.n_past, seq.seq_id, is_last)
+                if is_last:
+                    seq.logits_index = n
+                seq.n_past += 1
+                n += 1
+
+        batch.n_tokens = n
+        self._ctx.decode(self._batch)
+
+        # Prompts of multi-choice requests are evaluated now: fork the other choices
+        for seq in [s for s in self._active if s.reserved and s.logits_index is not None]:
+            self._fork(seq)
+
+        normalizers: Dict[int, float] = {}
+        for seq in list(self._active):
+            if seq.logits_index is None:
+                continue
+            index, seq.logits_index = seq.logits_index, None
+            token = seq.sampler.sample(ctx_main=self._ctx, idx=index)
+            seq.sampler.accept(self._ctx, token, False)
+            if seq.choices > 1 or seq.parent is not None:
+                seq.logprob += self._logprob(index, token, normalizers)
+            self._advance(seq, token)
+
+    def _fork(self, seq: _Sequence) -> None:
+        """Copy a sequence's prompt KV cells into its reserved seq ids, one new sequence each."""
+        for index, seq_id in enumerate(seq.reserved, start=1):
+            self._ctx.kv_cache_seq_cp(seq.seq_id, seq_id, -1, -1)
+            self._active.append(seq.fork(seq_id, index))
+        seq.reserved = []
+
+    def _logprob(self, index: int, token: int, normalizers: Dict[int, float]) -> float:
+        """Log probability of ``token`` under the logits at batch position ``index``."""
+        logits = np.ctypeslib.as_array(self._ctx.get_logits_ith(index), shape=(self._n_vocab,))
+        normalizer = normalizers.get(index)
+        if normalizer is None:
+            normalizer = normalizers[index] = log_normalizer(logits)
+        return float(logits[token]) - normalizer
+
+    @staticmethod
+    def _add(batch, index: int, token: int, pos: int, seq_id: int, logits: bool) -> None:
+        batch.token[index] = token
+        batch.pos[index] = pos
+        batch.n_seq_id[index] = 1
+        batch.seq_id[index][0] = seq_id
+        batch.logits[index] = logits
+
+    def _advance(self, seq: _Sequence, token: int) -> None:
+        """Deliver a sampled token and decide whether the sequence is done."""
+        if llama_cpp.llama_token_is_eog(self.model._model.model, token):
+            self._finish(seq, "stop")
+            return
+
+        seq.n_generated += 1
+        text = seq.decoder.decode(self.model.detokenize([token]))
+        seq.emit({
+            "token": text,
+            "index": seq.index,
+            "tokens_so_far": seq.n_generated,
+            "timestamp": time.time(),
+        })
+
+        if seq.n_generated >= seq.max_tokens or seq.n_past + 1 >= self.n_ctx_per_sequence:
+            self._finish(seq, "length")
+        else:
+            seq.last_token = token
+
+    def _finish(self, seq: _Sequence, finish_reason: str) -> None:
+        seq.emit(_Finished(finish_reason, len(seq.prompt_tokens), seq.n_generated, seq.index, seq.logprob))
+        # Choices that were never forked end together with their parent
+        for index in range(1, len(seq.reserved) + 1):
+            seq.emit(_Finished(finish_reason, len(seq.prompt_tokens), 0, index))
+        self._retire(seq)
+
+    def _retire(self, seq: _Sequence) -> None:
+        """Remove a sequence from the batch and free its KV cells."""
+        if seq in self._active:
+            self._active.remove(seq)
+        self._ctx.kv_cache_seq_rm(seq.seq_id, -1, -1)
+        self._release_seq_id(seq)
+
+    def _release_seq_id(self, seq: _Sequence) -> None:
+        with self._cond:
+            self._free_seq_ids.append(seq.seq_id)
+            self._free_seq_ids.extend(seq.reserved)
+            seq.reserved = []
+
+    # ------------------------------------------------------------------
+    # Event loop API
+    # ------------------------------------------------------------------
+
+    def _submit(self, seq: _Sequence) -> None:
+        with self._cond:
+            if not self._running:
+                raise RuntimeError("Batching engine is stopped")
+            self._pending.append(seq)
+            self._cond.notify()
+
+    async def _events(self, seq: _Sequence) -> AsyncGenerator[object, None]:
+        """Yield token dicts and final summaries of a submitted sequence and its forked choices."""
+        self._submit(seq)
+        finished = 0
+        try:
+            while True:
+                item = await seq.queue.get()
+                if isinstance(item, _Failure):
+                    raise item.error
+                yield item
+                if isinstance(item, _Finished):
+                    finished += 1
+                    if finished == seq.choices:
+                        return
+        finally:
+            # Frees the slot at the next step if the consumer left early
+            seq.cancelled = True
+
+    async def generate_completion(
+        self,
+        prompt: Union[str, List[int]],
+        max_tokens: int = 128,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        top_k: int = 40,
+        repeat_penalty: float = 1.1,
+        seed: Optional[int] = None,
+        stream: bool = False,
+        cancel: Optional[CancelToken] = None,
+        choices: int = 1,
+    ):
+        """
+        Generate a completion as part of the shared decode batch.
+
+        Mirrors ``InferenceEngine.generate_completion``: returns a result
+        dictionary, or an async generator of token dictionaries when
+        ``stream`` is True. A cancelled ``cancel`` token ends the sequence
+        at the next decode step with finish reason ``cancelled``.
+        ``seed`` is accepted for interface parity but not applied: all
+        sequences sample from the engine context's shared generator.
+        With ``choices`` > 1 the prompt is evaluated once and forked into
+        that many sequences; tokens carry their choice ``index`` and the
+        result lists every choice with its cumulative ``logprob``.
+        """
+        if choices > self.max_sequences:
+            raise ValueError(f"At most {self.max_sequences} choices per request with continuous batching")
+        sampling = _LlamaSamplingParams(
+            temp=temperature,
+            top_p=top_p,
+            top_k=top_k,
+            penalty_repeat=repeat_penalty,
+        )
+        seq = _Sequence(prompt, max_tokens, sampling, asyncio.get_running_loop(), cancel, choices)
+
+        if stream:
+            return self._stream(seq)
+
+        start_time = time.time()
+        pieces: List[List[str]] = [[] for _ in range(choices)]
+        finished: Dict[int, _Finished] = {}
+        first_token = None
+        async for item in self._events(seq):
+            if isinstance(item, _Finished):
+                finished[item.index] = item
+            else:
+                pieces[item["index"]].append(item["token"])
+                if first_token is None:
+                    first_token = item["timestamp"]
+        elapsed = time.time() - start_time
+
+        completion_tokens = sum(item.completion_tokens for item in finished.values())
+        result = {
+            "text": "".join(pieces[0]),
+            "tokens_used": completion_tokens,
+            "total_tokens": finished[0].prompt_tokens + completion_tokens,
+            "elapsed_seconds": elapsed,
+            "tokens_per_second": completion_tokens / elapsed if elapsed > 0 else 0,
+            "finish_reason": finished[0].finish_reason,
+            "first_token_seconds": first_token - start_time if first_token is not None else None,
+        }
+        if choices > 1:
+            result["choices"] = [
+                {
+                    "index": index,
+                    "text": "".join(pieces[index]),
+                    "tokens_used": finished[index].completion_tokens,
+                    "finish_reason": finished[index].finish_reason,
+                    "logprob": finished[index].logprob,
+                }
+                for index in range(choices)
+            ]
+
+        logger.info(
+            f"Batched completion finished: {result['tokens_used']} tokens in {elapsed:.2f}s "
+            f"({result['tokens_per_second']:.2f} tok/s)"
+        )
+        return result
+
+    async def _stream(self, seq: _Sequence) -> AsyncGenerator[dict, None]:
+        async for item in self._events(seq):
+            if isinstance(item, _Finished):
+                yield {
+                    "token": "",
+                    "index": item.index,
+                    "tokens_so_far": item.completion_tokens,
+                    "timestamp": time.time(),
+                    "finish_reason": item.finish_reason,
+                }
+            else:
+                yield item
+
+    def close(self) -> None:
+        """Stop the decode thread and free the engine's context."""
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._thread.join()
+        self._batch.close()
+        self._ctx.close()
+        logger.info("Continuous batching engine stopped")
+
+
+class BatchEngineRegistry:
+    """One continuous batching engine per loaded model replica."""
+
+    def __init__(self):
+        self._engines: Dict[str, List[ContinuousBatchingEngine]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_name: str, model: Llama) -> ContinuousBatchingEngine:
+        """Return the engine for a model replica, creating it on first use."""
+        with self._lock:
+            engines = self._engines.setdefault(model_name, [])
+            for engine in engines:
+                if engine.model is model:
+                    return engine
+
+            engine = ContinuousBatchingEngine(
+                model,
+                max_sequences=settings.batch_max_sequences,
+                n_ctx_per_sequence=settings.context_length,
+                n_batch=settings.batch_size,
+                prefill_chunk=settings.batch_prefill_chunk,
+                cpus=inference_executor.affinity(model),
+            )
+            engines.append(engine)
+            return engine
+
+    def find(self, model_name: str, model: Llama) -> Optional[ContinuousBatchingEngine]:
+        """Return the running engine for a model replica without creating one."""
+        with self._lock:
+            for engine in self._engines.get(model_name, []):
+                if engine.model is model:
+                    return engine
+            return None
+
+    def close(self, model_name: str, model: Optional[Llama] = None) -> None:
+        """Stop the engines for a model, or only the one serving ``model``."""
+        with self._lock:
+            engines = self._engines.get(model_name, [])
+            closing = [e for e in engines if model is None or e.model is model]
+            remaining = [e for e in engines if e not in closing]
+            if remaining:
+                self._engines[model_name] = remaining
+            else:
+                self._engines.pop(model_name, None)
+        for engine in closing:
+            engine.close()
+
+    def close_all(self) -> None:
+        """Stop all engines."""
+        with self._lock:
+            engines = [e for group in self._engines.values() for e in group]
+            self._engines.clear()
+        for engine in engines:
+            engine.close()
+
+
+batch_engines = BatchEngineRegistry()
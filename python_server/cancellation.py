@@ -0,0 +1,156 @@
+"""
+Cooperative cancellation of in-flight generations.
+
+Each generation request gets a ``CancelToken``. The decode loops (the
+per-request llama generator through its stopping criteria, the batching
+engine once per step, worker processes through a cancel message) check
+it once per token, so a generation stops within one token after the
+client disconnects, its deadline passes, or it is cancelled explicitly
+through ``POST /v1/requests/{id}/cancel``.
+"""
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Cancellation reasons
+DISCONNECT, DEADLINE, CLIENT = "disconnect", "deadline", "cancelled"
+
+
+class CancelToken:
+    """Cancellation flag and deadline for one request, safe to check from any thread."""
+
+    def __init__(self, request_id: str, max_tokens: int, timeout: Optional[float] = None):
+        """
+        Initialize the token.
+
+        Args:
+            request_id: Request the token belongs to
+            max_tokens: Token budget of the request, for the tokens-saved metric
+            timeout: Seconds until the request's deadline (None = no deadline)
+        """
+        self.request_id = request_id
+        self.max_tokens = max_tokens
+        self.deadline = time.monotonic() + timeout if timeout is not None else None
+        self.reason: Optional[str] = None
+        self.generated = 0
+        self._event = threading.Event()
+        self._callbacks: List[Callable[[str], None]] = []
+
+    def cancel(self, reason: str = CLIENT) -> bool:
+        """
+        Cancel the request; callbacks run on the calling thread.
+
+        Returns:
+            False if it was already cancelled
+        """
+        if self._event.is_set():
+            return False
+        self.reason = reason
+        self._event.set()
+        for callback in self._callbacks:
+            try:
+                callback(reason)
+            except Exception as e:
+                logger.warning(f"Cancel callback for {self.request_id} failed: {e}")
+        return True
+
+    def on_cancel(self, callback: Callable[[str], None]) -> None:
+        """Register ``callback(reason)`` to run when the request is cancelled."""
+        self._callbacks.append(callback)
+
+    @property
+    def cancelled(self) -> bool:
+        """Whether the request was cancelled or its deadline has passed."""
+        if self._event.is_set():
+            return True
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel(DEADLINE)
+            return True
+        return False
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left before the deadline, or None without one."""
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+    def __call__(self, input_ids: Any, logits: Any) -> bool:
+        """``llama_cpp`` stopping criterion: stop sampling once cancelled."""
+        return self.cancelled
+
+
+class RequestRegistry:
+    """In-flight generation requests, addressable by id, with cancellation counters."""
+
+    def __init__(self):
+        self.active: Dict[str, CancelToken] = {}
+        self.cancelled: Dict[str, int] = {DISCONNECT: 0, DEADLINE: 0, CLIENT: 0}
+        self.tokens_saved = 0
+
+    def open(self, request_id: str, max_tokens: int, timeout: Optional[float] = None) -> CancelToken:
+        """Register a request and return its token."""
+        token = CancelToken(request_id, max_tokens, timeout)
+        self.active[request_id] = token
+        return token
+
+    def close(self, token: CancelToken) -> None:
+        """
+        Unregister a finished request (idempotent).
+
+        A cancelled request counts the tokens of its budget it never had
+        to generate as saved.
+        """
+        if self.active.get(token.request_id) is not token:
+            return
+        del self.active[token.request_id]
+        if token.reason is not None:
+            self.cancelled[token.reason] = self.cancelled.get(token.reason, 0) + 1
+            saved = max(0, token.max_tokens - token.generated)
+            self.tokens_saved += saved
+            metrics.tokens_saved.labels(token.reason).inc(saved)
+            logger.info(
+                f"Request {token.request_id} cancelled ({token.reason}) after "
+                f"{token.generated} tokens; {saved} tokens saved"
+            )
+
+    def cancel(self, request_id: str, reason: str = CLIENT) -> bool:
+        """
+        Cancel an in-flight request by id.
+
+        Returns:
+            False if no such request is running
+        """
+        token = self.active.get(request_id)
+        if token is None:
+            return False
+        token.cancel(reason)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": len(self.active),
+            "cancelled": dict(self.cancelled),
+            "tokens_saved": self.tokens_saved,
+        }
+
+
+async def watch_disconnect(receive: Callable, token: CancelToken) -> None:
+    """
+    Cancel ``token`` when the client disconnects.
+
+    For non-streaming endpoints, whose request body has already been
+    read: the next ASGI message is ``http.disconnect``.
+    """
+    while not token.cancelled:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            token.cancel(DISCONNECT)
+            return
+
+
+# Global registry instance
+request_registry = RequestRegistry()
@@ -0,0 +1,347 @@
+"""
+GGUF model catalog.
+
+Parses GGUF headers through mmap, without loading weights, to describe
+each model in the model directory: architecture, parameter count,
+quantization, trained context length, vocabulary size, chat template and
+the per-token KV cache size needed for memory sizing before a load.
+Results are cached in an index that is refreshed only when the directory
+or a file's (inode, size, mtime) changes.
+"""
+
+import logging
+import mmap
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+GGUF_MAGIC = b"GGUF"
+
+# GGUF metadata value types
+_UINT8, _INT8, _UINT16, _INT16, _UINT32, _INT32, _FLOAT32, _BOOL, _STRING, _ARRAY, _UINT64, _INT64, _FLOAT64 = range(13)
+
+_SCALARS = {
+    _UINT8: struct.Struct("<B"),
+    _INT8: struct.Struct("<b"),
+    _UINT16: struct.Struct("<H"),
+    _INT16: struct.Struct("<h"),
+    _UINT32: struct.Struct("<I"),
+    _INT32: struct.Struct("<i"),
+    _FLOAT32: struct.Struct("<f"),
+    _BOOL: struct.Struct("<?"),
+    _UINT64: struct.Struct("<Q"),
+    _INT64: struct.Struct("<q"),
+    _FLOAT64: struct.Struct("<d"),
+}
+_U32 = struct.Struct("<I")
+_U64 = struct.Struct("<Q")
+
+# Arrays longer than this (token lists, merges, scores) are skipped, keeping only their length
+MAX_ARRAY_ITEMS = 64
+
+# llama_ftype values stored in general.file_type
+FILE_TYPES = {
+    0: "F32", 1: "F16", 2: "Q4_0", 3: "Q4_1", 7: "Q8_0", 8: "Q5_0", 9: "Q5_1",
+    10: "Q2_K", 11: "Q3_K_S", 12: "Q3_K_M", 13: "Q3_K_L", 14: "Q4_K_S", 15: "Q4_K_M",
+    16: "Q5_K_S", 17: "Q5_K_M", 18: "Q6_K", 19: "IQ2_XXS", 20: "IQ2_XS", 21: "Q2_K_S",
+    22: "IQ3_XS", 23: "IQ3_XXS", 24: "IQ1_S", 25: "IQ4_NL", 26: "IQ3_S", 27: "IQ3_M",
+    28: "IQ2_S", 29: "IQ2_M", 30: "IQ4_XS", 31: "IQ1_M", 32: "BF16",
+}
+
+# ggml tensor types, used when general.file_type is missing
+TENSOR_TYPES = {
+    0: "F32", 1: "F16", 2: "Q4_0", 3: "Q4_1", 6: "Q5_0", 7: "Q5_1", 8: "Q8_0", 9: "Q8_1",
+    10: "Q2_K", 11: "Q3_K", 12: "Q4_K", 13: "Q5_K", 14: "Q6_K", 15: "Q8_K", 16: "IQ2_XXS",
+    17: "IQ2_XS", 18: "IQ3_XXS", 19: "IQ1_S", 20: "IQ4_NL", 21: "IQ3_S", 22: "IQ2_S",
+    23: "IQ4_XS", 24: "I8", 25: "I16", 26: "I32", 27: "I64", 28: "F64", 29: "IQ1_M", 30: "BF16",
+}
+
+# Bytes per KV cache element (llama.cpp defaults to an f16 KV cache)
+KV_ELEMENT_BYTES = 2
+
+
+class _ArrayInfo:
+    """Placeholder for a metadata array too long to materialize."""
+
+    def __init__(self, item_type: int, length: int):
+        self.item_type = item_type
+        self.length = length
+
+
+class _Reader:
+    """Sequential little-endian reader over a memory-mapped GGUF file."""
+
+    def __init__(self, buffer: mmap.mmap):
+        self.buffer = buffer
+        self.offset = 0
+
+    def scalar(self, fmt: struct.Struct):
+        value = fmt.unpack_from(self.buffer, self.offset)[0]
+        self.offset += fmt.size
+        return value
+
+    def string(self) -> str:
+        length = self.scalar(_U64)
+        value = self.buffer[self.offset:self.offset + length].decode("utf-8", errors="replace")
+        self.offset += length
+        return value
+
+    def skip_string(self) -> None:
+        length = self.scalar(_U64)
+        self.offset += length
+
+    def value(self, value_type: int) -> Any:
+        if value_type == _STRING:
+            return self.string()
+        if value_type == _ARRAY:
+            item_type = self.scalar(_U32)
+            length = self.scalar(_U64)
+            if length > MAX_ARRAY_ITEMS:
+                self.skip_array(item_type, length)
+                return _ArrayInfo(item_type, length)
+            return [self.value(item_type) for _ in range(length)]
+        fmt = _SCALARS.get(value_type)
+        if fmt is None:
+            raise ValueError(f"unknown GGUF value type {value_type}")
+        return self.scalar(fmt)
+
+    def skip_array(self, item_type: int, length: int) -> None:
+        fmt = _SCALARS.get(item_type)
+        if fmt is not None:
+            self.offset += fmt.size * length
+        elif item_type == _STRING:
+            for _ in range(length):
+                self.skip_string()
+        else:
+            for _ in range(length):
+                self.value(item_type)
+
+
+def read_gguf_header(path: Path) -> Tuple[Dict[str, Any], List[Tuple[str, List[int], int]]]:
+    """
+    Read metadata and tensor descriptors from a GGUF file.
+
+    Only the header pages are touched; tensor data is never read.
+
+    Returns:
+        (metadata key/values, [(tensor name, shape, ggml type)])
+
+    Raises:
+        ValueError: The file is not a supported GGUF file
+    """
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        if buffer[:4] != GGUF_MAGIC:
+            raise ValueError("not a GGUF file")
+        reader = _Reader(buffer)
+        reader.offset = 4
+        version = reader.scalar(_U32)
+        if version < 2:
+            raise ValueError(f"unsupported GGUF version {version}")
+        n_tensors = reader.scalar(_U64)
+        n_kv = reader.scalar(_U64)
+
+        metadata: Dict[str, Any] = {"GGUF.version": version}
+        for _ in range(n_kv):
+            key = reader.string()
+            metadata[key] = reader.value(reader.scalar(_U32))
+
+        tensors = []
+        for _ in range(n_tensors):
+            name = reader.string()
+            n_dims = reader.scalar(_U32)
+            shape = [reader.scalar(_U64) for _ in range(n_dims)]
+            tensor_type = reader.scalar(_U32)
+            reader.scalar(_U64)  # data offset
+            tensors.append((name, shape, tensor_type))
+
+    return metadata, tensors
+
+
+class ModelMetadata:
+    """Catalog entry for one GGUF file."""
+
+    def __init__(self, path: Path, stat_key: Tuple[int, int, int], created: int):
+        self.path = path
+        self.name = path.name
+        self.stat_key = stat_key
+        self.size_bytes = stat_key[1]
+        self.created = created
+        self.architecture: Optional[str] = None
+        self.display_name: Optional[str] = None
+        self.parameter_count: Optional[int] = None
+        self.quantization: Optional[str] = None
+        self.context_length: Optional[int] = None
+        self.vocab_size: Optional[int] = None
+        self.chat_template: Optional[str] = None
+        self.kv_bytes_per_token: Optional[int] = None
+        self.error: Optional[str] = None
+
+    @classmethod
+    def from_file(cls, path: Path) -> "ModelMetadata":
+        stat = path.stat()
+        entry = cls(path, (stat.st_ino, stat.st_size, stat.st_mtime_ns), int(stat.st_mtime))
+        try:
+            metadata, tensors = read_gguf_header(path)
+        except (OSError, ValueError, struct.error) as e:
+            logger.warning(f"Could not read GGUF header of {path.name}: {e}")
+            entry.error = str(e)
+            return entry
+        entry._describe(metadata, tensors)
+        return entry
+
+    def _describe(self, metadata: Dict[str, Any], tensors: List[Tuple[str, List[int], int]]) -> None:
+        arch = metadata.get("general.architecture")
+        self.architecture = arch
+        self.display_name = metadata.get("general.name")
+        self.chat_template = metadata.get("tokenizer.chat_template")
+        self.context_length = metadata.get(f"{arch}.context_length")
+
+        tokens = metadata.get("tokenizer.ggml.tokens")
+        vocab_size = metadata.get(f"{arch}.vocab_size")
+        if vocab_size is None and tokens is not None:
+            vocab_size = tokens.length if isinstance(tokens, _ArrayInfo) else len(tokens)
+        self.vocab_size = vocab_size
+
+        parameter_count = 0
+        type_counts: Dict[int, int] = {}
+        for _, shape, tensor_type in tensors:
+            elements = 1
+            for dim in shape:
+                elements *= dim
+            parameter_count += elements
+            type_counts[tensor_type] = type_counts.get(tensor_type, 0) + elements
+        self.parameter_count = parameter_count or None
+
+        file_type = metadata.get("general.file_type")
+        if file_type in FILE_TYPES:
+            self.quantization = FILE_TYPES[file_type]
+        elif type_counts:
+            dominant = max(type_counts, key=type_counts.get)
+            self.quantization = TENSOR_TYPES.get(dominant, f"type{dominant}")
+
+        self.kv_bytes_per_token = self._kv_bytes_per_token(metadata, arch)
+
+    @staticmethod
+    def _kv_bytes_per_token(metadata: Dict[str, Any], arch: Optional[str]) -> Optional[int]:
+        """K and V cache bytes one token occupies across all layers."""
+        n_layer = metadata.get(f"{arch}.block_count")
+        n_embd = metadata.get(f"{arch}.embedding_length")
+        n_head = metadata.get(f"{arch}.attention.head_count")
+        if not n_layer or not n_embd or not n_head:
+            return None
+        n_head = max(n_head) if isinstance(n_head, list) else n_head
+        n_head_kv = metadata.get(f"{arch}.attention.head_count_kv", n_head)
+        n_head_kv = max(n_head_kv) if isinstance(n_head_kv, list) else n_head_kv
+        key_length = metadata.get(f"{arch}.attention.key_length", n_embd // n_head)
+        value_length = metadata.get(f"{arch}.attention.value_length", n_embd // n_head)
+        return n_layer * n_head_kv * (key_length + value_length) * KV_ELEMENT_BYTES
+
+    def kv_cache_bytes(self, n_ctx: int) -> Optional[int]:
+        """Estimated KV cache size for a context of ``n_ctx`` tokens."""
+        if self.kv_bytes_per_token is None:
+            return None
+        return self.kv_bytes_per_token * n_ctx
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "size_bytes": self.size_bytes,
+            "created": self.created,
+            "architecture": self.architecture,
+            "display_name": self.display_name,
+            "parameter_count": self.parameter_count,
+            "quantization": self.quantization,
+            "context_length": self.context_length,
+            "vocab_size": self.vocab_size,
+            "chat_template": self.chat_template,
+            "kv_bytes_per_token": self.kv_bytes_per_token,
+            "error": self.error,
+        }
+
+
+class ModelCatalog:
+    """
+    Index of GGUF files in the model directory.
+
+    Listing is served from memory. The directory is rescanned when its
+    mtime changes (files added, removed or renamed) or at most every
+    ``refresh_interval`` seconds (files rewritten in place); headers are
+    re-parsed only for files whose (inode, size, mtime) changed.
+    """
+
+    def __init__(self, model_dir: Path, refresh_interval: float = 10.0):
+        """
+        Initialize the catalog.
+
+        Args:
+            model_dir: Directory containing GGUF models
+            refresh_interval: Maximum age in seconds of the cached file stats
+        """
+        self.model_dir = Path(model_dir)
+        self.refresh_interval = refresh_interval
+        self._entries: Dict[str, ModelMetadata] = {}
+        self._dir_mtime: Optional[int] = None
+        self._scanned_at = 0.0
+        self._lock = threading.Lock()
+
+    def _stale(self) -> bool:
+        if time.monotonic() - self._scanned_at >= self.refresh_interval:
+            return True
+        try:
+            return self.model_dir.stat().st_mtime_ns != self._dir_mtime
+        except OSError:
+            return self._dir_mtime is not None
+
+    def _scan(self) -> None:
+        """Refresh the index from the directory (lock held)."""
+        try:
+            dir_mtime = self.model_dir.stat().st_mtime_ns
+            paths = sorted(self.model_dir.glob("*.gguf"))
+        except OSError:
+            self._entries = {}
+            self._dir_mtime = None
+            self._scanned_at = time.monotonic()
+            return
+
+        entries = {}
+        for path in paths:
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            previous = self._entries.get(path.name)
+            if previous is not None and previous.stat_key == (stat.st_ino, stat.st_size, stat.st_mtime_ns):
+                entries[path.name] = previous
+            else:
+                entries[path.name] = ModelMetadata.from_file(path)
+
+        added = entries.keys() - self._entries.keys()
+        if added:
+            logger.info(f"Model catalog indexed {len(added)} new GGUF file(s)")
+        self._entries = entries
+        self._dir_mtime = dir_mtime
+        self._scanned_at = time.monotonic()
+
+    def list(self) -> List[ModelMetadata]:
+        """All indexed models, refreshing the index only when it is stale."""
+        with self._lock:
+            if self._stale():
+                self._scan()
+            return list(self._entries.values())
+
+    def get(self, model_name: str) -> Optional[ModelMetadata]:
+        """Metadata for one model file, or None if it is not in the directory."""
+        with self._lock:
+            if self._stale() or model_name not in self._entries:
+                self._scan()
+            return self._entries.get(model_name)
+
+
+# Global catalog instance
+model_catalog = ModelCatalog(Path(settings.model_path), settings.catalog_refresh_seconds)
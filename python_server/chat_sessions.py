@@ -0,0 +1,448 @@
+"""
+Stateful chat sessions that keep llama state between turns.
+
+A chat request carrying a ``session_id`` binds that id to the llama state
+its generation ends in. The next turn of the session restores that state
+before evaluating, so only the tokens after the shared prefix (normally
+the new messages) are evaluated instead of the whole history. When the
+history no longer matches the saved tokens, only the matching prefix is
+reused and the rest is evaluated as usual.
+
+Resident states share one byte budget across all models and are evicted
+least-recently-used. Evicted states, and states idle for
+``chat_session_idle_seconds``, are spilled to ``cache_dir/sessions`` as
+KV snapshot files and mapped back on the session's next turn.
+"""
+
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from llama_cpp import Llama
+from llama_cpp.llama import LlamaState
+
+from .config import settings
+from .kv_store import (
+    SNAPSHOT_SUFFIX,
+    compact_state,
+    model_fingerprint,
+    read_snapshot,
+    read_snapshot_header,
+    write_snapshot,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _common_length(a: Sequence[int], b: Sequence[int]) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+class _Session:
+    """A resident session state."""
+
+    def __init__(self, session_id: str, fingerprint: str, state: LlamaState, prompt_tokens: Optional[int] = None):
+        self.session_id = session_id
+        self.fingerprint = fingerprint
+        self.state = state
+        # Leading tokens of the state that were the turn's prompt; the rest were generated
+        self.prompt_tokens = prompt_tokens
+        self.size_bytes = state.llama_state_size + state.scores.nbytes + state.input_ids.nbytes
+        self.last_used = time.time()
+
+
+class _SpilledSession:
+    """Index entry for a session state on disk."""
+
+    def __init__(
+        self,
+        path: Path,
+        fingerprint: str,
+        size_bytes: int,
+        last_used: float,
+        prompt_tokens: Optional[int] = None,
+    ):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.size_bytes = size_bytes
+        self.last_used = last_used
+        self.prompt_tokens = prompt_tokens
+
+
+class ChatSessionStore:
+    """
+    Session id -> llama state, in memory under a byte budget with a disk tier.
+
+    ``restore`` and ``save`` run on the inference thread that owns the
+    model; writes to disk run on a dedicated spill thread, so neither the
+    event loop nor the model waits for them. A session being spilled stays
+    readable from memory until its file is written.
+    """
+
+    def __init__(
+        self,
+        memory_bytes: int,
+        disk_dir: Optional[Path] = None,
+        disk_max_bytes: int = 0,
+        idle_seconds: float = 300.0,
+        ttl: float = 0.0,
+    ):
+        """
+        Initialize the store.
+
+        Args:
+            memory_bytes: Budget for resident states across all models (0 disables sessions)
+            disk_dir: Directory for spilled states (None = evicted states are dropped)
+            disk_max_bytes: Size cap of the disk tier
+            idle_seconds: Idle time before a resident state is spilled
+            ttl: Seconds unused before a session is deleted (0 = never)
+        """
+        self.memory_bytes = memory_bytes
+        self.disk_dir = Path(disk_dir) if disk_dir is not None and disk_max_bytes > 0 else None
+        self.disk_max_bytes = disk_max_bytes
+        self.idle_seconds = idle_seconds
+        self.ttl = ttl
+        self._resident: "OrderedDict[str, _Session]" = OrderedDict()
+        self._resident_bytes = 0
+        self._spilling: Dict[str, _Session] = {}
+        # Disk index, built lazily from snapshot headers
+        self._disk: Optional[Dict[str, _SpilledSession]] = None
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self._spill_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-spill")
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.diverged = 0
+        self.reused_tokens = 0
+        self.spills = 0
+        self.evictions = 0
+        self.expired = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.memory_bytes > 0
+
+    def _expired(self, last_used: float, now: float) -> bool:
+        return self.ttl > 0 and now - last_used >= self.ttl
+
+    # ------------------------------------------------------------------
+    # Restore / save (inference thread)
+    # ------------------------------------------------------------------
+
+    def restore(self, model: Llama, session_id: str, prompt_tokens: Sequence[int]) -> Dict[str, Any]:
+        """
+        Load a session's saved state into ``model`` ahead of generation.
+
+        The state is loaded only when it shares a longer prefix with the
+        prompt than what the model's context already holds; generation
+        then evaluates from the end of the shared prefix. A history that
+        diverges from the saved tokens reuses just the matching part; it
+        counts as ``diverged`` only when it differs from the saved turn's
+        prompt, not from the sampled completion the state ends with (the
+        next turn carries that back as re-tokenized, stripped text).
+
+        Returns:
+            Session usage: the id, where the state came from (``memory``,
+            ``disk`` or None) and how many prompt tokens were reused
+        """
+        fingerprint = model_fingerprint(Path(model.model_path))
+        state, source, saved_prompt = self._find(session_id, fingerprint)
+        # llama-cpp-python always re-evaluates the final prompt token
+        resident = model.input_ids[:model.n_tokens].tolist()
+        current = min(_common_length(resident, prompt_tokens), len(prompt_tokens) - 1)
+        info = {"id": session_id, "restored": None, "reused_tokens": max(current, 0)}
+        if state is None:
+            return info
+
+        saved = state.input_ids[:state.n_tokens].tolist()
+        common = _common_length(saved, prompt_tokens)
+        matched = min(common, len(prompt_tokens) - 1)
+        with self._lock:
+            if saved_prompt is not None and common < min(saved_prompt, len(saved)):
+                self.diverged += 1
+        if matched > current:
+            model.load_state(state)
+            info["restored"] = source
+            info["reused_tokens"] = matched
+        with self._lock:
+            self.reused_tokens += info["reused_tokens"]
+        return info
+
+    def _find(
+        self, session_id: str, fingerprint: str
+    ) -> Tuple[Optional[LlamaState], Optional[str], Optional[int]]:
+        """The session's state for this model file, whether it came from memory or disk, and its prompt length."""
+        now = time.time()
+        with self._lock:
+            entry = self._resident.get(session_id) or self._spilling.get(session_id)
+            if entry is not None and entry.fingerprint == fingerprint and not self._expired(entry.last_used, now):
+                entry.last_used = now
+                if session_id in self._resident:
+                    self._resident.move_to_end(session_id)
+                self.hits += 1
+                return entry.state, "memory", entry.prompt_tokens
+
+            spilled = self._disk_index().get(session_id) if self.disk_dir is not None else None
+            if spilled is None or spilled.fingerprint != fingerprint:
+                self.misses += 1
+                return None, None, None
+            if self._expired(spilled.last_used, now):
+                self._disk_delete(session_id)
+                self.expired += 1
+                self.misses += 1
+                return None, None, None
+            try:
+                state = read_snapshot(spilled.path)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Dropping unreadable session state {spilled.path}: {e}")
+                self._disk_delete(session_id)
+                self.misses += 1
+                return None, None, None
+            spilled.last_used = now
+            self.disk_hits += 1
+            return state, "disk", spilled.prompt_tokens
+
+    def save(self, model: Llama, session_id: str, prompt_tokens: Optional[int] = None) -> None:
+        """
+        Bind the session to the model's current state, evicting least recently used ones over budget.
+
+        Args:
+            prompt_tokens: Length of the prompt the state's generation started from (None = unknown)
+        """
+        fingerprint = model_fingerprint(Path(model.model_path))
+        entry = _Session(session_id, fingerprint, compact_state(model.save_state()), prompt_tokens)
+        if entry.size_bytes > self.memory_bytes:
+            logger.debug(f"Session state of {entry.size_bytes} bytes exceeds session budget; not kept")
+            self.delete(session_id)
+            return
+
+        victims: List[_Session] = []
+        with self._lock:
+            self._spilling.pop(session_id, None)
+            previous = self._resident.pop(session_id, None)
+            if previous is not None:
+                self._resident_bytes -= previous.size_bytes
+            if self.disk_dir is not None and session_id in self._disk_index():
+                self._disk_delete(session_id)
+            self._resident[session_id] = entry
+            self._resident_bytes += entry.size_bytes
+            while self._resident_bytes > self.memory_bytes:
+                _, victim = self._resident.popitem(last=False)
+                self._resident_bytes -= victim.size_bytes
+                victims.append(victim)
+        for victim in victims:
+            self._spill_later(victim)
+
+    # ------------------------------------------------------------------
+    # Disk tier
+    # ------------------------------------------------------------------
+
+    def _spill_later(self, entry: _Session) -> None:
+        """Hand an entry leaving memory to the spill thread, or drop it without a disk tier."""
+        if self.disk_dir is None:
+            with self._lock:
+                self.evictions += 1
+            return
+        with self._lock:
+            self._spilling[entry.session_id] = entry
+        self._spill_pool.submit(self._spill, entry)
+
+    def _disk_path(self, session_id: str) -> Path:
+        name = hashlib.sha256(session_id.encode()).hexdigest()[:32]
+        return self.disk_dir / f"{name}{SNAPSHOT_SUFFIX}"
+
+    def _spill(self, entry: _Session) -> None:
+        """Write a session state to disk (spill thread)."""
+        path = self._disk_path(entry.session_id)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            size = write_snapshot(
+                path,
+                entry.state,
+                self.disk_max_bytes,
+                {
+                    "session": entry.session_id,
+                    "fingerprint": entry.fingerprint,
+                    "last_used": entry.last_used,
+                    "prompt_tokens": entry.prompt_tokens,
+                },
+            )
+        except OSError as e:
+            logger.warning(f"Could not spill session state to {path}: {e}")
+            size = None
+
+        with self._lock:
+            if self._spilling.get(entry.session_id) is not entry:
+                # Saved again or deleted while this write ran
+                if size is not None and entry.session_id not in self._disk_index():
+                    self._unlink(path)
+                return
+            del self._spilling[entry.session_id]
+            if size is None:
+                self.evictions += 1
+                return
+            index = self._disk_index()
+            previous = index.pop(entry.session_id, None)
+            if previous is not None:
+                self._disk_bytes -= previous.size_bytes
+            index[entry.session_id] = _SpilledSession(
+                path, entry.fingerprint, size, entry.last_used, entry.prompt_tokens
+            )
+            self._disk_bytes += size
+            self.spills += 1
+            while self._disk_bytes > self.disk_max_bytes:
+                oldest = min(
+                    (session_id for session_id in index if session_id != entry.session_id),
+                    key=lambda session_id: index[session_id].last_used,
+                    default=None,
+                )
+                if oldest is None:
+                    break
+                self._disk_delete(oldest)
+                self.evictions += 1
+
+    def _disk_index(self) -> Dict[str, _SpilledSession]:
+        """Spilled sessions by id (lock held)."""
+        if self._disk is None:
+            self._disk = {}
+            self._disk_bytes = 0
+            if self.disk_dir is not None and self.disk_dir.exists():
+                for path in self.disk_dir.glob(f"*{SNAPSHOT_SUFFIX}"):
+                    try:
+                        header, _ = read_snapshot_header(path)
+                        size = path.stat().st_size
+                        spilled = _SpilledSession(
+                            path, header["fingerprint"], size, header["last_used"], header.get("prompt_tokens")
+                        )
+                        self._disk[header["session"]] = spilled
+                    except (OSError, ValueError, KeyError) as e:
+                        logger.warning(f"Skipping unreadable session state {path}: {e}")
+                        continue
+                    self._disk_bytes += size
+        return self._disk
+
+    def _disk_delete(self, session_id: str) -> None:
+        """Remove a spilled session and its file (lock held)."""
+        spilled = self._disk_index().pop(session_id, None)
+        if spilled is not None:
+            self._disk_bytes -= spilled.size_bytes
+            self._unlink(spilled.path)
+
+    @staticmethod
+    def _unlink(path: Path) -> None:
+        try:
+            path.unlink()
+        except OSError as e:
+            # Still mapped by a restore in progress (e.g. on Windows); the next scan retries
+            logger.warning(f"Could not delete session state {path}: {e}")
+
+    # ------------------------------------------------------------------
+    # Maintenance
+    # ------------------------------------------------------------------
+
+    def delete(self, session_id: str) -> bool:
+        """Forget a session wherever its state lives; returns whether it existed."""
+        with self._lock:
+            found = self._spilling.pop(session_id, None) is not None
+            entry = self._resident.pop(session_id, None)
+            if entry is not None:
+                self._resident_bytes -= entry.size_bytes
+                found = True
+            if self.disk_dir is not None and session_id in self._disk_index():
+                self._disk_delete(session_id)
+                found = True
+        return found
+
+    def sweep(self) -> None:
+        """Delete expired sessions and spill resident ones idle past ``idle_seconds``."""
+        now = time.time()
+        idle: List[_Session] = []
+        with self._lock:
+            for session_id, entry in list(self._resident.items()):
+                if self._expired(entry.last_used, now):
+                    del self._resident[session_id]
+                    self._resident_bytes -= entry.size_bytes
+                    self.expired += 1
+                elif now - entry.last_used >= self.idle_seconds:
+                    del self._resident[session_id]
+                    self._resident_bytes -= entry.size_bytes
+                    idle.append(entry)
+            if self.disk_dir is not None:
+                for session_id, spilled in list(self._disk_index().items()):
+                    if self._expired(spilled.last_used, now):
+                        self._disk_delete(session_id)
+                        self.expired += 1
+        for entry in idle:
+            self._spill_later(entry)
+        if idle:
+            logger.info(f"Spilling {len(idle)} idle chat session(s) to disk")
+
+    async def sweep_periodically(self, interval: float) -> None:
+        """Run ``sweep`` every ``interval`` seconds until cancelled."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.sweep)
+            except Exception as e:
+                logger.error(f"Chat session sweep failed: {e}", exc_info=True)
+
+    def close(self) -> None:
+        """Spill every resident session so it survives the restart, then finish writing."""
+        with self._lock:
+            resident = list(self._resident.values())
+            self._resident.clear()
+            self._resident_bytes = 0
+        for entry in resident:
+            self._spill_later(entry)
+        self._spill_pool.shutdown(wait=True)
+
+    # ------------------------------------------------------------------
+    # Monitoring
+    # ------------------------------------------------------------------
+
+    def stats(self) -> Dict[str, Any]:
+        """Tier sizes and restore counters."""
+        with self._lock:
+            restores = self.hits + self.disk_hits
+            lookups = restores + self.misses
+            return {
+                "enabled": self.enabled,
+                "resident": len(self._resident),
+                "resident_bytes": self._resident_bytes,
+                "memory_bytes": self.memory_bytes,
+                "spilling": len(self._spilling),
+                "disk_sessions": len(self._disk) if self._disk is not None else None,
+                "disk_bytes": self._disk_bytes if self._disk is not None else None,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(restores / lookups, 4) if lookups else 0.0,
+                "diverged": self.diverged,
+                "reused_tokens": self.reused_tokens,
+                "spills": self.spills,
+                "evictions": self.evictions,
+                "expired": self.expired,
+            }
+
+
+# Global chat session store
+chat_sessions = ChatSessionStore(
+    settings.chat_session_memory_bytes,
+    Path(settings.cache_dir) / "sessions",
+    settings.chat_session_disk_bytes,
+    settings.chat_session_idle_seconds,
+    settings.chat_session_ttl,
+)
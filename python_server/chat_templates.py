@@ -0,0 +1,246 @@
+"""
+Model-native chat templates.
+
+Chat prompts are rendered with the Jinja template each GGUF ships in
+its ``tokenizer.chat_template`` metadata, so every model sees the role
+markers and end-of-turn tokens it was trained with. Templates are
+compiled once per model; models without one keep the generic format in
+``InferenceEngine.format_chat_segments``.
+
+Rendered prompts are split into segments at the conversation lengths of
+earlier requests: a request's new messages form one segment, the text
+they add to the rendering of the conversation before them. Earlier
+segments come from a cache keyed by a chain hash of the conversation
+prefix they end, so every turn of a growing conversation renders the
+template twice (with and without the generation prompt) however long
+its history is, and earlier turns keep byte-identical text and token
+ids for the tokenization cache and prefix KV reuse. The joined segments
+are checked against the full render on every request; templates that
+rewrite earlier turns (such as dropping reasoning from past assistant
+messages) get a single segment.
+"""
+
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from .config import settings
+
+try:
+    import jinja2
+    from jinja2.sandbox import ImmutableSandboxedEnvironment
+    JINJA2_AVAILABLE = True
+except ImportError:
+    JINJA2_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Value of ``chat_template_overrides`` that selects the built-in generic format
+GENERIC_TEMPLATE = "generic"
+
+
+def _raise_exception(message: str):
+    raise ValueError(message)
+
+
+def _strftime_now(format: str) -> str:
+    return datetime.now().strftime(format)
+
+
+def _chain_keys(messages: List[dict]) -> List[bytes]:
+    """Digest of each conversation prefix ``messages[:k + 1]``."""
+    keys = []
+    running = hashlib.blake2b(digest_size=16)
+    for message in messages:
+        for field, value in sorted(message.items()):
+            running.update(f"{field}\0{value}\0".encode("utf-8"))
+        running.update(b"\1")
+        keys.append(running.copy().digest())
+    return keys
+
+
+class ChatTemplate:
+    """One model's compiled chat template with its cache of rendered message segments."""
+
+    def __init__(self, source: str, bos_token: str, eos_token: str, max_segments: int = 4096):
+        """
+        Compile the template.
+
+        Args:
+            source: Jinja template text
+            bos_token: Text of the model's BOS token, exposed as ``bos_token``
+            eos_token: Text of the model's EOS token, exposed as ``eos_token``
+            max_segments: Rendered message segments kept
+
+        Raises:
+            jinja2.TemplateSyntaxError: The template does not compile
+        """
+        self.source = source
+        self.bos_token = bos_token
+        self.eos_token = eos_token
+        self.max_segments = max_segments
+        environment = ImmutableSandboxedEnvironment(
+            loader=jinja2.BaseLoader(),
+            trim_blocks=True,
+            lstrip_blocks=True,
+        )
+        environment.globals["raise_exception"] = _raise_exception
+        environment.globals["strftime_now"] = _strftime_now
+        self._template = environment.from_string(source)
+        # Chain key of a segment's last message -> (index of its first message, text)
+        self._segments: "OrderedDict[bytes, Tuple[int, str]]" = OrderedDict()
+        self.renders = 0
+        self.render_seconds = 0.0
+
+    def render(self, messages: List[dict], add_generation_prompt: bool = True) -> str:
+        """Render a conversation as one prompt string."""
+        start = time.perf_counter()
+        try:
+            return self._template.render(
+                messages=messages,
+                bos_token=self.bos_token,
+                eos_token=self.eos_token,
+                add_generation_prompt=add_generation_prompt,
+            )
+        finally:
+            self.renders += 1
+            self.render_seconds += time.perf_counter() - start
+
+    def segments(self, messages: List[dict]) -> List[str]:
+        """
+        Render a conversation as consecutive prompt segments.
+
+        The cached segments of the longest conversation prefix seen
+        before, one segment for the remaining messages, and the trailing
+        generation prompt; joined they equal ``render(messages)``. Falls
+        back to the whole prompt as one segment when the template is not
+        prefix-stable.
+
+        Raises:
+            ValueError: The template rejects the conversation
+        """
+        try:
+            full = self.render(messages)
+        except jinja2.TemplateError as e:
+            raise ValueError(f"Chat template error: {e}") from e
+
+        keys = _chain_keys(messages)
+        end = len(keys)
+        while end > 0 and keys[end - 1] not in self._segments:
+            end -= 1
+        segments: List[str] = []
+        position = end
+        while position > 0:
+            entry = self._segments.get(keys[position - 1])
+            if entry is None:
+                # An earlier segment was evicted; render the conversation afresh
+                segments, end = [], 0
+                break
+            self._segments.move_to_end(keys[position - 1])
+            position, text = entry
+            segments.append(text)
+        segments.reverse()
+        body = "".join(segments)
+
+        if end < len(keys):
+            try:
+                prefix = self.render(messages, add_generation_prompt=False)
+            except (jinja2.TemplateError, ValueError):
+                return [full]
+            if not prefix.startswith(body):
+                return [full]
+            segments.append(prefix[len(body):])
+            self._segments[keys[-1]] = (end, segments[-1])
+            while len(self._segments) > self.max_segments:
+                self._segments.popitem(last=False)
+            body = prefix
+
+        if not full.startswith(body):
+            return [full]
+        segments.append(full[len(body):])
+        return segments
+
+    def starts_with_bos(self, segments: List[str]) -> bool:
+        """Whether the rendered prompt already contains the BOS token text."""
+        return bool(self.bos_token) and bool(segments) and segments[0].startswith(self.bos_token)
+
+
+class ChatTemplateRegistry:
+    """
+    Compiled chat templates per model name.
+
+    A template is compiled the first time a model renders a chat and
+    recompiled only if its source changes (the GGUF was replaced), so
+    replicas of a model share one template and its segment cache. Only
+    touched from the event loop.
+    """
+
+    def __init__(self, overrides: Optional[Dict[str, str]] = None, max_segments: int = 4096):
+        """
+        Initialize the registry.
+
+        Args:
+            overrides: Per-model template text replacing the GGUF's
+                (``"generic"`` selects the built-in format)
+            max_segments: Rendered message segments kept per model
+        """
+        self.overrides = overrides or {}
+        self.max_segments = max_segments
+        self._templates: Dict[str, Tuple[Optional[str], Optional[ChatTemplate]]] = {}
+
+    @staticmethod
+    def _token_text(model: Any, token: int) -> str:
+        if token < 0:
+            return ""
+        return model._model.token_get_text(token)
+
+    def get(self, model: Any, model_name: str) -> Optional[ChatTemplate]:
+        """
+        The model's compiled chat template, or None to use the generic format.
+
+        Args:
+            model: Loaded Llama instance (its GGUF metadata holds the template)
+            model_name: Model name, for overrides and sharing across replicas
+        """
+        source = self.overrides.get(model_name)
+        if source is None:
+            source = getattr(model, "metadata", {}).get("tokenizer.chat_template")
+        if source == GENERIC_TEMPLATE or not JINJA2_AVAILABLE:
+            source = None
+
+        cached = self._templates.get(model_name)
+        if cached is not None and cached[0] == source:
+            return cached[1]
+
+        template = None
+        if source is not None:
+            try:
+                template = ChatTemplate(
+                    source,
+                    self._token_text(model, model.token_bos()),
+                    self._token_text(model, model.token_eos()),
+                    self.max_segments,
+                )
+                logger.info(f"Compiled chat template for {model_name}")
+            except jinja2.TemplateError as e:
+                logger.warning(f"Chat template of {model_name} does not compile, using generic format: {e}")
+        self._templates[model_name] = (source, template)
+        return template
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            model_name: {
+                "segments": len(template._segments),
+                "renders": template.renders,
+                "mean_render_ms": round(template.render_seconds / template.renders * 1000, 4) if template.renders else 0.0,
+            }
+            for model_name, (_, template) in self._templates.items()
+            if template is not None
+        }
+
+
+# Global template registry instance
+chat_templates = ChatTemplateRegistry(settings.chat_template_overrides, settings.tokenization_cache_size)
@@ -6,7 +6,7 @@ with support for both CPU and GPU builds.
 """
 
 import os
-from typing import Optional
+from typing import Any, Optional
 from pathlib import Path
 from pydantic_settings import BaseSettings
 
@@ -37,14 +37,79 @@ class Settings(BaseSettings):
     enable_cache: bool = True
     cache_dir: str = "./cache"
     max_cached_models: int = 2  # Maximum models to keep in memory simultaneously
+    model_idle_ttl: float = 0  # Seconds idle before an unpinned model is unloaded (0 = never)
+    model_idle_ttls: dict[str, float] = {}  # Per-model idle TTL overrides
+    max_concurrent_loads: int = 2  # Model loads running at once (others queue)
+    load_io_bytes_per_second: int = 0  # Read rate cap while prefetching model weights (0 = unlimited)
+    prefetch_weights: bool = True  # Read weights into the page cache before constructing a model
+    model_load_wait: Optional[float] = None  # Default seconds a request waits for a cold load (None = until loaded)
+    preload_models: list[str] = []  # Models loaded, prefetched and warmed up at startup (gates /ready)
+    warmup_prompt: str = "Hello"  # Text evaluated once after a preload to initialize compute kernels
+    model_memory_budget: int = 0  # Bytes for loaded models (weights + KV); 0 = 80% of physical memory
+    memory_reserve_bytes: int = 1024**3  # Host MemAvailable to keep free; idle models are evicted below it
+    memory_poll_interval: float = 5.0  # Seconds between host memory pressure checks
+    pinned_models: list[str] = []  # Models never evicted from the cache
+    use_mlock: bool = True  # Lock model weights in RAM (they then count fully toward the budget)
+    prefix_cache_bytes: int = 2 * 1024**3  # Per-model budget for cached prompt-prefix KV states
+    prefix_cache_policy: str = "lru"  # Prefix cache eviction: "lru" or "lfu"
+    prefix_cache_min_tokens: int = 32  # Shortest shared prefix worth restoring
+    kv_store_enabled: bool = True  # Persist prefix KV snapshots under cache_dir across restarts
+    kv_store_max_bytes: int = 8 * 1024**3  # Size cap for on-disk KV snapshots
+    kv_warm_prompts: list[dict[str, str]] = []  # [{"name", "prompt", "model"}] snapshotted at startup
+    tokenization_cache_size: int = 4096  # Cached chat message tokenizations per model
+    chat_template_overrides: dict[str, str] = {}  # Per-model Jinja chat templates replacing the GGUF's ("generic" = built-in format)
+    catalog_refresh_seconds: float = 10.0  # Max age of the GGUF metadata index before re-checking files
+    response_cache_size: int = 1024  # Deterministic (temperature 0 / seeded) responses cached in memory (0 = off)
+    response_cache_ttl: float = 3600.0  # Seconds a cached response stays valid (0 = until evicted)
+    response_cache_disk_bytes: int = 0  # Cap for responses spilled to cache_dir/responses (0 = memory only)
+    semantic_cache_enabled: bool = False  # Answer near-duplicate chat questions with earlier answers
+    semantic_cache_size: int = 4096  # Cached chat answers per model
+    semantic_cache_ttl: float = 86400.0  # Seconds a cached answer stays valid (0 = until evicted)
+    semantic_cache_threshold: float = 0.95  # Minimum cosine similarity of the last user turn for a hit
+    semantic_cache_thresholds: dict[str, float] = {}  # Per-model threshold overrides
+    semantic_cache_embedding_model: Optional[str] = None  # Model embedding the questions (None = the chat model)
+    semantic_cache_save_interval: float = 60.0  # Seconds between saves to cache_dir/semantic
+    chat_session_memory_bytes: int = 1024**3  # Budget for resident chat session KV states, all models (0 = sessions off)
+    chat_session_disk_bytes: int = 8 * 1024**3  # Cap for sessions spilled to cache_dir/sessions (0 = evicted sessions are dropped)
+    chat_session_idle_seconds: float = 300.0  # Idle time before a session's state is spilled to disk
+    chat_session_ttl: float = 86400.0  # Seconds unused before a session is deleted (0 = never)
+    
+    # Speculative decoding, per model: {"model.gguf": {"mode": "prompt_lookup", "num_pred_tokens": 10,
+    # "max_ngram_size": 2}} or {"model.gguf": {"mode": "draft", "draft_model": "small.gguf", "num_pred_tokens": 4}}
+    speculative_models: dict[str, dict[str, Any]] = {}
     
     # Performance tuning
-    max_workers: int = 4  # For concurrent requests
+    max_workers: int = 4  # Inference thread pool size (prompt eval, decode, tokenization)
     request_timeout: int = 600  # Request timeout in seconds
+    max_concurrent_requests: int = 1  # Requests running at once per model
+    max_queue_depth: int = 16  # Requests waiting per model before shedding with 429
+    max_choices: int = 8  # Highest n / best_of per request (capped by batch_max_sequences when batching)
     stream_chunk_size: int = 1  # Tokens per stream chunk (1 = real-time)
+    stream_flush_interval: float = 0.05  # Max seconds a token waits for its chunk to fill
+    embedding_batch_tokens: int = 512  # Tokens per embedding decode batch and embedding context (longer inputs are truncated)
+    max_embedding_inputs: int = 2048  # Inputs accepted per /v1/embeddings call
+    
+    # Worker processes
+    worker_processes: bool = False  # Run each loaded model in its own CPU-pinned worker process
+    
+    # Model replicas (share mmap'd weights; each gets its own context and n_threads cores)
+    max_replicas: int = 1  # Maximum Llama instances per model
+    replica_scale_up_queue: int = 2  # Queued requests per model that trigger another replica
+    replica_idle_seconds: float = 60.0  # Idle time before an extra replica is freed
+    replica_scale_interval: float = 1.0  # Seconds between replica scaling checks
+    
+    # Continuous batching
+    enable_continuous_batching: bool = False  # Decode concurrent requests in one shared batch
+    batch_max_sequences: int = 8  # Sequences decoded together per model
+    batch_prefill_chunk: int = 128  # Prompt tokens per sequence per decode step
+    
+    # Offline batch jobs (/v1/batches), run below interactive traffic
+    batch_job_concurrency: int = 1  # Requests of the running job in flight at once (raise with continuous batching)
+    batch_job_max_requests: int = 50000  # Requests accepted per job
     
     # API configuration
     enable_metrics: bool = True
+    request_trace_buffer: int = 1000  # Finished request traces kept for /debug/requests
     cors_origins: list[str] = ["*"]  # Adjust for production security
     
     class Config:
@@ -0,0 +1,159 @@
+"""
+Batched embeddings for the ``/v1/embeddings`` endpoint.
+
+Models serve embeddings from a separate embedding-mode instance, cached
+by ``ModelManager`` under ``<model>#embedding``. Inputs are packed into
+decode batches by length: llama.cpp concatenates sequences without
+padding, so sorting inputs longest-first and packing them first-fit into
+``embedding_batch_tokens``-token batches minimizes the number of decode
+calls and the unused capacity of each. Vectors come back as one float32
+NumPy array, normalized there, in the caller's input order.
+"""
+
+import base64
+import json
+import logging
+from typing import Any, List, Sequence, Tuple, Union
+
+import numpy as np
+import llama_cpp
+from llama_cpp import Llama
+
+from .executor import inference_executor
+
+try:
+    import orjson
+
+    def dumps_embeddings(obj: Any) -> bytes:
+        """Encode a response whose vectors are NumPy arrays (float32 precision)."""
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+except ImportError:
+    def dumps_embeddings(obj: Any) -> bytes:
+        """Encode a response whose vectors are NumPy arrays."""
+        return json.dumps(obj, default=lambda array: array.tolist(), separators=(",", ":")).encode()
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_SUFFIX = "#embedding"
+
+
+def embedding_key(model_name: str) -> str:
+    """Model cache key of a model's embedding-mode instance."""
+    return model_name + EMBEDDING_SUFFIX
+
+
+def is_embedding_key(model_key: str) -> bool:
+    return model_key.endswith(EMBEDDING_SUFFIX)
+
+
+def model_file_name(model_key: str) -> str:
+    """GGUF file name behind a model cache key."""
+    return model_key[:-len(EMBEDDING_SUFFIX)] if is_embedding_key(model_key) else model_key
+
+
+def plan_batches(lengths: Sequence[int], max_tokens: int) -> List[List[int]]:
+    """
+    Pack inputs into decode batches of at most ``max_tokens`` tokens.
+
+    First-fit decreasing: inputs are taken longest first and each goes
+    into the first batch with room, so batches fill up and inputs of
+    similar length end up together.
+
+    Args:
+        lengths: Token count of each input (each at most ``max_tokens``)
+        max_tokens: Token capacity of one batch
+
+    Returns:
+        Input indices per batch
+    """
+    batches: List[List[int]] = []
+    room: List[int] = []
+    for index in sorted(range(len(lengths)), key=lambda i: -lengths[i]):
+        length = lengths[index]
+        for b, free in enumerate(room):
+            if length <= free:
+                batches[b].append(index)
+                room[b] -= length
+                break
+        else:
+            batches.append([index])
+            room.append(max_tokens - length)
+    return batches
+
+
+def embed_inputs(
+    model: Llama,
+    inputs: List[Union[str, List[int]]],
+    normalize: bool = True,
+) -> Tuple[np.ndarray, int]:
+    """
+    Embed inputs on the calling (inference) thread.
+
+    Text is tokenized here; every input is truncated to what one batch
+    and the model's trained context hold. Models without a pooling layer
+    are mean-pooled over their tokens.
+
+    Args:
+        model: Model created with ``embedding=True``
+        inputs: Texts or token ids
+        normalize: Scale every vector to unit L2 norm
+
+    Returns:
+        (float32 array of shape (len(inputs), n_embd), total input tokens)
+    """
+    limit = min(model.n_batch, model._model.n_ctx_train())
+    inputs = [
+        (model.tokenize(item.encode("utf-8")) if isinstance(item, str) else list(item))[:limit]
+        for item in inputs
+    ]
+    if any(not tokens for tokens in inputs):
+        raise ValueError("Embedding inputs must not be empty")
+
+    n_embd = model.n_embd()
+    pooled = model.pooling_type() != llama_cpp.LLAMA_POOLING_TYPE_NONE
+    ctx = model._ctx.ctx
+    vectors = np.empty((len(inputs), n_embd), dtype=np.float32)
+
+    for batch_indices in plan_batches([len(tokens) for tokens in inputs], model.n_batch):
+        model._batch.reset()
+        for seq_id, index in enumerate(batch_indices):
+            model._batch.add_sequence(inputs[index], seq_id, not pooled)
+        llama_cpp.llama_kv_cache_clear(ctx)
+        model._ctx.decode(model._batch)
+
+        if pooled:
+            for seq_id, index in enumerate(batch_indices):
+                pointer = llama_cpp.llama_get_embeddings_seq(ctx, seq_id)
+                vectors[index] = np.ctypeslib.as_array(pointer, shape=(n_embd,))
+        else:
+            n_tokens = sum(len(inputs[index]) for index in batch_indices)
+            rows = np.ctypeslib.as_array(llama_cpp.llama_get_embeddings(ctx), shape=(n_tokens, n_embd))
+            offset = 0
+            for index in batch_indices:
+                length = len(inputs[index])
+                vectors[index] = rows[offset:offset + length].mean(axis=0)
+                offset += length
+
+    model._batch.reset()
+    llama_cpp.llama_kv_cache_clear(ctx)
+
+    if normalize:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors, sum(len(tokens) for tokens in inputs)
+
+
+async def embed(
+    model: Llama,
+    inputs: List[Union[str, List[int]]],
+    normalize: bool = True,
+) -> Tuple[np.ndarray, int]:
+    """Embed inputs on the inference thread pool; see ``embed_inputs``."""
+    return await inference_executor.run(model, embed_inputs, model, inputs, normalize)
+
+
+def encode_vector(vector: np.ndarray, encoding_format: str) -> Union[np.ndarray, str]:
+    """A vector as returned to the client: a float array, or base64 of little-endian float32."""
+    if encoding_format == "base64":
+        return base64.b64encode(vector.astype("<f4", copy=False).tobytes()).decode("ascii")
+    return vector
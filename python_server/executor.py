@@ -0,0 +1,251 @@
+"""
+Inference execution layer for GGUF models.
+
+Runs blocking llama.cpp work (prompt evaluation, decoding, tokenization)
+on a bounded thread pool so the asyncio event loop stays responsive,
+and serializes access so a single Llama instance is never entered by
+two threads at once.
+"""
+
+import asyncio
+import functools
+import logging
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncGenerator, Callable, FrozenSet, Iterator, Optional
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Markers passed through the token queue alongside regular items
+_END = object()
+
+# CPUs this process may run on; unpinned work is restored to the full set
+_process_cpus: FrozenSet[int] = frozenset(
+    os.sched_getaffinity(0) if hasattr(os, "sched_getaffinity") else range(os.cpu_count() or 1)
+)
+
+_thread_state = threading.local()
+
+
+def process_cpus() -> FrozenSet[int]:
+    """CPUs available to this process's inference work."""
+    return _process_cpus
+
+
+def restrict_process_cpus(cpus: FrozenSet[int]) -> None:
+    """
+    Confine this process to ``cpus`` (used by worker processes at startup).
+
+    Pins the calling thread, which threads created afterwards inherit,
+    and makes ``cpus`` the set unpinned work is restored to.
+    """
+    global _process_cpus
+    _process_cpus = frozenset(cpus)
+    pin_current_thread(_process_cpus)
+
+
+def cpu_slice(slot: int, size: int) -> Optional[FrozenSet[int]]:
+    """
+    The ``slot``-th disjoint block of ``size`` CPUs, or None if the
+    process has too few CPUs for that slot to get its own block.
+    """
+    cpus = sorted(_process_cpus)
+    if size <= 0 or (slot + 1) * size > len(cpus):
+        return None
+    return frozenset(cpus[slot * size:(slot + 1) * size])
+
+
+def pin_current_thread(cpus: Optional[FrozenSet[int]]) -> None:
+    """
+    Restrict the calling thread (and threads it spawns) to ``cpus``.
+
+    llama.cpp starts its compute threads from the calling thread, so they
+    inherit this affinity. ``None`` restores the full CPU set. No-op on
+    platforms without ``sched_setaffinity``.
+    """
+    if not hasattr(os, "sched_setaffinity"):
+        return
+    cpus = cpus or _process_cpus
+    if getattr(_thread_state, "cpus", None) == cpus:
+        return
+    try:
+        os.sched_setaffinity(0, cpus)
+        _thread_state.cpus = cpus
+    except OSError as e:
+        logger.warning(f"Could not set CPU affinity {sorted(cpus)}: {e}")
+
+
+class _Failure:
+    """Wraps an exception raised in a worker thread for re-raising on the loop."""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class InferenceExecutor:
+    """
+    Bounded thread pool for llama.cpp calls with per-model serialization.
+
+    Each model gets an asyncio lock (so waiting requests queue on the
+    event loop instead of occupying pool threads) and a threading lock
+    (so the Llama instance is never entered concurrently, even if an
+    awaiting coroutine is cancelled while its worker is still running).
+    """
+
+    def __init__(self, max_workers: int = 4):
+        """
+        Initialize the executor.
+
+        Args:
+            max_workers: Maximum number of threads running inference
+        """
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="llama-worker",
+        )
+        self._async_locks: "weakref.WeakKeyDictionary[Any, asyncio.Lock]" = weakref.WeakKeyDictionary()
+        self._thread_locks: "weakref.WeakKeyDictionary[Any, threading.Lock]" = weakref.WeakKeyDictionary()
+        self._affinity: "weakref.WeakKeyDictionary[Any, FrozenSet[int]]" = weakref.WeakKeyDictionary()
+        self._registry_lock = threading.Lock()
+
+    def set_affinity(self, model: Any, cpus: Optional[FrozenSet[int]]) -> None:
+        """Run all calls against ``model`` on the given CPUs (None = any CPU)."""
+        with self._registry_lock:
+            if cpus:
+                self._affinity[model] = frozenset(cpus)
+            else:
+                self._affinity.pop(model, None)
+
+    def affinity(self, model: Any) -> Optional[FrozenSet[int]]:
+        """CPUs assigned to ``model``, if it is pinned."""
+        with self._registry_lock:
+            return self._affinity.get(model)
+
+    def _locks_for(self, model: Any) -> tuple[asyncio.Lock, threading.Lock]:
+        """Return the (async, thread) lock pair guarding a model instance."""
+        with self._registry_lock:
+            async_lock = self._async_locks.get(model)
+            if async_lock is None:
+                async_lock = asyncio.Lock()
+                self._async_locks[model] = async_lock
+            thread_lock = self._thread_locks.get(model)
+            if thread_lock is None:
+                thread_lock = threading.Lock()
+                self._thread_locks[model] = thread_lock
+            return async_lock, thread_lock
+
+    async def run(self, model: Any, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Run a blocking call against a model on the thread pool.
+
+        Args:
+            model: Model instance the call operates on (used for serialization)
+            fn: Blocking callable, e.g. ``model`` or ``model.tokenize``
+            *args: Positional arguments for ``fn``
+            **kwargs: Keyword arguments for ``fn``
+
+        Returns:
+            The value returned by ``fn``
+        """
+        async_lock, thread_lock = self._locks_for(model)
+        call = functools.partial(fn, *args, **kwargs)
+
+        cpus = self.affinity(model)
+
+        def _locked_call():
+            with thread_lock:
+                pin_current_thread(cpus)
+                return call()
+
+        loop = asyncio.get_running_loop()
+        async with async_lock:
+            # If the caller is cancelled the worker keeps running; the
+            # thread lock still keeps the next call out until it finishes.
+            return await loop.run_in_executor(self._pool, _locked_call)
+
+    async def iterate(
+        self,
+        model: Any,
+        fn: Callable[..., Iterator[Any]],
+        *args,
+        **kwargs,
+    ) -> AsyncGenerator[Any, None]:
+        """
+        Drive a blocking generator on the thread pool and yield its items.
+
+        The generator is created and consumed entirely inside a worker
+        thread; items are handed to the event loop through an asyncio
+        queue. Closing the returned async generator stops the worker at
+        the next item boundary.
+
+        Args:
+            model: Model instance the generator operates on
+            fn: Callable returning a blocking iterator, e.g. ``model``
+                called with ``stream=True``
+            *args: Positional arguments for ``fn``
+            **kwargs: Keyword arguments for ``fn``
+
+        Yields:
+            Items produced by the blocking iterator
+        """
+        async_lock, thread_lock = self._locks_for(model)
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+        cpus = self.affinity(model)
+
+        def _deliver(item: Any) -> None:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                # Event loop already closed; nobody is listening anymore
+                stop.set()
+
+        def _produce() -> None:
+            with thread_lock:
+                pin_current_thread(cpus)
+                iterator = None
+                try:
+                    iterator = fn(*args, **kwargs)
+                    for item in iterator:
+                        if stop.is_set():
+                            break
+                        _deliver(item)
+                except BaseException as e:
+                    _deliver(_Failure(e))
+                finally:
+                    close = getattr(iterator, "close", None)
+                    if close is not None:
+                        try:
+                            close()
+                        except Exception as e:
+                            logger.warning(f"Error closing inference generator: {e}")
+                    _deliver(_END)
+
+        async with async_lock:
+            future = loop.run_in_executor(self._pool, _produce)
+            try:
+                while True:
+                    item = await queue.get()
+                    if item is _END:
+                        break
+                    if isinstance(item, _Failure):
+                        raise item.error
+                    yield item
+            finally:
+                stop.set()
+                # Hold the async lock until the worker has released the model
+                await asyncio.shield(future)
+
+    def shutdown(self) -> None:
+        """Stop accepting work and wait for running inference to finish."""
+        logger.info("Shutting down inference executor")
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+
+inference_executor = InferenceExecutor(max_workers=settings.max_workers)
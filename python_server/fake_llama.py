@@ -0,0 +1,375 @@
+"""
+Deterministic stand-in for ``llama_cpp`` used by the load-testing benchmark.
+
+``install()`` registers a fake ``llama_cpp`` package whose ``Llama``
+tokenizes bytes one token each, evaluates prompts and decodes tokens by
+sleeping for a configurable time per token, and always generates the
+same text. The server then runs unchanged on top of it, so request
+handling, scheduling, streaming and the inference thread pool can be
+benchmarked without a model file.
+
+Only what the per-request engine uses is implemented: generation,
+tokenization, perf counters and parallel sampling, with the low-level
+API of the pinned llama-cpp-python (``llama_get_timings``). Continuous
+batching, worker processes, embeddings, prefix caching and chat sessions
+need the real library; names imported from its submodules that the fake
+does not provide resolve to classes that raise ``NotImplementedError``
+when used. The package itself has only what is listed here, so feature
+checks with ``hasattr`` see the pinned version.
+"""
+
+import sys
+import time
+import types
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+import numpy as np
+
+BOS, EOS = 1, 2
+# Byte b is token b + BYTE_OFFSET
+BYTE_OFFSET = 3
+N_VOCAB = 256 + BYTE_OFFSET
+OUTPUT_TEXT = b" The quick brown fox jumps over the lazy dog."
+
+
+class FakeProfile:
+    """Simulated compute cost of the fake model."""
+
+    def __init__(
+        self,
+        prompt_ms_per_token: float = 0.5,
+        ms_per_token: float = 20.0,
+        completion_tokens: Optional[int] = None,
+        kv_bytes_per_token: int = 16 * 1024,
+    ):
+        """
+        Args:
+            prompt_ms_per_token: Prompt evaluation time per new prompt token
+            ms_per_token: Decode time per generated token
+            completion_tokens: Tokens generated before end of sequence (None = until ``max_tokens``)
+            kv_bytes_per_token: Context state size per ``n_ctx`` position, for memory accounting
+        """
+        self.prompt_ms_per_token = prompt_ms_per_token
+        self.ms_per_token = ms_per_token
+        self.completion_tokens = completion_tokens
+        self.kv_bytes_per_token = kv_bytes_per_token
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(vars(self))
+
+
+# Cost profile of every fake model; set by install()
+profile = FakeProfile()
+
+
+class _Unsupported:
+    """Stands in for ``llama_cpp`` names the fake does not implement."""
+
+    def __init__(self, *args, **kwargs):
+        raise NotImplementedError(f"{type(self).__name__} is not supported by the fake llama backend")
+
+
+class _Context:
+    """Fake ``llama_context``: perf counters and state size."""
+
+    def __init__(self, n_ctx: int):
+        self.n_ctx = n_ctx
+        self.reset_perf()
+
+    def reset_perf(self) -> None:
+        self.t_p_eval_ms = 0.0
+        self.t_eval_ms = 0.0
+        self.n_p_eval = 0
+        self.n_eval = 0
+
+
+class _Handle:
+    """Holds a raw pointer-like object, like ``llama_cpp``'s ``_internals`` wrappers."""
+
+    def __init__(self, ctx: Any):
+        self.ctx = ctx
+        self.model = ctx
+
+    def token_get_text(self, token: int) -> str:
+        return {BOS: "<s>", EOS: "</s>"}.get(token, "")
+
+
+class LogitsProcessorList(list):
+    def __call__(self, input_ids: np.ndarray, scores: np.ndarray) -> np.ndarray:
+        for processor in self:
+            scores = processor(input_ids, scores)
+        return scores
+
+
+class StoppingCriteriaList(list):
+    def __call__(self, input_ids: np.ndarray, logits: np.ndarray) -> bool:
+        return any(criterion(input_ids, logits) for criterion in self)
+
+
+class Llama:
+    """
+    Fake ``llama_cpp.Llama``.
+
+    Like the real one it keeps the evaluated tokens of its context and
+    only evaluates the part of a prompt past the shared prefix, so prompt
+    reuse between requests is priced as it would be.
+    """
+
+    def __init__(self, model_path: str, n_ctx: int = 512, seed: int = 0, **kwargs):
+        self.model_path = model_path
+        self.metadata: Dict[str, str] = {}
+        self.cache = None
+        self.draft_model = None
+        self.verbose = kwargs.get("verbose", False)
+        self._n_ctx = n_ctx
+        self._seed = seed
+        self._ctx = _Handle(_Context(n_ctx))
+        self._model = _Handle(self)
+        self.input_ids = np.zeros(n_ctx, dtype=np.intc)
+        self.n_tokens = 0
+        self.scores = np.zeros((1, N_VOCAB), dtype=np.single)
+
+    # Model information
+
+    def n_ctx(self) -> int:
+        return self._n_ctx
+
+    def n_vocab(self) -> int:
+        return N_VOCAB
+
+    def token_bos(self) -> int:
+        return BOS
+
+    def token_eos(self) -> int:
+        return EOS
+
+    # Tokenizer
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> List[int]:
+        return ([BOS] if add_bos else []) + [byte + BYTE_OFFSET for byte in text]
+
+    def detokenize(self, tokens: List[int], prev_tokens: Optional[List[int]] = None, special: bool = False) -> bytes:
+        return bytes(token - BYTE_OFFSET for token in tokens if token >= BYTE_OFFSET)
+
+    # State
+
+    def set_seed(self, seed: int) -> None:
+        self._seed = seed
+
+    def set_cache(self, cache: Any) -> None:
+        self.cache = cache
+
+    def reset(self) -> None:
+        self.n_tokens = 0
+
+    def eval(self, tokens: List[int]) -> None:
+        """Evaluate tokens after the current context, as a prompt batch."""
+        start = time.perf_counter()
+        time.sleep(len(tokens) * profile.prompt_ms_per_token / 1000)
+        self._append(tokens)
+        ctx = self._ctx.ctx
+        ctx.t_p_eval_ms += (time.perf_counter() - start) * 1000
+        ctx.n_p_eval += len(tokens)
+
+    def close(self) -> None:
+        pass
+
+    # Generation
+
+    def generate(
+        self,
+        tokens: List[int],
+        logits_processor: Optional[LogitsProcessorList] = None,
+        **kwargs,
+    ) -> Iterator[int]:
+        """
+        Evaluate ``tokens`` and yield generated tokens until the caller stops.
+
+        The text is always ``OUTPUT_TEXT`` repeated, one byte per token,
+        then ``EOS`` after ``profile.completion_tokens`` tokens.
+        """
+        reused = self._shared_prefix(tokens)
+        self.n_tokens = reused
+        self.eval(tokens[reused:])
+        generated = 0
+        while True:
+            if profile.completion_tokens is not None and generated >= profile.completion_tokens:
+                token = EOS
+            else:
+                token = OUTPUT_TEXT[generated % len(OUTPUT_TEXT)] + BYTE_OFFSET
+            if logits_processor is not None:
+                logits = np.zeros(N_VOCAB, dtype=np.single)
+                logits[token] = 10.0
+                logits_processor(self.input_ids[:self.n_tokens], logits)
+            yield token
+            self._decode(token)
+            generated += 1
+
+    def __call__(
+        self,
+        prompt: Union[str, List[int]],
+        max_tokens: Optional[int] = 16,
+        stream: bool = False,
+        stopping_criteria: Optional[StoppingCriteriaList] = None,
+        **kwargs,
+    ):
+        """Completion in ``create_completion``'s output format (a dict, or chunks when streaming)."""
+        tokens = prompt if isinstance(prompt, list) else self.tokenize(prompt.encode(), add_bos=True, special=True)
+        if len(tokens) >= self._n_ctx:
+            raise ValueError(f"Requested tokens ({len(tokens)}) exceed context window of {self._n_ctx}")
+        if max_tokens is None or max_tokens <= 0:
+            max_tokens = self._n_ctx - len(tokens)
+        chunks = self._completion(tokens, max_tokens, stopping_criteria)
+        if stream:
+            return chunks
+
+        pieces = []
+        for chunk in chunks:
+            choice = chunk["choices"][0]
+            pieces.append(choice["text"])
+        completion_tokens = len(pieces) - 1
+        return {
+            **self._envelope(),
+            "choices": [
+                {"text": "".join(pieces), "index": 0, "logprobs": None, "finish_reason": choice["finish_reason"]}
+            ],
+            "usage": {
+                "prompt_tokens": len(tokens),
+                "completion_tokens": completion_tokens,
+                "total_tokens": len(tokens) + completion_tokens,
+            },
+        }
+
+    def _completion(
+        self,
+        tokens: List[int],
+        max_tokens: int,
+        stopping_criteria: Optional[StoppingCriteriaList],
+    ) -> Iterator[Dict[str, Any]]:
+        generated = 0
+        finish_reason = "length"
+        for token in self.generate(tokens):
+            if token == EOS:
+                finish_reason = "stop"
+                break
+            if stopping_criteria is not None and stopping_criteria(self.input_ids[:self.n_tokens], self.scores[0]):
+                finish_reason = "stop"
+                break
+            generated += 1
+            yield self._chunk(self.detokenize([token]).decode("utf-8", errors="replace"), None)
+            if generated >= max_tokens:
+                break
+        yield self._chunk("", finish_reason)
+
+    def _envelope(self) -> Dict[str, Any]:
+        return {"id": "cmpl-fake", "object": "text_completion", "created": int(time.time()), "model": self.model_path}
+
+    def _chunk(self, text: str, finish_reason: Optional[str]) -> Dict[str, Any]:
+        return {
+            **self._envelope(),
+            "choices": [{"text": text, "index": 0, "logprobs": None, "finish_reason": finish_reason}],
+        }
+
+    def _decode(self, token: int) -> None:
+        start = time.perf_counter()
+        time.sleep(profile.ms_per_token / 1000)
+        self._append([token])
+        ctx = self._ctx.ctx
+        ctx.t_eval_ms += (time.perf_counter() - start) * 1000
+        ctx.n_eval += 1
+
+    def _shared_prefix(self, tokens: List[int]) -> int:
+        shared = 0
+        for cached, token in zip(self.input_ids[:self.n_tokens], tokens):
+            if cached != token:
+                break
+            shared += 1
+        # The last prompt token is always re-evaluated for its logits
+        return max(0, min(shared, len(tokens) - 1))
+
+    def _append(self, tokens: List[int]) -> None:
+        if self.n_tokens + len(tokens) > self._n_ctx:
+            raise ValueError(f"Context window of {self._n_ctx} tokens exceeded")
+        self.input_ids[self.n_tokens:self.n_tokens + len(tokens)] = tokens
+        self.n_tokens += len(tokens)
+
+
+# Low-level API used by the per-request engine and memory accounting
+
+LLAMA_POOLING_TYPE_NONE = 0
+
+
+def llama_token_is_eog(model: Any, token: int) -> bool:
+    return token == EOS
+
+
+def llama_state_get_size(ctx: _Context) -> int:
+    return ctx.n_ctx * profile.kv_bytes_per_token
+
+
+def llama_get_timings(ctx: _Context) -> types.SimpleNamespace:
+    return types.SimpleNamespace(
+        t_p_eval_ms=ctx.t_p_eval_ms,
+        t_eval_ms=ctx.t_eval_ms,
+        n_p_eval=ctx.n_p_eval,
+        n_eval=ctx.n_eval,
+    )
+
+
+def llama_reset_timings(ctx: _Context) -> None:
+    ctx.reset_perf()
+
+
+def _unsupported_attribute(module_name: str):
+    placeholders: Dict[str, type] = {}
+
+    def __getattr__(name: str):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        if name not in placeholders:
+            placeholders[name] = type(name, (_Unsupported,), {"__module__": module_name})
+        return placeholders[name]
+
+    return __getattr__
+
+
+def _register(name: str, placeholders: bool = True, **attributes: Any) -> types.ModuleType:
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    if placeholders:
+        module.__dict__["__getattr__"] = _unsupported_attribute(name)
+    sys.modules[name] = module
+    return module
+
+
+def install(cost: Optional[FakeProfile] = None) -> None:
+    """
+    Register the fake as the ``llama_cpp`` package.
+
+    Must run before any server module is imported.
+
+    Raises:
+        RuntimeError: ``llama_cpp`` was already imported
+    """
+    global profile
+    current = sys.modules.get("llama_cpp")
+    if current is not None and not getattr(current, "FAKE", False):
+        raise RuntimeError("llama_cpp was imported before the fake backend was installed")
+    if cost is not None:
+        profile = cost
+
+    package = _register(
+        "llama_cpp",
+        placeholders=False,
+        FAKE=True,
+        Llama=Llama,
+        LogitsProcessorList=LogitsProcessorList,
+        StoppingCriteriaList=StoppingCriteriaList,
+        LLAMA_POOLING_TYPE_NONE=LLAMA_POOLING_TYPE_NONE,
+        llama_token_is_eog=llama_token_is_eog,
+        llama_state_get_size=llama_state_get_size,
+        llama_get_timings=llama_get_timings,
+        llama_reset_timings=llama_reset_timings,
+    )
+    for submodule in ("llama", "_internals", "llama_cache", "llama_speculative"):
+        setattr(package, submodule, _register(f"llama_cpp.{submodule}", Llama=Llama))
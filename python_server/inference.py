@@ -5,15 +5,33 @@ Handles text generation, token management, streaming, and inference
 parameter application for various generation strategies.
 """
 
+import codecs
 import logging
+import random
 import time
-from typing import AsyncGenerator, Optional, Tuple
-from llama_cpp import Llama
+from typing import AsyncGenerator, List, Optional, Tuple, Union
+import llama_cpp
+from llama_cpp import Llama, LogitsProcessorList, StoppingCriteriaList
 
+from .cancellation import CancelToken
+from .chat_sessions import chat_sessions
+from .chat_templates import chat_templates
 from .config import settings
+from .executor import inference_executor
+from .sampling import ChoiceLogprob
+from .speculative import SpeculativeDraft
+from .tokenization import token_cache
 
 logger = logging.getLogger(__name__)
 
+# Context perf counters: llama_perf_context in llama-cpp-python 0.3, llama_get_timings before
+if hasattr(llama_cpp, "llama_perf_context"):
+    _read_perf, _reset_perf = llama_cpp.llama_perf_context, llama_cpp.llama_perf_context_reset
+elif hasattr(llama_cpp, "llama_get_timings"):
+    _read_perf, _reset_perf = llama_cpp.llama_get_timings, llama_cpp.llama_reset_timings
+else:
+    _read_perf = _reset_perf = None
+
 
 class InferenceEngine:
     """
@@ -26,13 +44,17 @@ class InferenceEngine:
     @staticmethod
     async def generate_completion(
         model: Llama,
-        prompt: str,
+        prompt: Union[str, List[int]],
         max_tokens: int = 128,
         temperature: float = 0.7,
         top_p: float = 0.9,
         top_k: int = 40,
         repeat_penalty: float = 1.1,
+        seed: Optional[int] = None,
         stream: bool = False,
+        cancel: Optional[CancelToken] = None,
+        session: Optional[str] = None,
+        choices: int = 1,
     ) -> dict:
         """
         Generate text completion from a prompt.
@@ -42,13 +64,21 @@ class InferenceEngine:
         
         Args:
             model: Loaded Llama model instance
-            prompt: Input text prompt
+            prompt: Input text prompt, or its token ids (skips re-tokenization)
             max_tokens: Maximum tokens to generate
             temperature: Sampling temperature (0=deterministic, 2=very random)
             top_p: Nucleus sampling parameter (0-1)
             top_k: Top-K sampling (0=disabled)
             repeat_penalty: Penalty for repeated tokens (>1 = less repetition)
+            seed: Sampling seed for reproducible output (None = random)
             stream: If True, yield tokens as they're generated
+            cancel: Token checked after every sampled token; once cancelled,
+                generation stops with finish reason ``cancelled``
+            session: Chat session id; its saved state is restored before a
+                token-id prompt is evaluated and replaced by the final state
+            choices: Number of completions to sample from the one prompt
+                evaluation; with more than one, tokens carry their choice
+                ``index`` and the result lists every choice under ``choices``
             
         Returns:
             Dictionary with generated text and metadata, or async generator if stream=True
@@ -60,6 +90,12 @@ class InferenceEngine:
             f"max_tokens={max_tokens}, temp={temperature}, top_p={top_p}"
         )
         
+        if choices > 1:
+            return await InferenceEngine._choices_completion(
+                model, prompt, choices, max_tokens, temperature, top_p, top_k,
+                repeat_penalty, seed, stream, cancel,
+            )
+        
         if stream:
             return InferenceEngine._stream_completion(
                 model=model,
@@ -69,17 +105,27 @@ class InferenceEngine:
                 top_p=top_p,
                 top_k=top_k,
                 repeat_penalty=repeat_penalty,
+                seed=seed,
+                cancel=cancel,
+                session=session,
             )
         else:
-            # Non-streaming completion
-            output = model(
+            # Non-streaming completion (runs on the inference thread pool)
+            speculation = []
+            session_info = []
+            perf = []
+            output = await inference_executor.run(
+                model,
+                *InferenceEngine._generation_call(model, speculation, session, session_info, perf),
                 prompt,
                 max_tokens=max_tokens,
                 temperature=temperature,
                 top_p=top_p,
                 top_k=top_k,
                 repeat_penalty=repeat_penalty,
+                seed=seed,
                 stream=False,
+                stopping_criteria=InferenceEngine._stopping_criteria(cancel),
             )
             
             elapsed = time.time() - start_time
@@ -90,11 +136,19 @@ class InferenceEngine:
                 "total_tokens": output["usage"]["total_tokens"],
                 "elapsed_seconds": elapsed,
                 "tokens_per_second": output["usage"]["completion_tokens"] / elapsed if elapsed > 0 else 0,
+                "finish_reason": InferenceEngine._finish_reason(output["choices"][0]["finish_reason"], cancel),
             }
+            if speculation:
+                result["speculative"] = speculation[0].to_dict()
+            if perf:
+                result["perf"] = perf[0]
+            if session_info:
+                result["session"] = session_info[0]
             
             logger.info(
                 f"Completion finished: {result['tokens_used']} tokens in {elapsed:.2f}s "
                 f"({result['tokens_per_second']:.2f} tok/s)"
+                + InferenceEngine._speculation_summary(speculation)
             )
             
             return result
@@ -102,12 +156,15 @@ class InferenceEngine:
     @staticmethod
     async def _stream_completion(
         model: Llama,
-        prompt: str,
+        prompt: Union[str, List[int]],
         max_tokens: int,
         temperature: float,
         top_p: float,
         top_k: int,
         repeat_penalty: float,
+        seed: Optional[int] = None,
+        cancel: Optional[CancelToken] = None,
+        session: Optional[str] = None,
     ) -> AsyncGenerator[dict, None]:
         """
         Generate text completion with streaming.
@@ -117,72 +174,385 @@ class InferenceEngine:
         
         Args:
             model: Loaded Llama model instance
-            prompt: Input text prompt
+            prompt: Input text prompt, or its token ids (skips re-tokenization)
             max_tokens: Maximum tokens to generate
             temperature: Sampling temperature
             top_p: Nucleus sampling parameter
             top_k: Top-K sampling
             repeat_penalty: Repeat penalty
+            seed: Sampling seed (None = random)
+            cancel: Token checked after every sampled token
+            session: Chat session id whose state is restored and saved
             
         Yields:
-            Dictionary with streamed token data
+            Dictionary with streamed token data; the final one also has
+            ``finish_reason`` and the generation's llama.cpp ``perf``
+            counters, and is not counted as a token
         """
         start_time = time.time()
         tokens_generated = 0
+        stream_output = None
+        speculation = []
+        perf = []
+        final = None
         
         try:
-            # Create streaming generator
-            stream_output = model(
+            # Decode on a worker thread; tokens arrive through a queue
+            stream_output = inference_executor.iterate(
+                model,
+                *InferenceEngine._generation_call(model, speculation, session, [], perf),
                 prompt,
                 max_tokens=max_tokens,
                 temperature=temperature,
                 top_p=top_p,
                 top_k=top_k,
                 repeat_penalty=repeat_penalty,
+                seed=seed,
                 stream=True,
+                stopping_criteria=InferenceEngine._stopping_criteria(cancel),
             )
             
-            # Yield tokens as they arrive
-            for chunk in stream_output:
-                token_text = chunk["choices"][0]["text"]
+            # Yield tokens as they arrive; the finish reason is held back until
+            # generation has ended and its perf counters have been read
+            async for chunk in stream_output:
+                choice = chunk["choices"][0]
+                if choice["finish_reason"] is not None:
+                    final = {
+                        "token": choice["text"],
+                        "tokens_so_far": tokens_generated,
+                        "timestamp": time.time(),
+                        "finish_reason": InferenceEngine._finish_reason(choice["finish_reason"], cancel),
+                    }
+                    continue
                 tokens_generated += 1
                 
                 yield {
-                    "token": token_text,
+                    "token": choice["text"],
                     "tokens_so_far": tokens_generated,
                     "timestamp": time.time(),
                 }
             
+            if final is not None:
+                if perf:
+                    final["perf"] = perf[0]
+                yield final
+            
             elapsed = time.time() - start_time
             logger.info(
                 f"Stream completion finished: {tokens_generated} tokens in {elapsed:.2f}s "
                 f"({tokens_generated / elapsed:.2f} tok/s)"
+                + InferenceEngine._speculation_summary(speculation)
             )
         
         except Exception as e:
             logger.error(f"Streaming inference error: {e}")
             raise
+        
+        finally:
+            # Stop the worker promptly if the consumer went away early
+            if stream_output is not None:
+                await stream_output.aclose()
     
     @staticmethod
-    def format_chat_prompt(
+    async def _choices_completion(
+        model: Llama,
+        prompt: Union[str, List[int]],
+        choices: int,
+        max_tokens: int,
+        temperature: float,
+        top_p: float,
+        top_k: int,
+        repeat_penalty: float,
+        seed: Optional[int],
+        stream: bool,
+        cancel: Optional[CancelToken],
+    ):
+        """
+        Generate several completions of one prompt.
+        
+        Streams the token dictionaries of ``_sample_choices`` as they are
+        produced, or collects them into one result listing every choice.
+        """
+        args = (model, prompt, choices, max_tokens, temperature, top_p, top_k, repeat_penalty, seed, cancel)
+        if stream:
+            return inference_executor.iterate(model, InferenceEngine._sample_choices, *args)
+        
+        start_time = time.time()
+        # The generator only runs once iterated, i.e. on the inference thread
+        items = await inference_executor.run(model, list, InferenceEngine._sample_choices(*args))
+        elapsed = time.time() - start_time
+        
+        pieces = [[] for _ in range(choices)]
+        finished = {}
+        first_token = None
+        for item in items:
+            if "finish_reason" in item:
+                finished[item["index"]] = item
+            else:
+                pieces[item["index"]].append(item["token"])
+                if first_token is None:
+                    first_token = item["timestamp"]
+        
+        completion_tokens = sum(item["tokens_so_far"] for item in finished.values())
+        result = {
+            "text": "".join(pieces[0]),
+            "tokens_used": completion_tokens,
+            "total_tokens": finished[0]["prompt_tokens"] + completion_tokens,
+            "elapsed_seconds": elapsed,
+            "tokens_per_second": completion_tokens / elapsed if elapsed > 0 else 0,
+            "finish_reason": finished[0]["finish_reason"],
+            "first_token_seconds": first_token - start_time if first_token is not None else None,
+            "choices": [
+                {
+                    "index": index,
+                    "text": "".join(pieces[index]),
+                    "tokens_used": finished[index]["tokens_so_far"],
+                    "finish_reason": finished[index]["finish_reason"],
+                    "logprob": finished[index]["logprob"],
+                }
+                for index in range(choices)
+            ],
+        }
+        
+        logger.info(
+            f"Completion finished: {choices} choices, {completion_tokens} tokens in {elapsed:.2f}s "
+            f"({result['tokens_per_second']:.2f} tok/s)"
+        )
+        
+        return result
+    
+    @staticmethod
+    def _sample_choices(
+        model: Llama,
+        prompt: Union[str, List[int]],
+        choices: int,
+        max_tokens: int,
+        temperature: float,
+        top_p: float,
+        top_k: int,
+        repeat_penalty: float,
+        seed: Optional[int] = None,
+        cancel: Optional[CancelToken] = None,
+    ):
+        """
+        Sample ``choices`` completions of one prompt on the inference thread.
+        
+        The choices run back to back on the model's context, which keeps
+        the prompt's KV cells between them: the prompt is evaluated once
+        and every further choice re-evaluates only its last token. Choice
+        ``i`` samples with ``seed + i`` when a seed is given.
+        
+        Yields:
+            Token dictionaries tagged with their choice ``index``, and per
+            choice a final one with ``finish_reason``, the cumulative
+            ``logprob`` of its tokens and the prompt length
+        """
+        if isinstance(prompt, list):
+            prompt_tokens = prompt
+        else:
+            prompt_tokens = model.tokenize(prompt.encode(), add_bos=True, special=True)
+        if len(prompt_tokens) + 1 >= model.n_ctx():
+            raise ValueError(f"Prompt of {len(prompt_tokens)} tokens exceeds the context window of {model.n_ctx()}")
+        max_tokens = min(max_tokens, model.n_ctx() - len(prompt_tokens))
+        InferenceEngine._load_cached_prefix(model, prompt_tokens)
+        
+        logprob = ChoiceLogprob()
+        for index in range(choices):
+            model.set_seed(seed + index if seed is not None else random.randrange(2**31))
+            logprob.reset()
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            generated = 0
+            finish_reason = "length"
+            
+            if cancel is not None and cancel.cancelled:
+                # Choices not started when the request was cancelled end empty
+                finish_reason = "cancelled"
+                tokens = ()
+            else:
+                tokens = model.generate(
+                    prompt_tokens,
+                    top_k=top_k,
+                    top_p=top_p,
+                    temp=temperature,
+                    repeat_penalty=repeat_penalty,
+                    logits_processor=LogitsProcessorList([logprob]),
+                )
+            for token in tokens:
+                logprob.accept(token)
+                if llama_cpp.llama_token_is_eog(model._model.model, token):
+                    finish_reason = "stop"
+                    break
+                
+                generated += 1
+                yield {
+                    "token": decoder.decode(model.detokenize([token])),
+                    "index": index,
+                    "tokens_so_far": generated,
+                    "timestamp": time.time(),
+                }
+                
+                if cancel is not None and cancel.cancelled:
+                    finish_reason = "cancelled"
+                    break
+                if generated >= max_tokens:
+                    break
+            
+            yield {
+                "token": "",
+                "index": index,
+                "tokens_so_far": generated,
+                "timestamp": time.time(),
+                "finish_reason": finish_reason,
+                "logprob": logprob.total,
+                "prompt_tokens": len(prompt_tokens),
+            }
+    
+    @staticmethod
+    def _load_cached_prefix(model: Llama, prompt_tokens: List[int]) -> None:
+        """Load the model cache's state for the prompt when it shares a longer prefix than the context."""
+        if model.cache is None:
+            return
+        try:
+            state = model.cache[prompt_tokens]
+        except KeyError:
+            return
+        cached = Llama.longest_token_prefix(state.input_ids[:state.n_tokens].tolist(), prompt_tokens)
+        if cached > Llama.longest_token_prefix(model.input_ids[:model.n_tokens].tolist(), prompt_tokens):
+            model.load_state(state)
+    
+    @staticmethod
+    def _stopping_criteria(cancel: Optional[CancelToken]) -> Optional[StoppingCriteriaList]:
+        """Stop sampling within one token of ``cancel`` being cancelled."""
+        return StoppingCriteriaList([cancel]) if cancel is not None else None
+    
+    @staticmethod
+    def _finish_reason(finish_reason: Optional[str], cancel: Optional[CancelToken]) -> str:
+        """Report a generation stopped by its cancel token as ``cancelled``."""
+        if cancel is not None and cancel.reason is not None:
+            return "cancelled"
+        return finish_reason or "stop"
+    
+    @staticmethod
+    def _speculative_call(model: Llama, speculation: list, *args, **kwargs):
+        """
+        Call the model on the inference thread, counting draft acceptance.
+        
+        When the model has a speculative draft, a fresh stats object is
+        installed right before generation and appended to ``speculation``.
+        """
+        if isinstance(model.draft_model, SpeculativeDraft):
+            speculation.append(model.draft_model.begin())
+        return model(*args, **kwargs)
+    
+    @staticmethod
+    def _generation_call(
+        model: Llama, speculation: list, session: Optional[str], session_info: list, perf: list
+    ) -> tuple:
+        """Callable and leading arguments running one generation on the inference thread."""
+        if session is not None and chat_sessions.enabled:
+            call = (InferenceEngine._session_call, model, session, session_info, speculation)
+        else:
+            call = (InferenceEngine._speculative_call, model, speculation)
+        return (InferenceEngine._measured_call, perf, *call)
+    
+    @staticmethod
+    def _measured_call(perf: list, call, model: Llama, *args, **kwargs):
+        """
+        Run ``call(model, ...)`` on the inference thread and append the
+        generation's llama.cpp perf counters to ``perf``.
+        
+        The context's counters are reset first; a model replica runs one
+        generation at a time, so they cover this generation only. Without
+        a perf counter API in the installed llama_cpp, nothing is appended.
+        """
+        if _read_perf is None:
+            return call(model, *args, **kwargs)
+        _reset_perf(model._ctx.ctx)
+        output = call(model, *args, **kwargs)
+        if kwargs.get("stream"):
+            return InferenceEngine._measure_stream(model, perf, output)
+        perf.append(InferenceEngine._perf_counters(model))
+        return output
+    
+    @staticmethod
+    def _measure_stream(model: Llama, perf: list, chunks):
+        try:
+            yield from chunks
+        finally:
+            perf.append(InferenceEngine._perf_counters(model))
+    
+    @staticmethod
+    def _perf_counters(model: Llama) -> dict:
+        """Prompt-eval and eval time and token counts since the context's last perf reset."""
+        data = _read_perf(model._ctx.ctx)
+        return {
+            "prompt_eval_ms": round(data.t_p_eval_ms, 3),
+            "prompt_eval_tokens": data.n_p_eval,
+            "prompt_eval_ms_per_token": round(data.t_p_eval_ms / data.n_p_eval, 3) if data.n_p_eval else None,
+            "eval_ms": round(data.t_eval_ms, 3),
+            "eval_tokens": data.n_eval,
+            "eval_ms_per_token": round(data.t_eval_ms / data.n_eval, 3) if data.n_eval else None,
+        }
+    
+    @staticmethod
+    def _session_call(model: Llama, session: str, session_info: list, speculation: list, prompt, **kwargs):
+        """
+        Generate within a chat session on the inference thread.
+        
+        The session's saved state is restored first, so only the prompt
+        tokens past the shared prefix are evaluated; the state generation
+        ends in (also when a stream is closed early) is saved for the next
+        turn. Text prompts are not restored but still saved.
+        """
+        prompt_tokens = None
+        if isinstance(prompt, list):
+            session_info.append(chat_sessions.restore(model, session, prompt))
+            prompt_tokens = len(prompt)
+        output = InferenceEngine._speculative_call(model, speculation, prompt, **kwargs)
+        if kwargs.get("stream"):
+            return InferenceEngine._save_after_stream(model, session, prompt_tokens, output)
+        chat_sessions.save(model, session, prompt_tokens)
+        return output
+    
+    @staticmethod
+    def _save_after_stream(model: Llama, session: str, prompt_tokens: Optional[int], chunks):
+        try:
+            yield from chunks
+        except GeneratorExit:
+            chat_sessions.save(model, session, prompt_tokens)
+            raise
+        chat_sessions.save(model, session, prompt_tokens)
+    
+    @staticmethod
+    def _speculation_summary(speculation: list) -> str:
+        if not speculation:
+            return ""
+        stats = speculation[0].to_dict()
+        return (
+            f", {stats['mode']} speculation accepted {stats['accepted_tokens']}/"
+            f"{stats['drafted_tokens']} drafted tokens"
+        )
+    
+    @staticmethod
+    def format_chat_segments(
         messages: list[dict],
         model_name: str = "llama",
-    ) -> str:
+    ) -> list[str]:
         """
-        Convert chat messages to a model-specific prompt format.
+        Render chat messages as consecutive prompt segments.
         
-        This handles role-based formatting for multi-turn conversations.
-        Format varies by model type; this is a generic implementation
-        compatible with most instruction-tuned models.
+        One segment per message plus the trailing generation marker;
+        concatenated they form the full prompt. Keeping messages separate
+        lets their tokenization be cached across turns.
         
         Args:
             messages: List of message dictionaries with 'role' and 'content'
             model_name: Name of model for format selection
             
         Returns:
-            Formatted prompt string
+            Prompt segments in order
         """
-        prompt_parts = []
+        segments = []
         
         for msg in messages:
             role = msg.get("role", "user")
@@ -190,16 +560,114 @@ class InferenceEngine:
             
             # Generic chat format (adjust for specific models)
             if role == "system":
-                prompt_parts.append(f"System: {content}\n")
+                segments.append(f"System: {content}\n\n")
             elif role == "user":
-                prompt_parts.append(f"User: {content}\n")
+                segments.append(f"User: {content}\n\n")
             elif role == "assistant":
-                prompt_parts.append(f"Assistant: {content}\n")
+                segments.append(f"Assistant: {content}\n\n")
         
         # Add prompt marker for next response
-        prompt_parts.append("Assistant:")
+        segments.append("Assistant:")
+        
+        return segments
+    
+    @staticmethod
+    def format_chat_prompt(
+        messages: list[dict],
+        model_name: str = "llama",
+        model: Optional[Llama] = None,
+    ) -> str:
+        """
+        Convert chat messages to a model-specific prompt format.
+        
+        Uses the chat template from the model's GGUF metadata when
+        ``model`` is given and has one; otherwise a generic format
+        compatible with most instruction-tuned models.
+        
+        Args:
+            messages: List of message dictionaries with 'role' and 'content'
+            model_name: Name of model for format selection
+            model: Loaded Llama model instance, for its chat template
+            
+        Returns:
+            Formatted prompt string
+        """
+        template = chat_templates.get(model, model_name) if model is not None else None
+        if template is not None:
+            return template.render(messages)
+        return "".join(InferenceEngine.format_chat_segments(messages, model_name))
+    
+    @staticmethod
+    async def tokenize(
+        model: Llama,
+        text: str,
+    ) -> list[int]:
+        """
+        Tokenize a prompt exactly as generation would.
+        
+        The returned ids can be passed straight to ``generate_completion``
+        so the prompt is tokenized only once per request.
+        
+        Args:
+            model: Loaded Llama model instance
+            text: Prompt text
+            
+        Returns:
+            Token ids including the model's BOS token, if it uses one
+        """
+        return await inference_executor.run(model, model.tokenize, text.encode(), add_bos=True, special=True)
+    
+    @staticmethod
+    async def tokenize_chat(
+        model: Llama,
+        messages: list[dict],
+        model_name: str = "llama",
+    ) -> list[int]:
+        """
+        Tokenize a conversation using the per-message tokenization cache.
+        
+        Messages are rendered with the model's own chat template (see
+        ``chat_templates``), or the generic format without one. Each
+        rendered message is tokenized on its own and cached by content
+        hash, so a long history only costs tokenizing the new turn.
+        Because segments never merge across message boundaries, earlier
+        turns also keep identical token ids as the conversation grows,
+        which keeps prefix KV reuse effective.
+        
+        Args:
+            messages: List of message dictionaries with 'role' and 'content'
+            model_name: Name of model for format selection
+            
+        Returns:
+            Token ids of the full chat prompt
+        
+        Raises:
+            ValueError: The model's chat template rejects the conversation
+        """
+        template = chat_templates.get(model, model_name)
+        if template is not None:
+            segments = template.segments(messages)
+        else:
+            segments = InferenceEngine.format_chat_segments(messages, model_name)
+        cached = [token_cache.get(model, segment) for segment in segments]
+        missing = [segment for segment, tokens in zip(segments, cached) if tokens is None]
+        
+        if missing:
+            def _tokenize_segments() -> list[list[int]]:
+                return [model.tokenize(segment.encode(), add_bos=False, special=True) for segment in missing]
+            
+            fresh = iter(await inference_executor.run(model, _tokenize_segments))
+            for i, tokens in enumerate(cached):
+                if tokens is None:
+                    cached[i] = next(fresh)
+                    token_cache.put(model, segments[i], cached[i])
         
-        return "\n".join(prompt_parts)
+        # Templates usually render the BOS token themselves
+        has_bos = template is not None and template.starts_with_bos(segments)
+        prompt_tokens = [] if has_bos else list(token_cache.bos(model))
+        for tokens in cached:
+            prompt_tokens.extend(tokens)
+        return prompt_tokens
     
     @staticmethod
     async def get_token_count(
@@ -219,7 +687,7 @@ class InferenceEngine:
             Number of tokens in the text
         """
         try:
-            tokens = model.tokenize(text.encode())
+            tokens = await inference_executor.run(model, model.tokenize, text.encode())
             return len(tokens)
         except Exception as e:
             logger.error(f"Token counting error: {e}")
@@ -0,0 +1,387 @@
+"""
+Persistent on-disk KV state store.
+
+Snapshots evaluated prompt prefixes under ``cache_dir`` so prefix reuse
+survives restarts and deploys. Snapshots are keyed by a fingerprint of
+the model file plus the token prefix, read back through mmap, and
+evicted least-recently-used once the store exceeds its size cap.
+"""
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+from llama_cpp.llama import LlamaState
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"NXKVSTA1"
+SNAPSHOT_SUFFIX = ".kvstate"
+_HEADER_LEN = struct.Struct("<I")
+_ALIGNMENT = 64
+
+# Bytes of the GGUF file hashed for its fingerprint; the header region holds
+# architecture, quantization and tokenizer metadata
+FINGERPRINT_BYTES = 16 * 1024 * 1024
+
+_fingerprints: Dict[Tuple[str, int, int], str] = {}
+
+
+def model_fingerprint(model_path: Path) -> str:
+    """
+    Identify a model file for snapshot keying.
+
+    Hashes the file size and the leading header region rather than the
+    whole multi-GB file; results are memoized per (path, size, mtime).
+    """
+    stat = model_path.stat()
+    memo_key = (str(model_path.resolve()), stat.st_size, stat.st_mtime_ns)
+    fingerprint = _fingerprints.get(memo_key)
+    if fingerprint is None:
+        digest = hashlib.sha256(str(stat.st_size).encode())
+        with open(model_path, "rb") as f:
+            digest.update(f.read(FINGERPRINT_BYTES))
+        fingerprint = digest.hexdigest()[:32]
+        _fingerprints[memo_key] = fingerprint
+    return fingerprint
+
+
+def compact_state(state: LlamaState) -> LlamaState:
+    """
+    Drop all but the last row of saved logits.
+
+    After a prefix restore llama-cpp-python always re-evaluates at least
+    the final prompt token, so earlier rows are never read; ``load_state``
+    broadcasts a single row back over the restored range.
+    """
+    if state.scores.ndim == 2 and state.scores.shape[0] > 1:
+        state.scores = state.scores[-1:].copy()
+    return state
+
+
+def _common_length(a: Sequence[int], b: Sequence[int]) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+def read_snapshot_header(path: Path) -> Tuple[dict, int]:
+    """Return the JSON header and the payload offset of a snapshot file."""
+    with open(path, "rb") as f:
+        prefix = f.read(len(MAGIC) + _HEADER_LEN.size)
+        if len(prefix) < len(MAGIC) + _HEADER_LEN.size or prefix[:len(MAGIC)] != MAGIC:
+            raise ValueError("not a KV snapshot")
+        (header_len,) = _HEADER_LEN.unpack(prefix[len(MAGIC):])
+        header = json.loads(f.read(header_len))
+    return header, header["payload_offset"]
+
+
+def read_snapshot(path: Path) -> LlamaState:
+    """Map a snapshot file back into an mmap-backed ``LlamaState``."""
+    header, offset = read_snapshot_header(path)
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    state_size = header["llama_state_size"]
+    n_vocab = header["n_vocab"]
+    tokens = header["tokens"]
+
+    # The llama state stays a zero-copy view of the mapping; load_state
+    # copies straight from the page cache into the context
+    llama_state = memoryview(mapped)[offset:offset + state_size]
+    scores_offset = offset + state_size
+    scores = np.frombuffer(mapped, dtype=np.single, count=n_vocab, offset=scores_offset).reshape(1, n_vocab)
+
+    input_ids = np.zeros(header["n_ctx"], dtype=np.intc)
+    input_ids[:len(tokens)] = tokens
+
+    return LlamaState(
+        input_ids=input_ids,
+        scores=scores,
+        n_tokens=header["n_tokens"],
+        llama_state=llama_state,
+        llama_state_size=state_size,
+    )
+
+
+def write_snapshot(
+    path: Path,
+    state: LlamaState,
+    max_bytes: Optional[int] = None,
+    meta: Optional[dict] = None,
+) -> Optional[int]:
+    """
+    Write ``state`` to a snapshot file, atomically.
+
+    The file is a small JSON header (which carries the evaluated token
+    ids) followed by the raw llama state and the last logits row.
+
+    Args:
+        path: Destination file (its directory must exist)
+        state: State to write
+        max_bytes: Skip the write if the file would be larger
+        meta: Extra JSON-serializable fields stored in the header
+
+    Returns:
+        Size of the file in bytes, or None if it was not written
+    """
+    scores = np.ascontiguousarray(state.scores[-1:], dtype=np.single)
+    header = {
+        "tokens": [int(t) for t in state.input_ids[:state.n_tokens]],
+        "n_tokens": state.n_tokens,
+        "n_ctx": len(state.input_ids),
+        "n_vocab": scores.shape[-1],
+        "llama_state_size": state.llama_state_size,
+        "created": time.time(),
+        **(meta or {}),
+    }
+    header_bytes = json.dumps(header).encode()
+    # Reserve room for the offset field itself, then align the payload
+    payload_offset = len(MAGIC) + _HEADER_LEN.size + len(header_bytes) + 32
+    payload_offset += -payload_offset % _ALIGNMENT
+    header["payload_offset"] = payload_offset
+    header_bytes = json.dumps(header).encode()
+    padding = payload_offset - (len(MAGIC) + _HEADER_LEN.size + len(header_bytes))
+
+    total = payload_offset + state.llama_state_size + scores.nbytes
+    if max_bytes is not None and total > max_bytes:
+        return None
+
+    # A temp file of its own per writer: the prefix cache, the session spill
+    # thread and worker processes may write the same snapshot concurrently
+    with tempfile.NamedTemporaryFile("wb", dir=path.parent, prefix=f"{path.name}.", suffix=".tmp", delete=False) as f:
+        tmp_path = f.name
+        try:
+            f.write(MAGIC)
+            f.write(_HEADER_LEN.pack(len(header_bytes)))
+            f.write(header_bytes)
+            f.write(b"\0" * padding)
+            f.write(memoryview(state.llama_state)[:state.llama_state_size])
+            f.write(scores.tobytes())
+        except BaseException:
+            f.close()
+            os.unlink(tmp_path)
+            raise
+    os.replace(tmp_path, path)
+    return total
+
+
+class _Snapshot:
+    """Index entry for one snapshot file."""
+
+    def __init__(self, path: Path, tokens: Tuple[int, ...], size_bytes: int, last_access: float):
+        self.path = path
+        self.tokens = tokens
+        self.size_bytes = size_bytes
+        self.last_access = last_access
+
+
+class DiskStateStore:
+    """
+    Size-capped directory of llama state snapshots.
+
+    Layout: ``<root>/<model fingerprint>/<prefix hash>.kvstate``. Each file
+    is a small JSON header (which carries the prefix token ids) followed
+    by the raw llama state and the last logits row. The in-memory index
+    is built lazily from file headers on first use.
+    """
+
+    def __init__(self, root: Path, max_bytes: int):
+        """
+        Initialize the store.
+
+        Args:
+            root: Directory holding snapshots (created on first write)
+            max_bytes: Size cap across all models
+        """
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._index: Optional[Dict[str, Dict[Tuple[int, ...], _Snapshot]]] = None
+        self._size_bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.writes = 0
+        self.evictions = 0
+
+    # ------------------------------------------------------------------
+    # Index
+    # ------------------------------------------------------------------
+
+    def _ensure_index(self) -> Dict[str, Dict[Tuple[int, ...], _Snapshot]]:
+        if self._index is not None:
+            return self._index
+
+        self._index = {}
+        self._size_bytes = 0
+        if self.root.exists():
+            for path in self.root.glob(f"*/*{SNAPSHOT_SUFFIX}"):
+                try:
+                    header, _ = read_snapshot_header(path)
+                    stat = path.stat()
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Skipping unreadable KV snapshot {path}: {e}")
+                    continue
+                snapshot = _Snapshot(path, tuple(header["tokens"]), stat.st_size, stat.st_mtime)
+                self._index.setdefault(path.parent.name, {})[snapshot.tokens] = snapshot
+                self._size_bytes += snapshot.size_bytes
+
+        logger.info(
+            f"KV snapshot store: {sum(len(v) for v in self._index.values())} snapshot(s), "
+            f"{self._size_bytes / (1024 * 1024):.1f} MB in {self.root}"
+        )
+        return self._index
+
+    # ------------------------------------------------------------------
+    # Read / write
+    # ------------------------------------------------------------------
+
+    def lookup(
+        self,
+        fingerprint: str,
+        tokens: Sequence[int],
+        min_length: int = 1,
+    ) -> Optional[Tuple[int, LlamaState]]:
+        """
+        Find the snapshot sharing the longest prefix with ``tokens``.
+
+        Args:
+            fingerprint: Model fingerprint
+            tokens: Query token ids
+            min_length: Only return snapshots sharing at least this many tokens
+
+        Returns:
+            (matched token count, mmap-backed state), or None
+        """
+        with self._lock:
+            snapshots = self._ensure_index().get(fingerprint)
+            if not snapshots:
+                return None
+
+            best, best_len = None, min_length - 1
+            for snapshot in snapshots.values():
+                matched = _common_length(snapshot.tokens, tokens)
+                if matched > best_len:
+                    best, best_len = snapshot, matched
+            if best is None:
+                return None
+
+            try:
+                state = read_snapshot(best.path)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Dropping unreadable KV snapshot {best.path}: {e}")
+                self._forget(fingerprint, best)
+                return None
+
+            best.last_access = time.time()
+            try:
+                os.utime(best.path)
+            except OSError:
+                pass
+            self.hits += 1
+            return best_len, state
+
+    def contains(self, fingerprint: str, tokens: Sequence[int]) -> bool:
+        """Whether an exact snapshot of ``tokens`` exists."""
+        with self._lock:
+            return tuple(tokens) in self._ensure_index().get(fingerprint, {})
+
+    def save(self, fingerprint: str, state: LlamaState) -> Optional[Path]:
+        """
+        Write a snapshot of ``state``, keyed by the tokens it evaluated.
+
+        Returns:
+            Path of the snapshot, or None if it does not fit the size cap
+        """
+        tokens = tuple(int(t) for t in state.input_ids[:state.n_tokens])
+        directory = self.root / fingerprint
+        directory.mkdir(parents=True, exist_ok=True)
+        name = hashlib.sha256(np.asarray(tokens, dtype=np.int64).tobytes()).hexdigest()[:32]
+        path = directory / f"{name}{SNAPSHOT_SUFFIX}"
+        total = write_snapshot(path, state, self.max_bytes)
+        if total is None:
+            logger.debug("KV snapshot exceeds store cap; not written")
+            return None
+
+        with self._lock:
+            snapshots = self._ensure_index().setdefault(fingerprint, {})
+            previous = snapshots.get(tokens)
+            if previous is not None:
+                self._size_bytes -= previous.size_bytes
+            snapshots[tokens] = _Snapshot(path, tokens, total, time.time())
+            self._size_bytes += total
+            self.writes += 1
+            self._evict(protect=path)
+
+        logger.info(f"Saved KV snapshot: {len(tokens)} tokens, {total / (1024 * 1024):.1f} MB -> {path.name}")
+        return path
+
+    # ------------------------------------------------------------------
+    # Eviction
+    # ------------------------------------------------------------------
+
+    def _forget(self, fingerprint: str, snapshot: _Snapshot) -> None:
+        self._index.get(fingerprint, {}).pop(snapshot.tokens, None)
+        self._size_bytes -= snapshot.size_bytes
+
+    def _evict(self, protect: Path) -> None:
+        """Delete least-recently-used snapshots until under the size cap."""
+        while self._size_bytes > self.max_bytes:
+            candidates = [
+                (snapshot.last_access, fingerprint, snapshot)
+                for fingerprint, snapshots in self._index.items()
+                for snapshot in snapshots.values()
+                if snapshot.path != protect
+            ]
+            if not candidates:
+                break
+            _, fingerprint, victim = min(candidates, key=lambda c: c[0])
+            self._forget(fingerprint, victim)
+            self.evictions += 1
+            try:
+                victim.path.unlink()
+            except OSError as e:
+                # Still mapped elsewhere (e.g. on Windows); the next scan retries
+                logger.warning(f"Could not delete KV snapshot {victim.path}: {e}")
+
+    def stats(self) -> dict:
+        """Counters for monitoring."""
+        with self._lock:
+            index = self._ensure_index()
+            return {
+                "snapshots": sum(len(v) for v in index.values()),
+                "size_bytes": self._size_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "writes": self.writes,
+                "evictions": self.evictions,
+            }
+
+
+class ModelStateStore:
+    """A ``DiskStateStore`` bound to one model's fingerprint."""
+
+    def __init__(self, store: DiskStateStore, fingerprint: str):
+        self.store = store
+        self.fingerprint = fingerprint
+
+    def lookup(self, tokens: Sequence[int], min_length: int = 1) -> Optional[Tuple[int, LlamaState]]:
+        return self.store.lookup(self.fingerprint, tokens, min_length)
+
+    def contains(self, tokens: Sequence[int]) -> bool:
+        return self.store.contains(self.fingerprint, tokens)
+
+    def save(self, state: LlamaState) -> Optional[Path]:
+        return self.store.save(self.fingerprint, state)
@@ -0,0 +1,395 @@
+"""
+Load-testing benchmark for the inference server.
+
+Sends a mix of streaming and non-streaming completion and chat requests
+through ``GGUFServerClient``, either closed-loop (a fixed number of users,
+each sending its next request when the previous one finishes) or
+open-loop (arrivals at a fixed average rate, whether or not earlier
+requests have finished), and prints throughput and p50/p95/p99 time to
+first token and latency as JSON.
+
+By default the server runs in this process on a loopback port on top of
+the fake llama backend (``fake_llama``), with configurable prompt-eval
+and per-token latency, so server overhead can be compared between
+revisions without a model file. ``--base-url`` targets a running server
+instead.
+
+Run with: python -m python_server.load_test --mode open --rate 20 --duration 30
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+import numpy as np
+
+from . import fake_llama
+from .test_server import GGUFServerClient
+
+FAKE_MODEL = "fake-model.gguf"
+
+# Settings the fake backend cannot serve: they need the real llama_cpp
+FAKE_BACKEND_SETTINGS = {
+    "ENABLE_CONTINUOUS_BATCHING": "false",
+    "WORKER_PROCESSES": "false",
+    "ENABLE_CACHE": "false",
+    "KV_STORE_ENABLED": "false",
+    "KV_WARM_PROMPTS": "[]",
+    "CHAT_SESSION_MEMORY_BYTES": "0",
+    "SEMANTIC_CACHE_ENABLED": "false",
+    "SPECULATIVE_MODELS": "{}",
+    "PRELOAD_MODELS": "[]",
+}
+
+# Defaults for a benchmark run; the environment may override them
+BENCHMARK_DEFAULTS = {
+    "RESPONSE_CACHE_SIZE": "0",
+    "PREFETCH_WEIGHTS": "false",
+    "USE_MLOCK": "false",
+}
+
+WORDS = (
+    "server latency token prompt model cache stream batch queue decode "
+    "context memory thread request answer question summary detail"
+).split()
+
+
+class RequestMix:
+    """Deterministic sequence of benchmark requests."""
+
+    def __init__(self, stream_fraction: float, chat_fraction: float, prompt_words: int, seed: int = 0):
+        self.stream_fraction = stream_fraction
+        self.chat_fraction = chat_fraction
+        self.prompt_words = prompt_words
+        self.rng = random.Random(seed)
+        self.count = 0
+
+    def next(self) -> Dict[str, Any]:
+        """The next request: ``kind`` (``completion`` / ``chat``), ``stream`` and its prompt."""
+        index = self.count
+        self.count += 1
+        text = f"Request {index}: " + " ".join(
+            WORDS[(index + i) % len(WORDS)] for i in range(self.prompt_words)
+        )
+        request = {
+            "kind": "chat" if self.rng.random() < self.chat_fraction else "completion",
+            "stream": self.rng.random() < self.stream_fraction,
+        }
+        if request["kind"] == "chat":
+            request["messages"] = [
+                {"role": "system", "content": "You are a concise assistant."},
+                {"role": "user", "content": text},
+            ]
+        else:
+            request["prompt"] = text
+        return request
+
+
+def _chunk_text(chunk: dict) -> str:
+    choices = chunk.get("choices") or [{}]
+    choice = choices[0]
+    if "delta" in choice:
+        return choice["delta"].get("content") or ""
+    return choice.get("text") or ""
+
+
+async def timed_request(
+    client: GGUFServerClient,
+    request: Dict[str, Any],
+    model: Optional[str],
+    max_tokens: int,
+    scheduled: Optional[float] = None,
+) -> Dict[str, Any]:
+    """
+    Send one request and time it.
+
+    Args:
+        scheduled: ``perf_counter`` time the request was due (open loop);
+            latency counts from then, so client-side delays are not hidden
+
+    Returns:
+        ``kind``, ``stream``, ``ok``, ``status``, ``latency`` and ``ttft``
+        (seconds; ``ttft`` for streams only) and ``completion_tokens``
+    """
+    start = scheduled if scheduled is not None else time.perf_counter()
+    chat = request["kind"] == "chat"
+    record: Dict[str, Any] = {
+        "kind": request["kind"],
+        "stream": request["stream"],
+        "ok": False,
+        "status": None,
+        "ttft": None,
+        "completion_tokens": 0,
+    }
+    try:
+        if request["stream"]:
+            if chat:
+                chunks = client.stream_chat_completions(request["messages"], max_tokens, model)
+            else:
+                chunks = client.stream_completions(request["prompt"], max_tokens, model)
+            async for chunk in chunks:
+                if "error" in chunk:
+                    raise RuntimeError(chunk["error"]["message"])
+                if record["ttft"] is None and _chunk_text(chunk):
+                    record["ttft"] = time.perf_counter() - start
+                if chunk.get("usage"):
+                    record["completion_tokens"] = chunk["usage"]["completion_tokens"]
+        else:
+            if chat:
+                response = await client.chat_completions(request["messages"], model=model, max_tokens=max_tokens)
+            else:
+                response = await client.completions(request["prompt"], model=model, max_tokens=max_tokens)
+            record["completion_tokens"] = response["usage"]["completion_tokens"]
+        record["ok"] = True
+        record["status"] = 200
+    except httpx.HTTPStatusError as e:
+        record["status"] = e.response.status_code
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["latency"] = time.perf_counter() - start
+    return record
+
+
+async def closed_loop(
+    client: GGUFServerClient,
+    mix: RequestMix,
+    users: int,
+    duration: float,
+    model: Optional[str],
+    max_tokens: int,
+) -> List[Dict[str, Any]]:
+    """``users`` concurrent users, each sending requests back to back for ``duration`` seconds."""
+    deadline = time.perf_counter() + duration
+    records: List[Dict[str, Any]] = []
+
+    async def user() -> None:
+        while time.perf_counter() < deadline:
+            records.append(await timed_request(client, mix.next(), model, max_tokens))
+
+    await asyncio.gather(*(user() for _ in range(users)))
+    return records
+
+
+async def open_loop(
+    client: GGUFServerClient,
+    mix: RequestMix,
+    rate: float,
+    duration: float,
+    model: Optional[str],
+    max_tokens: int,
+    poisson: bool = True,
+    seed: int = 0,
+) -> List[Dict[str, Any]]:
+    """
+    Requests arriving at ``rate`` per second for ``duration`` seconds.
+
+    Arrivals are a Poisson process (exponential gaps) or evenly spaced,
+    and do not wait for earlier requests to finish.
+    """
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    arrival = 0.0
+    tasks = []
+    while True:
+        arrival += rng.expovariate(rate) if poisson else 1 / rate
+        if arrival >= duration:
+            break
+        delay = start + arrival - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(
+            timed_request(client, mix.next(), model, max_tokens, scheduled=start + arrival)
+        ))
+    return list(await asyncio.gather(*tasks))
+
+
+def percentiles(values: List[float]) -> Optional[Dict[str, float]]:
+    """p50 / p95 / p99, mean and max of durations in seconds, in milliseconds."""
+    if not values:
+        return None
+    ms = np.asarray(values) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        "p50": round(float(p50), 2),
+        "p95": round(float(p95), 2),
+        "p99": round(float(p99), 2),
+        "mean": round(float(ms.mean()), 2),
+        "max": round(float(ms.max()), 2),
+    }
+
+
+def summarize(records: List[Dict[str, Any]], elapsed: float) -> Dict[str, Any]:
+    """Throughput, errors and TTFT / latency percentiles, overall and per request kind."""
+    ok = [record for record in records if record["ok"]]
+    failed = [record for record in records if not record["ok"]]
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for record in ok:
+        groups.setdefault(f"{record['kind']}/{'stream' if record['stream'] else 'json'}", []).append(record)
+
+    def timings(group: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return {
+            "ttft_ms": percentiles([record["ttft"] for record in group if record["ttft"] is not None]),
+            "latency_ms": percentiles([record["latency"] for record in group]),
+        }
+
+    tokens = sum(record["completion_tokens"] for record in ok)
+    return {
+        "requests": len(records),
+        "succeeded": len(ok),
+        "failed": len(failed),
+        "errors": dict(Counter(str(record["status"] or record.get("error")) for record in failed)),
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput": {
+            "requests_per_second": round(len(ok) / elapsed, 3) if elapsed > 0 else 0.0,
+            "completion_tokens_per_second": round(tokens / elapsed, 1) if elapsed > 0 else 0.0,
+        },
+        **timings(ok),
+        "by_kind": {
+            name: {"requests": len(group), **timings(group)} for name, group in sorted(groups.items())
+        },
+    }
+
+
+def use_fake_backend(cost: fake_llama.FakeProfile, directory: Path) -> str:
+    """
+    Configure this process to serve a placeholder model with the fake llama backend.
+
+    Must run before any other server module is imported.
+
+    Returns:
+        The fake model's name
+    """
+    fake_llama.install(cost)
+    (directory / FAKE_MODEL).write_bytes(b"fake llama model\n")
+    os.environ.update(FAKE_BACKEND_SETTINGS)
+    os.environ["MODEL_PATH"] = str(directory)
+    os.environ["DEFAULT_MODEL"] = FAKE_MODEL
+    os.environ["CACHE_DIR"] = str(directory / "cache")
+    for name, value in BENCHMARK_DEFAULTS.items():
+        os.environ.setdefault(name, value)
+    return FAKE_MODEL
+
+
+class InProcessServer:
+    """The server app on a loopback port, run by uvicorn on its own thread and event loop."""
+
+    def __init__(self, log_level: str = "warning"):
+        self.log_level = log_level
+        self.server = None
+        self.thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> str:
+        import uvicorn
+
+        from .main import app
+
+        for name in ("python_server", "httpx"):
+            logging.getLogger(name).setLevel(self.log_level.upper())
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+        self.server = uvicorn.Server(uvicorn.Config(app, log_level=self.log_level))
+        self.thread = threading.Thread(target=self.server.run, kwargs={"sockets": [sock]}, daemon=True)
+        self.thread.start()
+        while not self.server.started:
+            if not self.thread.is_alive():
+                raise RuntimeError("In-process server failed to start")
+            time.sleep(0.01)
+        return f"http://127.0.0.1:{port}"
+
+    def __exit__(self, *exc_info) -> None:
+        self.server.should_exit = True
+        self.thread.join(timeout=30)
+
+
+async def run_benchmark(args: argparse.Namespace, base_url: str, model: Optional[str]) -> Dict[str, Any]:
+    """Warm up with one request, run the configured load, and build the report."""
+    client = GGUFServerClient(base_url=base_url, timeout=args.timeout)
+    mix = RequestMix(args.stream_fraction, args.chat_fraction, args.prompt_words, args.seed)
+    warmup = await timed_request(client, {**mix.next(), "stream": False}, model, args.max_tokens)
+    if not warmup["ok"]:
+        raise RuntimeError(f"Warm-up request failed: {warmup.get('error') or warmup['status']}")
+
+    start = time.perf_counter()
+    if args.mode == "closed":
+        records = await closed_loop(client, mix, args.users, args.duration, model, args.max_tokens)
+    else:
+        records = await open_loop(
+            client, mix, args.rate, args.duration, model, args.max_tokens, args.arrivals == "poisson", args.seed
+        )
+    elapsed = time.perf_counter() - start
+
+    config = {
+        "mode": args.mode,
+        "duration_seconds": args.duration,
+        "max_tokens": args.max_tokens,
+        "prompt_words": args.prompt_words,
+        "stream_fraction": args.stream_fraction,
+        "chat_fraction": args.chat_fraction,
+        "seed": args.seed,
+    }
+    if args.mode == "closed":
+        config["users"] = args.users
+    else:
+        config.update(rate=args.rate, arrivals=args.arrivals)
+    return {"config": config, **summarize(records, elapsed)}
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Load-test the inference server and report latency percentiles")
+    parser.add_argument("--mode", choices=("closed", "open"), default="closed", help="Arrival pattern")
+    parser.add_argument("--users", type=int, default=8, help="Concurrent users (closed loop)")
+    parser.add_argument("--rate", type=float, default=10.0, help="Requests per second (open loop)")
+    parser.add_argument("--arrivals", choices=("poisson", "uniform"), default="poisson", help="Open-loop arrival gaps")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds of load")
+    parser.add_argument("--max-tokens", type=int, default=32, help="max_tokens per request")
+    parser.add_argument("--prompt-words", type=int, default=32, help="Words per prompt")
+    parser.add_argument("--stream-fraction", type=float, default=0.5, help="Share of streaming requests")
+    parser.add_argument("--chat-fraction", type=float, default=0.5, help="Share of chat requests")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the request mix and arrivals")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request client timeout")
+    parser.add_argument("--base-url", help="Benchmark a running server instead of the in-process fake backend")
+    parser.add_argument("--model", help="Model to request (default: the server's default model)")
+    parser.add_argument("--prompt-ms-per-token", type=float, default=0.5, help="Fake backend prompt-eval latency")
+    parser.add_argument("--ms-per-token", type=float, default=20.0, help="Fake backend per-token decode latency")
+    parser.add_argument("--completion-tokens", type=int, help="Fake backend tokens before end of sequence")
+    parser.add_argument("--log-level", default="warning", help="Server log level with the fake backend")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Run the benchmark and print its JSON report."""
+    args = parse_args(argv)
+    if args.base_url:
+        report = asyncio.run(run_benchmark(args, args.base_url, args.model))
+        report["server"] = {"base_url": args.base_url}
+    else:
+        cost = fake_llama.FakeProfile(args.prompt_ms_per_token, args.ms_per_token, args.completion_tokens)
+        with tempfile.TemporaryDirectory() as directory:
+            model = use_fake_backend(cost, Path(directory))
+            with InProcessServer(args.log_level) as base_url:
+                report = asyncio.run(run_benchmark(args, base_url, args.model or model))
+        report["server"] = {"fake_backend": cost.to_dict()}
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    return report
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
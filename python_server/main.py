@@ -10,16 +10,34 @@ import sys
 import subprocess
 from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Optional, AsyncGenerator
+from typing import Any, Dict, Optional, AsyncGenerator, Tuple
 
-from fastapi import FastAPI, HTTPException, BackgroundTasks, Query
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Query, Header, Request, Response
 from fastapi.responses import StreamingResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
 import uvicorn
 
 from .config import settings, ensure_cache_dir
-from .model_manager import model_manager, LLAMA_CPP_AVAILABLE
-from .inference import InferenceEngine
+from .catalog import model_catalog
+from .batch_jobs import BatchInputError, batch_jobs
+from .chat_sessions import chat_sessions
+from .chat_templates import chat_templates
+from .model_manager import model_manager, ModelLoading, ModelMemoryExhausted, LLAMA_CPP_AVAILABLE
+from .executor import inference_executor
+from .batching import batch_engines
+from .backends import LocalBackend
+from .workers import worker_pool, WorkerCrashed
+from .preload import preloader
+from .cancellation import DEADLINE, DISCONNECT, CancelToken, request_registry, watch_disconnect
+from .embeddings import dumps_embeddings, embedding_key, encode_vector
+from .metrics import CONTENT_TYPE, StreamTimer, metrics
+from .response_cache import response_cache, cache_policy, is_deterministic
+from .sampling import result_choices
+from .semantic_cache import SemanticProbe, semantic_cache
+from .streaming import DONE_EVENT, StreamFormatter, coalesce
+from .tracing import RequestTrace, request_traces
+from .scheduler import request_scheduler, AdmissionRejected
 from .schemas import (
     CompletionRequest,
     ChatCompletionRequest,
@@ -28,6 +46,7 @@ from .schemas import (
     ChatCompletionResponse,
     ChatCompletionChoice,
     ChatMessage,
+    EmbeddingRequest,
     AvailableModels,
     ModelInfo,
     ErrorResponse,
@@ -42,11 +61,12 @@ logger = logging.getLogger(__name__)
 
 def ensure_dependencies():
     """Ensure all required dependencies are installed."""
-    required = ['fastapi', 'uvicorn', 'pydantic', 'llama-cpp-python']
+    # pip package -> import name
+    required = {'fastapi': 'fastapi', 'uvicorn': 'uvicorn', 'pydantic': 'pydantic', 'llama-cpp-python': 'llama_cpp'}
     
-    for pkg in required:
+    for pkg, module in required.items():
         try:
-            __import__(pkg.replace('-', '_'))
+            __import__(module)
         except ImportError:
             logger.warning(f"Installing missing dependency: {pkg}")
             try:
@@ -67,12 +87,43 @@ async def lifespan(app: FastAPI):
     # Initialize directories
     ensure_cache_dir()
     
-    # Verify models exist
+    # Pre-evaluate configured prompt prefixes in the background
+    # (worker processes warm their own model's prompts)
+    warm_task = None
+    if settings.kv_warm_prompts and not settings.worker_processes:
+        warm_task = asyncio.create_task(model_manager.warm_prompt_states())
+    
+    # Load, prefetch and warm up configured models; /ready reports progress
+    preload_task = asyncio.create_task(preloader.run())
+    
+    # Shed idle models under host memory pressure
+    memory_task = asyncio.create_task(model_manager.watch_memory_pressure())
+    # Unload models idle past their TTL
+    idle_task = asyncio.create_task(
+        worker_pool.watch_idle_workers() if settings.worker_processes else model_manager.watch_idle_models()
+    )
+    # Grow and shrink per-model replica pools with queue depth
+    replica_task = asyncio.create_task(model_manager.watch_replica_demand())
+    # Save semantic cache indexes to cache_dir
+    semantic_task = None
+    if semantic_cache.enabled:
+        semantic_task = asyncio.create_task(
+            semantic_cache.persist_periodically(settings.semantic_cache_save_interval)
+        )
+    # Spill idle chat session states to cache_dir (worker processes sweep their own)
+    session_task = None
+    if chat_sessions.enabled and not settings.worker_processes:
+        session_task = asyncio.create_task(chat_sessions.sweep_periodically(settings.memory_poll_interval))
+    
+    # Resume unfinished batch jobs and run new ones in the background
+    await batch_jobs.start()
+    
+    # Verify models exist and index their GGUF headers
     model_dir = Path(settings.model_path)
     if not model_dir.exists():
         logger.error(f"Model directory not found: {model_dir}")
     else:
-        models = list(model_dir.glob("*.gguf"))
+        models = model_catalog.list()
         if models:
             logger.info(f"✓ Found {len(models)} GGUF model(s)")
         else:
@@ -82,7 +133,26 @@ async def lifespan(app: FastAPI):
     
     # Shutdown
     logger.info("🛑 Shutting down GGUF Inference Server")
+    if warm_task is not None and not warm_task.done():
+        warm_task.cancel()
+    if not preload_task.done():
+        preload_task.cancel()
+    memory_task.cancel()
+    idle_task.cancel()
+    replica_task.cancel()
+    if semantic_task is not None:
+        semantic_task.cancel()
+        await asyncio.gather(semantic_task, return_exceptions=True)
+    if session_task is not None:
+        session_task.cancel()
+    # The running batch job resumes from its output file on next start
+    await batch_jobs.close()
+    await worker_pool.stop_all()
     await model_manager.shutdown()
+    batch_engines.close_all()
+    inference_executor.shutdown()
+    # Resident sessions go to disk so they survive the restart
+    await asyncio.to_thread(chat_sessions.close)
 
 
 app = FastAPI(
@@ -101,6 +171,406 @@ app.add_middleware(
 )
 
 
+async def open_backend(model_name: str, load_wait: Optional[float] = None, embedding: bool = False):
+    """
+    Backend serving one request: the model's worker process, or a leased in-process model.
+    
+    Args:
+        model_name: Model to serve the request
+        load_wait: Seconds to wait if the model must be loaded first
+            (None = the ``model_load_wait`` setting; only when that is
+            also None does the request wait until the model is loaded)
+        embedding: Lease the model's embedding-mode instance (in-process;
+            a worker loads its own on the first embedding request)
+    
+    Raises:
+        ModelLoading: The model is still loading after ``load_wait`` seconds
+    """
+    if load_wait is None:
+        load_wait = settings.model_load_wait
+    if settings.worker_processes:
+        return await worker_pool.session(model_name, wait=load_wait)
+    model_key = embedding_key(model_name) if embedding else model_name
+    return LocalBackend(model_name, await model_manager.acquire_model(model_key, wait=load_wait))
+
+
+def sampling_plan(request) -> Tuple[int, int]:
+    """
+    Choices to sample and to return for a request's ``n`` / ``best_of``.
+    
+    Raises:
+        HTTPException: 400 for ``best_of`` below ``n``, more choices than
+            allowed, a streamed ``best_of`` (choices cannot be ranked
+            before they finish), or several streamed choices without
+            continuous batching (they could not be interleaved)
+    """
+    samples = request.best_of or request.n
+    if samples < request.n:
+        raise HTTPException(status_code=400, detail="best_of must be at least n")
+    limit = settings.max_choices
+    if settings.enable_continuous_batching:
+        limit = min(limit, settings.batch_max_sequences)
+    if samples > limit:
+        raise HTTPException(status_code=400, detail=f"At most {limit} choices per request")
+    if request.stream and samples > request.n:
+        raise HTTPException(status_code=400, detail="best_of greater than n cannot be streamed")
+    if request.stream and samples > 1 and not settings.enable_continuous_batching:
+        # The per-request engine decodes choices one after another, so it cannot interleave them
+        raise HTTPException(
+            status_code=400,
+            detail="Streaming several choices requires continuous batching (ENABLE_CONTINUOUS_BATCHING)",
+        )
+    return samples, request.n
+
+
+def usage_block(prompt_tokens: int, result: dict) -> dict:
+    """
+    Usage for a finished generation.
+    
+    Adds the generation rate and, for speculatively decoded models, the
+    draft acceptance counters, so speculation can be tuned per model.
+    Chat session turns also report how many prompt tokens their
+    restored session state saved.
+    """
+    usage = {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": result["tokens_used"],
+        "total_tokens": result["total_tokens"],
+    }
+    if "tokens_per_second" in result:
+        usage["tokens_per_second"] = round(result["tokens_per_second"], 2)
+    if "speculative" in result:
+        usage["speculative"] = result["speculative"]
+    if "session" in result:
+        usage["session"] = result["session"]
+    return usage
+
+
+async def cached_response(
+    model_name: str,
+    kind: str,
+    prompt: Any,
+    request,
+    cache_control: Optional[str],
+) -> Tuple[Optional[str], Optional[dict]]:
+    """
+    Look a deterministic request up in the response cache.
+    
+    Every request field except the prompt, model and ``stream`` is part
+    of the key, so a streamed and a non-streamed request share their
+    entry. Requests sampling several choices are not cached, nor are chat
+    session turns: a hit would skip saving the session's state.
+    
+    Returns:
+        (key to store the result under, or None if it is not cacheable;
+        the cached response on a hit)
+    """
+    lookup, store = cache_policy(cache_control)
+    if not response_cache.enabled or not store or not is_deterministic(request.temperature, request.seed):
+        return None, None
+    if (request.best_of or request.n) > 1:
+        return None, None
+    if getattr(request, "session_id", None) is not None and chat_sessions.enabled:
+        return None, None
+    params = request.model_dump(exclude={"prompt", "messages", "model", "stream", "session_id", "n", "best_of"})
+    key = await response_cache.key(model_name, kind, prompt, params)
+    if key is None or not lookup:
+        return key, None
+    return key, await response_cache.get(model_name, key)
+
+
+def cache_entry(prompt_tokens: int, result: dict) -> Dict[str, Any]:
+    """Response cache entry for a finished generation."""
+    return {
+        "text": result["text"],
+        "finish_reason": result["finish_reason"],
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": result["tokens_used"],
+    }
+
+
+def cache_header(*keys) -> Dict[str, str]:
+    """``X-Cache`` header for a generated response: ``miss`` if any cache will store it."""
+    return {"X-Cache": "miss"} if any(key is not None for key in keys) else {}
+
+
+async def store_response(
+    model_name: str,
+    cache_key: Optional[str],
+    semantic: Optional[SemanticProbe],
+    entry: Dict[str, Any],
+) -> None:
+    """Store a finished generation in the caches it missed."""
+    if cache_key is not None:
+        await response_cache.put(model_name, cache_key, entry)
+    if semantic is not None:
+        await semantic_cache.put(model_name, semantic, entry)
+
+
+async def semantic_lookup(
+    model_name: str,
+    messages: list,
+    cache_control: Optional[str],
+) -> Tuple[Optional[SemanticProbe], Optional[dict], float]:
+    """
+    Look a chat request's last user turn up in the semantic cache.
+    
+    The turn is embedded by ``semantic_cache_embedding_model`` (default: the
+    chat model's embedding instance). If that model is not loaded yet it
+    is loaded in the background and this request goes uncached, so the
+    cache never makes a request wait for a model load.
+    
+    Returns:
+        (probe to store the answer with, or None if not cacheable;
+        the cached answer on a hit; its similarity)
+    """
+    lookup, store = cache_policy(cache_control)
+    if not semantic_cache.enabled or not store or not messages or messages[-1]["role"] != "user":
+        return None, None, 0.0
+    context = await semantic_cache.context_id(model_name, messages)
+    if context is None:
+        return None, None, 0.0
+    
+    embedding_model = settings.semantic_cache_embedding_model or model_name
+    backend = None
+    try:
+        backend = await open_backend(embedding_model, load_wait=0, embedding=True)
+        vectors, _ = await backend.embed([messages[-1]["content"]])
+    except (ModelLoading, ModelMemoryExhausted, WorkerCrashed, FileNotFoundError, ValueError) as e:
+        logger.debug(f"Semantic cache skipped for {model_name}: {e}")
+        return None, None, 0.0
+    finally:
+        if backend is not None:
+            await backend.release()
+    return await semantic_cache.lookup(model_name, embedding_model, context, vectors[0], lookup)
+
+
+def chat_cache_hit(
+    model_name: str,
+    request_id: str,
+    entry: dict,
+    stream: bool,
+    headers: Dict[str, str],
+    http_response: Response,
+):
+    """Chat response (or replayed stream) for a cached answer."""
+    if stream:
+        return StreamingResponse(
+            replay_events(StreamFormatter(f"chatcmpl-{request_id}", model_name, chat=True), entry),
+            media_type="text/event-stream",
+            headers={"X-Request-Id": request_id, **headers},
+        )
+    http_response.headers.update(headers)
+    return ChatCompletionResponse(
+        id=request_id,
+        created=int(time.time()),
+        model=model_name,
+        choices=[
+            ChatCompletionChoice(
+                index=0,
+                message=ChatMessage(role="assistant", content=entry["text"].strip()),
+                finish_reason=entry["finish_reason"],
+            )
+        ],
+        usage=cached_usage(entry),
+    )
+
+
+def cached_usage(entry: dict) -> dict:
+    return {
+        "prompt_tokens": entry["prompt_tokens"],
+        "completion_tokens": entry["completion_tokens"],
+        "total_tokens": entry["prompt_tokens"] + entry["completion_tokens"],
+    }
+
+
+async def replay_events(formatter: StreamFormatter, entry: dict) -> AsyncGenerator[bytes, None]:
+    """Stream a cached response in the same event format as a live generation."""
+    if formatter.chat:
+        yield formatter.role()
+    if entry["text"]:
+        yield formatter.content(entry["text"])
+    yield formatter.final(entry["finish_reason"], cached_usage(entry))
+    yield DONE_EVENT
+
+
+def record_generation(model_name: str, endpoint: str, ticket, prompt_tokens: int, completion_tokens: int, reasons) -> None:
+    """Count a finished generation's tokens and finish reasons and observe its duration."""
+    metrics.prompt_tokens.labels(model_name).inc(prompt_tokens)
+    metrics.completion_tokens.labels(model_name).inc(completion_tokens)
+    for reason in reasons:
+        metrics.finished.labels(model_name, reason).inc()
+    metrics.request_duration.labels(model_name, endpoint).observe(time.time() - ticket.arrived)
+
+
+def trace_requested(header: Optional[str]) -> bool:
+    """Whether an ``X-Request-Trace`` header asks for the request's trace."""
+    return header is not None and header.strip().lower() not in ("", "0", "false", "no")
+
+
+def close_trace(
+    trace: Optional[RequestTrace],
+    http_response: Optional[Response] = None,
+    return_trace: bool = False,
+) -> None:
+    """
+    Finish the trace of a request answered without streaming and keep it.
+    
+    Called from the endpoint's ``finally``, so an exception in flight
+    gives the trace its status code. With ``return_trace`` the phases
+    are added to ``http_response`` as a ``Server-Timing`` header.
+    """
+    if trace is None:
+        return
+    error = sys.exc_info()[1]
+    request_traces.add(trace.finish(200 if error is None else getattr(error, "status_code", 500)))
+    if return_trace and error is None and http_response is not None:
+        http_response.headers["Server-Timing"] = trace.server_timing()
+
+
+async def run_generation(http_request: Request, backend, ticket, cancel: CancelToken, **generate_kwargs) -> dict:
+    """
+    Run a non-streaming generation that stops when its client goes away.
+    
+    A watcher cancels ``cancel`` on client disconnect; the decode loop sees
+    it (or the passed deadline) within one token and returns early.
+    
+    Raises:
+        asyncio.TimeoutError: The request's deadline passed
+    """
+    watcher = asyncio.create_task(watch_disconnect(http_request.receive, cancel))
+    try:
+        result = await asyncio.wait_for(
+            backend.generate(stream=False, cancel=cancel, **generate_kwargs),
+            timeout=ticket.remaining(),
+        )
+    finally:
+        watcher.cancel()
+    cancel.generated = result["tokens_used"]
+    if cancel.reason == DEADLINE:
+        raise asyncio.TimeoutError()
+    return result
+
+
+async def stream_events(
+    backend,
+    ticket,
+    cancel: CancelToken,
+    formatter: StreamFormatter,
+    prompt_tokens: list,
+    release_resources,
+    trace: RequestTrace,
+    max_tokens: int,
+    cache_key: Optional[str] = None,
+    semantic: Optional[SemanticProbe] = None,
+    choices: int = 1,
+    return_trace: bool = False,
+    **generate_kwargs,
+) -> AsyncGenerator[bytes, None]:
+    """
+    Stream a generation as OpenAI-format SSE events.
+    
+    Tokens are coalesced per ``stream_chunk_size`` / ``stream_flush_interval``;
+    the stream ends with a chunk carrying finish reason, usage and timing,
+    then ``[DONE]``. Stops early, with finish reason ``length``, once the
+    request's deadline passes, or ``cancelled`` when cancelled by id; a
+    client disconnect stops generation within one token. With a
+    ``cache_key`` or ``semantic`` probe, a generation that runs to its end
+    is stored in the response or semantic cache. With several ``choices``
+    their tokens are interleaved as chunks tagged with the choice index.
+    The request's ``trace`` is kept when the stream ends, and included in
+    the final chunk with ``return_trace``.
+    """
+    start_time = time.time()
+    timer = StreamTimer(formatter.model, ticket.arrived, start_time, len(prompt_tokens))
+    tokens = 0
+    choice_tokens = [0] * choices
+    pieces = []
+    perf = None
+    completed = False
+    recorded = False
+    endpoint = "chat" if formatter.chat else "completions"
+    try:
+        if formatter.chat:
+            yield formatter.role(choices)
+        source = await backend.generate(
+            prompt=prompt_tokens, max_tokens=max_tokens, stream=True, cancel=cancel, choices=choices, **generate_kwargs
+        )
+        finish_reasons: Dict[int, str] = {}
+        async for batch in coalesce(source, settings.stream_chunk_size, settings.stream_flush_interval):
+            texts: Dict[int, str] = {}
+            for chunk in batch:
+                index = chunk.get("index", 0)
+                if "finish_reason" in chunk:
+                    finish_reasons[index] = chunk["finish_reason"]
+                    perf = chunk.get("perf", perf)
+                else:
+                    tokens += 1
+                    choice_tokens[index] += 1
+                    timer.token(chunk["timestamp"])
+                if chunk["token"]:
+                    texts[index] = texts.get(index, "") + chunk["token"]
+            cancel.generated = tokens
+            for index, text in texts.items():
+                if cache_key is not None or semantic is not None:
+                    pieces.append(text)
+                yield formatter.content(text, index)
+            if cancel.cancelled:
+                break
+        if cancel.reason == DEADLINE:
+            logger.warning(f"Stream exceeded deadline after {tokens} tokens: {formatter.request_id}")
+            reasons = ["length"] * choices
+        elif cancel.reason is not None:
+            reasons = ["cancelled"] * choices
+        else:
+            reasons = [
+                finish_reasons.get(index) or ("length" if choice_tokens[index] >= max_tokens else "stop")
+                for index in range(choices)
+            ]
+        ticket.record(tokens, time.time() - start_time)
+        timer.finish()
+        trace.generation(timer.first - start_time if timer.first is not None else None, perf)
+        trace.info.update(completion_tokens=tokens, finish_reason=reasons if choices > 1 else reasons[0])
+        if cancel.reason is not None:
+            trace.info["cancelled"] = cancel.reason
+        record_generation(formatter.model, endpoint, ticket, len(prompt_tokens), tokens, reasons)
+        recorded = True
+        if cancel.reason is None:
+            await store_response(formatter.model, cache_key, semantic, {
+                "text": "".join(pieces),
+                "finish_reason": reasons[0],
+                "prompt_tokens": len(prompt_tokens),
+                "completion_tokens": tokens,
+            })
+        yield formatter.final(
+            reasons if choices > 1 else reasons[0],
+            {
+                "prompt_tokens": len(prompt_tokens),
+                "completion_tokens": tokens,
+                "total_tokens": len(prompt_tokens) + tokens,
+            },
+            trace.finish().to_dict() if return_trace else None,
+        )
+        yield DONE_EVENT
+        completed = True
+    except Exception as e:
+        completed = True
+        logger.error(f"Streaming error: {e}")
+        trace.finish(500, error=str(e))
+        yield formatter.error(str(e))
+    finally:
+        if not completed:
+            # Closed before the end: the client disconnected
+            cancel.cancel(DISCONNECT)
+            if not recorded:
+                record_generation(
+                    formatter.model, endpoint, ticket, len(prompt_tokens), tokens, ["cancelled"] * choices
+                )
+            trace.finish(499)
+        request_traces.add(trace.finish())
+        await release_resources()
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
@@ -112,25 +582,31 @@ async def health_check():
     }
 
 
+@app.get("/ready")
+async def readiness_check():
+    """
+    Readiness probe: 200 once every preloaded model is loaded and warm, else 503.
+    
+    The body reports each preloaded model's state (pending, loading, ready
+    or failed), load time and whether it is still resident.
+    """
+    status = preloader.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Server metrics in Prometheus text exposition format."""
+    if not settings.enable_metrics:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return Response(content=metrics.render(), media_type=CONTENT_TYPE)
+
+
 @app.get("/v1/models")
 async def list_models() -> AvailableModels:
-    """List available GGUF models."""
+    """List available GGUF models with metadata from their headers."""
     try:
-        model_dir = Path(settings.model_path)
-        
-        if not model_dir.exists():
-            return AvailableModels(data=[])
-        
-        models = []
-        for model_file in model_dir.glob("*.gguf"):
-            stat = model_file.stat()
-            models.append(
-                ModelInfo(
-                    name=model_file.name,
-                    size_bytes=stat.st_size,
-                    created=int(stat.st_mtime),
-                )
-            )
+        models = [ModelInfo(**entry.to_dict()) for entry in model_catalog.list()]
         
         logger.info(f"Found {len(models)} available models")
         return AvailableModels(data=models)
@@ -141,57 +617,143 @@ async def list_models() -> AvailableModels:
 
 
 @app.post("/v1/completions")
-async def create_completion(request: CompletionRequest):
+async def create_completion(
+    request: CompletionRequest,
+    http_request: Request,
+    http_response: Response,
+    x_request_timeout: Optional[float] = Header(None),
+    x_load_wait: Optional[float] = Header(None),
+    x_request_id: Optional[str] = Header(None),
+    x_request_trace: Optional[str] = Header(None),
+    cache_control: Optional[str] = Header(None),
+):
     """Create text completion from a prompt."""
+    ticket = None
+    backend = None
+    cancel = None
+    trace = None
+    streaming = False
+    
+    async def release_resources():
+        if cancel is not None:
+            request_registry.close(cancel)
+        if backend is not None:
+            await backend.release()
+        if ticket is not None:
+            ticket.release()
+    
     try:
         if not LLAMA_CPP_AVAILABLE:
             raise HTTPException(status_code=503, detail="llama-cpp-python not available")
         
         model_name = request.model or settings.default_model
         logger.info(f"Completion request: model={model_name}")
+        metrics.requests.labels(model_name, "completions").inc()
+        trace = RequestTrace(x_request_id or str(uuid.uuid4()), model_name, "completions")
+        trace.info["stream"] = request.stream
+        samples, n = sampling_plan(request)
+        
+        # Deterministic repeats are answered before admission and model load
+        cache_key, cached = await cached_response(model_name, "completion", request.prompt, request, cache_control)
+        trace.phase("cache_lookup")
+        if cached is not None:
+            request_id = trace.request_id
+            trace.info["cache"] = "hit"
+            if request.stream:
+                return StreamingResponse(
+                    replay_events(StreamFormatter(f"cmpl-{request_id}", model_name, chat=False), cached),
+                    media_type="text/event-stream",
+                    headers={"X-Request-Id": request_id, "X-Cache": "hit"},
+                )
+            http_response.headers["X-Cache"] = "hit"
+            return CompletionResponse(
+                id=request_id,
+                created=int(time.time()),
+                model=model_name,
+                choices=[CompletionChoice(index=0, text=cached["text"], finish_reason=cached["finish_reason"])],
+                usage=cached_usage(cached),
+            )
+        
+        # Every sampled choice decodes up to max_tokens
+        ticket = await request_scheduler.acquire(model_name, request.max_tokens * samples, x_request_timeout)
+        trace.phase("queue")
+        backend = await open_backend(model_name, x_load_wait)
+        trace.phase("load")
         
-        model = await model_manager.load_model(model_name)
+        # Tokenize once; the ids feed both the context check and generation
+        if isinstance(request.prompt, list):
+            prompt_tokens = request.prompt
+            try:
+                backend.check_tokens(prompt_tokens)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+        else:
+            prompt_tokens = await backend.tokenize(request.prompt)
+        trace.phase("tokenize")
         
-        token_count = await InferenceEngine.get_token_count(model, request.prompt)
+        token_count = len(prompt_tokens)
+        trace.info["prompt_tokens"] = token_count
         if token_count + request.max_tokens > settings.context_length:
             raise HTTPException(
                 status_code=400,
                 detail=f"Prompt exceeds context length",
             )
         
-        request_id = str(uuid.uuid4())
+        # Clients may supply the id they will later cancel the request by
+        request_id = trace.request_id
+        cancel = request_registry.open(request_id, request.max_tokens * samples, ticket.remaining())
         
         if request.stream:
-            async def event_generator() -> AsyncGenerator[str, None]:
-                try:
-                    async for chunk in await InferenceEngine.generate_completion(
-                        model=model,
-                        prompt=request.prompt,
-                        max_tokens=request.max_tokens,
-                        temperature=request.temperature,
-                        top_p=request.top_p,
-                        top_k=request.top_k,
-                        repeat_penalty=request.repeat_penalty,
-                        stream=True,
-                    ):
-                        yield f"data: {chunk}\n\n"
-                except Exception as e:
-                    logger.error(f"Streaming error: {e}")
-                    yield f"data: {{'error': '{str(e)}'}}\n\n"
-            
-            return StreamingResponse(event_generator(), media_type="text/event-stream")
+            streaming = True
+            return StreamingResponse(
+                stream_events(
+                    backend,
+                    ticket,
+                    cancel,
+                    StreamFormatter(f"cmpl-{request_id}", model_name, chat=False),
+                    prompt_tokens,
+                    release_resources,
+                    trace,
+                    max_tokens=request.max_tokens,
+                    cache_key=cache_key,
+                    choices=samples,
+                    return_trace=trace_requested(x_request_trace),
+                    temperature=request.temperature,
+                    top_p=request.top_p,
+                    top_k=request.top_k,
+                    repeat_penalty=request.repeat_penalty,
+                    seed=request.seed,
+                ),
+                media_type="text/event-stream",
+                headers={"X-Request-Id": request_id, **cache_header(cache_key)},
+                background=BackgroundTask(release_resources),
+            )
         
         else:
-            result = await InferenceEngine.generate_completion(
-                model=model,
-                prompt=request.prompt,
+            http_response.headers.update({"X-Request-Id": request_id, **cache_header(cache_key)})
+            result = await run_generation(
+                http_request,
+                backend,
+                ticket,
+                cancel,
+                prompt=prompt_tokens,
                 max_tokens=request.max_tokens,
                 temperature=request.temperature,
                 top_p=request.top_p,
                 top_k=request.top_k,
                 repeat_penalty=request.repeat_penalty,
-                stream=False,
+                seed=request.seed,
+                choices=samples,
             )
+            ticket.record(result["tokens_used"], result["elapsed_seconds"])
+            trace.generation(result.get("first_token_seconds"), result.get("perf"))
+            trace.info.update(completion_tokens=result["tokens_used"], finish_reason=result["finish_reason"])
+            record_generation(
+                model_name, "completions", ticket, token_count, result["tokens_used"],
+                [choice["finish_reason"] for choice in result.get("choices", [result])],
+            )
+            if cache_key is not None and cancel.reason is None:
+                await response_cache.put(model_name, cache_key, cache_entry(token_count, result))
             
             response = CompletionResponse(
                 id=request_id,
@@ -199,83 +761,196 @@ async def create_completion(request: CompletionRequest):
                 model=model_name,
                 choices=[
                     CompletionChoice(
-                        index=0,
-                        text=result["text"],
-                        finish_reason="stop",
+                        index=choice["index"],
+                        text=choice["text"],
+                        finish_reason=choice["finish_reason"],
                     )
+                    for choice in result_choices(result, n)
                 ],
-                usage={
-                    "prompt_tokens": token_count,
-                    "completion_tokens": result["tokens_used"],
-                    "total_tokens": result["total_tokens"],
-                },
+                usage=usage_block(token_count, result),
             )
             
             return response
     
     except HTTPException:
         raise
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.message,
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except ModelMemoryExhausted as e:
+        logger.warning(str(e))
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except ModelLoading as e:
+        logger.info(str(e))
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except WorkerCrashed as e:
+        logger.error(str(e))
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": "1"},
+        )
+    except asyncio.TimeoutError:
+        if cancel is not None:
+            cancel.cancel(DEADLINE)
+        logger.warning(f"Completion exceeded deadline: model={model_name}")
+        raise HTTPException(status_code=504, detail="Request exceeded deadline")
     except FileNotFoundError as e:
         logger.error(f"Model not found: {e}")
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         logger.error(f"Completion error: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if not streaming:
+            await release_resources()
+            close_trace(trace, http_response, trace_requested(x_request_trace))
 
 
 @app.post("/v1/chat/completions")
-async def create_chat_completion(request: ChatCompletionRequest):
+async def create_chat_completion(
+    request: ChatCompletionRequest,
+    http_request: Request,
+    http_response: Response,
+    x_request_timeout: Optional[float] = Header(None),
+    x_load_wait: Optional[float] = Header(None),
+    x_request_id: Optional[str] = Header(None),
+    x_request_trace: Optional[str] = Header(None),
+    cache_control: Optional[str] = Header(None),
+):
     """Create chat completion from messages."""
+    ticket = None
+    backend = None
+    cancel = None
+    trace = None
+    streaming = False
+    
+    async def release_resources():
+        if cancel is not None:
+            request_registry.close(cancel)
+        if backend is not None:
+            await backend.release()
+        if ticket is not None:
+            ticket.release()
+    
     try:
         if not LLAMA_CPP_AVAILABLE:
             raise HTTPException(status_code=503, detail="llama-cpp-python not available")
         
         model_name = request.model or settings.default_model
         logger.info(f"Chat completion: model={model_name}, messages={len(request.messages)}")
+        metrics.requests.labels(model_name, "chat").inc()
+        trace = RequestTrace(x_request_id or str(uuid.uuid4()), model_name, "chat")
+        trace.info["stream"] = request.stream
+        samples, n = sampling_plan(request)
         
-        model = await model_manager.load_model(model_name)
+        messages = [msg.model_dump() for msg in request.messages]
+        # Session turns restore the session's KV state and evaluate only new tokens
+        # (several choices cannot all continue one session); they bypass the caches
+        session = request.session_id if chat_sessions.enabled and samples == 1 else None
+        cache_key, cached = await cached_response(model_name, "chat", messages, request, cache_control)
+        if cached is not None:
+            request_id = trace.request_id
+            trace.phase("cache_lookup")
+            trace.info["cache"] = "hit"
+            return chat_cache_hit(model_name, request_id, cached, request.stream, {"X-Cache": "hit"}, http_response)
         
-        prompt = InferenceEngine.format_chat_prompt(
-            [msg.model_dump() for msg in request.messages],
-            model_name=model_name,
-        )
+        semantic, answer, similarity = None, None, 0.0
+        if samples == 1 and session is None:
+            semantic, answer, similarity = await semantic_lookup(model_name, messages, cache_control)
+        trace.phase("cache_lookup")
+        if answer is not None:
+            request_id = trace.request_id
+            trace.info["cache"] = "semantic-hit"
+            logger.info(f"Semantic cache hit: model={model_name}, similarity={similarity:.4f}")
+            headers = {"X-Cache": "semantic-hit", "X-Cache-Similarity": f"{similarity:.4f}"}
+            return chat_cache_hit(model_name, request_id, answer, request.stream, headers, http_response)
+        
+        # Every sampled choice decodes up to max_tokens
+        ticket = await request_scheduler.acquire(model_name, request.max_tokens * samples, x_request_timeout)
+        trace.phase("queue")
+        backend = await open_backend(model_name, x_load_wait)
+        trace.phase("load")
+        
+        prompt_tokens = await backend.tokenize_chat(messages)
+        trace.phase("tokenize")
         
-        token_count = await InferenceEngine.get_token_count(model, prompt)
+        token_count = len(prompt_tokens)
+        trace.info["prompt_tokens"] = token_count
         if token_count + request.max_tokens > settings.context_length:
             raise HTTPException(status_code=400, detail="Messages exceed context length")
         
-        request_id = str(uuid.uuid4())
+        # Clients may supply the id they will later cancel the request by
+        request_id = trace.request_id
+        cancel = request_registry.open(request_id, request.max_tokens * samples, ticket.remaining())
+        
+        headers = {"X-Request-Id": request_id, **cache_header(cache_key, semantic)}
+        if session is not None:
+            headers["X-Session-Id"] = session
         
         if request.stream:
-            async def event_generator() -> AsyncGenerator[str, None]:
-                try:
-                    async for chunk in await InferenceEngine.generate_completion(
-                        model=model,
-                        prompt=prompt,
-                        max_tokens=request.max_tokens,
-                        temperature=request.temperature,
-                        top_p=request.top_p,
-                        top_k=request.top_k,
-                        stream=True,
-                    ):
-                        token = chunk["token"]
-                        yield f'data: {{"delta": {{"content": "{token}"}}, "index": 0}}\n\n'
-                except Exception as e:
-                    logger.error(f"Chat streaming error: {e}")
-                    yield f"data: {{'error': '{str(e)}'}}\n\n"
-            
-            return StreamingResponse(event_generator(), media_type="text/event-stream")
+            streaming = True
+            return StreamingResponse(
+                stream_events(
+                    backend,
+                    ticket,
+                    cancel,
+                    StreamFormatter(f"chatcmpl-{request_id}", model_name, chat=True),
+                    prompt_tokens,
+                    release_resources,
+                    trace,
+                    max_tokens=request.max_tokens,
+                    cache_key=cache_key,
+                    semantic=semantic,
+                    choices=samples,
+                    return_trace=trace_requested(x_request_trace),
+                    temperature=request.temperature,
+                    top_p=request.top_p,
+                    top_k=request.top_k,
+                    seed=request.seed,
+                    session=session,
+                ),
+                media_type="text/event-stream",
+                headers=headers,
+                background=BackgroundTask(release_resources),
+            )
         
         else:
-            result = await InferenceEngine.generate_completion(
-                model=model,
-                prompt=prompt,
+            http_response.headers.update(headers)
+            result = await run_generation(
+                http_request,
+                backend,
+                ticket,
+                cancel,
+                prompt=prompt_tokens,
                 max_tokens=request.max_tokens,
                 temperature=request.temperature,
                 top_p=request.top_p,
                 top_k=request.top_k,
-                stream=False,
+                seed=request.seed,
+                session=session,
+                choices=samples,
             )
+            ticket.record(result["tokens_used"], result["elapsed_seconds"])
+            trace.generation(result.get("first_token_seconds"), result.get("perf"))
+            trace.info.update(completion_tokens=result["tokens_used"], finish_reason=result["finish_reason"])
+            record_generation(
+                model_name, "chat", ticket, token_count, result["tokens_used"],
+                [choice["finish_reason"] for choice in result.get("choices", [result])],
+            )
+            if cancel.reason is None:
+                await store_response(model_name, cache_key, semantic, cache_entry(token_count, result))
             
             response = ChatCompletionResponse(
                 id=request_id,
@@ -283,68 +958,440 @@ async def create_chat_completion(request: ChatCompletionRequest):
                 model=model_name,
                 choices=[
                     ChatCompletionChoice(
-                        index=0,
+                        index=choice["index"],
                         message=ChatMessage(
                             role="assistant",
-                            content=result["text"].strip(),
+                            content=choice["text"].strip(),
                         ),
-                        finish_reason="stop",
+                        finish_reason=choice["finish_reason"],
                     )
+                    for choice in result_choices(result, n)
                 ],
-                usage={
-                    "prompt_tokens": token_count,
-                    "completion_tokens": result["tokens_used"],
-                    "total_tokens": result["total_tokens"],
-                },
+                usage=usage_block(token_count, result),
             )
             
             return response
     
     except HTTPException:
         raise
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.message,
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except ModelMemoryExhausted as e:
+        logger.warning(str(e))
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except ModelLoading as e:
+        logger.info(str(e))
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except WorkerCrashed as e:
+        logger.error(str(e))
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": "1"},
+        )
+    except asyncio.TimeoutError:
+        if cancel is not None:
+            cancel.cancel(DEADLINE)
+        logger.warning(f"Chat completion exceeded deadline: model={model_name}")
+        raise HTTPException(status_code=504, detail="Request exceeded deadline")
+    except ValueError as e:
+        # Raised by the model's chat template for conversations it rejects
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Chat completion error: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if not streaming:
+            await release_resources()
+            close_trace(trace, http_response, trace_requested(x_request_trace))
+
+
+@app.post("/v1/embeddings")
+async def create_embeddings(
+    request: EmbeddingRequest,
+    x_load_wait: Optional[float] = Header(None),
+    x_request_timeout: Optional[float] = Header(None),
+    x_request_trace: Optional[str] = Header(None),
+):
+    """
+    Embed one input or an array of inputs, batched by length.
+    
+    Admitted through the scheduler like generations, on a queue of the
+    model's embedding instance weighted by input tokens (estimated from
+    text length until tokenized).
+    """
+    backend = None
+    ticket = None
+    trace = None
+    try:
+        if not LLAMA_CPP_AVAILABLE:
+            raise HTTPException(status_code=503, detail="llama-cpp-python not available")
+        
+        model_name = request.model or settings.default_model
+        metrics.requests.labels(model_name, "embeddings").inc()
+        trace = RequestTrace(str(uuid.uuid4()), model_name, "embeddings")
+        inputs = request.input
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        if not inputs:
+            raise HTTPException(status_code=400, detail="No input to embed")
+        if len(inputs) > settings.max_embedding_inputs:
+            raise HTTPException(
+                status_code=400,
+                detail=f"At most {settings.max_embedding_inputs} inputs per request",
+            )
+        
+        weight = sum(len(item) if isinstance(item, list) else len(item) // 4 + 1 for item in inputs)
+        ticket = await request_scheduler.acquire(embedding_key(model_name), weight, x_request_timeout)
+        trace.phase("queue")
+        backend = await open_backend(model_name, x_load_wait, embedding=True)
+        trace.phase("load")
+        start_time = time.perf_counter()
+        vectors, tokens = await asyncio.wait_for(backend.embed(inputs, request.normalize), ticket.remaining())
+        elapsed = time.perf_counter() - start_time
+        ticket.record(tokens, elapsed)
+        trace.phase("embed")
+        trace.info.update(inputs=len(inputs), prompt_tokens=tokens)
+        metrics.prompt_tokens.labels(model_name).inc(tokens)
+        metrics.request_duration.labels(model_name, "embeddings").observe(elapsed)
+        logger.info(
+            f"Embedded {len(inputs)} input(s), {tokens} tokens in {elapsed:.3f}s "
+            f"({len(inputs) / elapsed if elapsed > 0 else 0:.1f} embeddings/s)"
+        )
+        
+        body = {
+            "object": "list",
+            "data": [
+                {"object": "embedding", "index": index, "embedding": encode_vector(vector, request.encoding_format)}
+                for index, vector in enumerate(vectors)
+            ],
+            "model": model_name,
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+        headers = {"Server-Timing": trace.finish().server_timing()} if trace_requested(x_request_trace) else None
+        return Response(content=dumps_embeddings(body), media_type="application/json", headers=headers)
+    
+    except HTTPException:
+        raise
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.message,
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except ModelMemoryExhausted as e:
+        logger.warning(str(e))
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except ModelLoading as e:
+        logger.info(str(e))
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except WorkerCrashed as e:
+        logger.error(str(e))
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": "1"},
+        )
+    except asyncio.TimeoutError:
+        logger.warning(f"Embedding exceeded deadline: model={model_name}")
+        raise HTTPException(status_code=504, detail="Request exceeded deadline")
+    except FileNotFoundError as e:
+        logger.error(f"Model not found: {e}")
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Embedding error: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if backend is not None:
+            await backend.release()
+        if ticket is not None:
+            ticket.release()
+        close_trace(trace)
+
+
+@app.post("/v1/requests/{request_id}/cancel")
+async def cancel_request(request_id: str):
+    """
+    Cancel an in-flight completion by id.
+    
+    Accepts the ``X-Request-Id`` value or a completion id (``cmpl-``/``chatcmpl-``
+    prefixed). Generation stops within one token: a non-streaming request
+    returns its partial text, a stream ends, both with finish reason ``cancelled``.
+    """
+    for prefix in ("chatcmpl-", "cmpl-"):
+        if request_id.startswith(prefix) and request_id not in request_registry.active:
+            request_id = request_id[len(prefix):]
+            break
+    if not request_registry.cancel(request_id):
+        raise HTTPException(status_code=404, detail=f"No in-flight request {request_id}")
+    return {"status": "cancelling", "id": request_id, "timestamp": time.time()}
+
+
+@app.get("/v1/requests")
+async def active_requests():
+    """In-flight request ids and cancellation counters, including tokens saved."""
+    return {
+        **request_registry.stats(),
+        "requests": [
+            {
+                "id": token.request_id,
+                "max_tokens": token.max_tokens,
+                "generated": token.generated,
+                "remaining_seconds": round(token.remaining(), 3) if token.deadline is not None else None,
+            }
+            for token in request_registry.active.values()
+        ],
+        "timestamp": time.time(),
+    }
+
+
+@app.get("/debug/requests")
+async def debug_requests(limit: int = Query(20, ge=1, le=1000)):
+    """
+    Phase timings of the slowest and the most recent finished requests.
+    
+    Both lists come from the last ``request_trace_buffer`` requests.
+    """
+    return {
+        "slowest": request_traces.slowest(limit),
+        "recent": request_traces.recent(limit),
+        "buffer_size": request_traces.size,
+        "timestamp": time.time(),
+    }
+
+
+@app.delete("/v1/sessions/{session_id}")
+async def delete_session(session_id: str):
+    """End a chat session, freeing its saved KV state in memory and on disk."""
+    if settings.worker_processes:
+        found = await worker_pool.delete_chat_session(session_id)
+    else:
+        found = await asyncio.to_thread(chat_sessions.delete, session_id)
+    if not found:
+        raise HTTPException(status_code=404, detail=f"No chat session {session_id}")
+    return {"status": "deleted", "id": session_id, "timestamp": time.time()}
+
+
+@app.post("/v1/batches")
+async def create_batch(http_request: Request, model: Optional[str] = Query(None)):
+    """
+    Submit a batch job: the request body is a JSONL file of completion or chat requests.
+    
+    Each line is an OpenAI-style batch entry (``custom_id``, ``url``, ``body``)
+    or a bare request body. ``model`` applies to lines naming no model.
+    The job runs in the background below interactive traffic.
+    """
+    try:
+        job = await batch_jobs.submit(await http_request.body(), model)
+    except (BatchInputError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return job.status_dict()
+
+
+@app.get("/v1/batches")
+async def list_batches():
+    """Status and throughput of every batch job, newest first."""
+    return {"data": batch_jobs.list_jobs(), "timestamp": time.time()}
+
+
+@app.get("/v1/batches/{job_id}")
+async def get_batch(job_id: str):
+    """Status, request counts and throughput of a batch job."""
+    job = batch_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No batch job {job_id}")
+    return job.status_dict()
+
+
+@app.get("/v1/batches/{job_id}/output")
+async def get_batch_output(job_id: str):
+    """Results so far, one JSON object per line, in the order requests finished."""
+    job = batch_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No batch job {job_id}")
+    return StreamingResponse(
+        job.iter_output(),
+        media_type="application/jsonl",
+        headers={"Content-Disposition": f'attachment; filename="{job_id}.jsonl"'},
+    )
+
+
+@app.post("/v1/batches/{job_id}/cancel")
+async def cancel_batch(job_id: str):
+    """Cancel a batch job; requests in flight stop within one token, finished results are kept."""
+    job = batch_jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No batch job {job_id}")
+    return job.status_dict()
 
 
 @app.post("/v1/models/{model_name}/unload")
 async def unload_model(model_name: str):
     """Unload a specific model from memory."""
     try:
-        await model_manager.unload_model(model_name)
+        if settings.worker_processes:
+            await worker_pool.stop(model_name)
+        else:
+            await model_manager.unload_model(model_name)
         return {"status": "unloaded", "model": model_name, "timestamp": time.time()}
     except Exception as e:
         logger.error(f"Unload error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/v1/models/{model_name}/load")
+async def load_model(model_name: str, wait: float = Query(0, ge=0)):
+    """
+    Load a model in the background.
+    
+    Returns 200 once the model is loaded (waiting up to ``wait`` seconds),
+    otherwise 202 with load progress and a Retry-After estimate.
+    """
+    try:
+        if settings.worker_processes:
+            backend = await worker_pool.session(model_name, wait=wait)
+        else:
+            backend = LocalBackend(model_name, await model_manager.acquire_model(model_name, wait=wait))
+        await backend.release()
+        return {"status": "loaded", "model": model_name, "timestamp": time.time()}
+    except ModelLoading as e:
+        return JSONResponse(
+            status_code=202,
+            content={"status": "loading", "model": model_name, "progress": e.progress},
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ModelMemoryExhausted as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except Exception as e:
+        logger.error(f"Load error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/v1/models/loading")
+async def loading_models():
+    """Progress of model loads in flight (phase, bytes prefetched, elapsed and expected time)."""
+    loads = worker_pool.load_progress() if settings.worker_processes else model_manager.load_progress()
+    return {"loads": loads, "timestamp": time.time()}
+
+
+@app.post("/v1/models/{model_name}/pin")
+async def pin_model(model_name: str):
+    """Exempt a model from cache eviction."""
+    model_manager.pin_model(model_name)
+    worker_pool.pinned.add(model_name)
+    return {"status": "pinned", "model": model_name, "timestamp": time.time()}
+
+
+@app.post("/v1/models/{model_name}/unpin")
+async def unpin_model(model_name: str):
+    """Allow a pinned model to be evicted again."""
+    model_manager.unpin_model(model_name)
+    worker_pool.pinned.discard(model_name)
+    return {"status": "unpinned", "model": model_name, "timestamp": time.time()}
+
+
+@app.get("/v1/models/loaded")
+async def loaded_models():
+    """Loaded models with their memory footprint, leases and pin state."""
+    if settings.worker_processes:
+        return {"workers": await worker_pool.stats(), "timestamp": time.time()}
+    return {**model_manager.memory_stats(), "timestamp": time.time()}
+
+
 @app.post("/v1/cache/clear")
 async def clear_cache():
     """Clear all cached models and free resources."""
     try:
+        await worker_pool.stop_all()
         await model_manager.cache.clear()
+        await response_cache.clear()
+        await semantic_cache.clear()
         return {"status": "cleared", "timestamp": time.time()}
     except Exception as e:
         logger.error(f"Cache clear error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/v1/cache/stats")
+async def cache_stats():
+    """Prefix KV cache hit/miss/saved-token counters per loaded model, response / semantic cache hit rates and chat session counters."""
+    models = model_manager.prefix_cache_stats()
+    disk = model_manager.kv_store_stats()
+    sessions = chat_sessions.stats()
+    if settings.worker_processes:
+        # Each worker keeps its own model's sessions
+        sessions = {}
+        for model_name, worker in (await worker_pool.stats()).items():
+            models.update(worker.get("prefix_cache", {}))
+            disk = worker.get("disk", disk)
+            if "chat_sessions" in worker:
+                sessions[model_name] = worker["chat_sessions"]
+    return {
+        "enabled": settings.enable_cache,
+        "models": models,
+        "disk": disk,
+        "responses": response_cache.stats(),
+        "semantic": semantic_cache.stats(),
+        "sessions": sessions,
+        "chat_templates": chat_templates.stats(),
+        "timestamp": time.time(),
+    }
+
+
 @app.post("/v1/tokenize")
 async def tokenize(text: str = Query(...), model: Optional[str] = Query(None)):
     """Tokenize text using the model's tokenizer."""
+    backend = None
     try:
         model_name = model or settings.default_model
-        loaded_model = await model_manager.load_model(model_name)
-        token_count = await InferenceEngine.get_token_count(loaded_model, text)
+        backend = await open_backend(model_name)
+        token_count = await backend.count_tokens(text)
         
         return {
             "model": model_name,
             "token_count": token_count,
             "text_length": len(text),
         }
+    except ModelLoading as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
     except Exception as e:
         logger.error(f"Tokenization error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if backend is not None:
+            await backend.release()
 
 
 @app.exception_handler(HTTPException)
@@ -359,6 +1406,7 @@ async def http_exception_handler(request, exc):
                 "type": "http_error",
             }
         ).model_dump(),
+        headers=getattr(exc, "headers", None),
     )
 
 
@@ -0,0 +1,155 @@
+"""
+Host memory accounting for loaded models.
+
+Reads ``/proc/meminfo`` for host memory pressure and ``/proc/self/smaps``
+for how much of a memory-mapped GGUF file is actually resident. On
+platforms without procfs the readers return None and callers fall back
+to file sizes. ``prefetch_file`` pulls model files into the page cache
+before a load.
+"""
+
+import logging
+import mmap
+import os
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+import llama_cpp
+
+logger = logging.getLogger(__name__)
+
+MEMINFO_PATH = Path("/proc/meminfo")
+SMAPS_PATH = Path("/proc/self/smaps")
+
+# Read size when prefetching model files with progress or a rate cap
+PREFETCH_CHUNK_BYTES = 16 * 1024**2
+
+
+def read_meminfo() -> Optional[Dict[str, int]]:
+    """Parse ``/proc/meminfo`` into byte counts, or None if unavailable."""
+    try:
+        text = MEMINFO_PATH.read_text()
+    except OSError:
+        return None
+
+    info = {}
+    for line in text.splitlines():
+        key, _, rest = line.partition(":")
+        fields = rest.split()
+        if not fields:
+            continue
+        try:
+            value = int(fields[0])
+        except ValueError:
+            continue
+        if len(fields) > 1 and fields[1] == "kB":
+            value *= 1024
+        info[key] = value
+    return info
+
+
+def available_memory() -> Optional[int]:
+    """Bytes the kernel can hand out without swapping (``MemAvailable``)."""
+    info = read_meminfo()
+    return info.get("MemAvailable") if info else None
+
+
+def total_memory() -> Optional[int]:
+    """Physical memory in bytes (``MemTotal``)."""
+    info = read_meminfo()
+    return info.get("MemTotal") if info else None
+
+
+def resident_mapped_bytes(path: Path) -> Optional[int]:
+    """
+    Resident bytes of this process's mappings of ``path``.
+
+    Several model replicas map the same file and share its page cache, so
+    mappings are grouped by file offset and each region counts once.
+
+    Returns:
+        Resident bytes of the file, or None when ``/proc/self/smaps``
+        cannot be read
+    """
+    target = str(Path(path).resolve())
+    try:
+        text = SMAPS_PATH.read_text()
+    except OSError:
+        return None
+
+    by_offset: Dict[int, int] = {}
+    offset = None
+    for line in text.splitlines():
+        parts = line.split()
+        if not parts:
+            continue
+        if not parts[0].endswith(":"):
+            # Mapping header: address perms offset dev inode [pathname]
+            is_target = len(parts) >= 6 and " ".join(parts[5:]) == target
+            offset = int(parts[2], 16) if is_target else None
+        elif offset is not None and parts[0] == "Rss:":
+            by_offset[offset] = max(by_offset.get(offset, 0), int(parts[1]) * 1024)
+    return sum(by_offset.values())
+
+
+def context_bytes(ctx) -> int:
+    """Size of a llama context's state (KV cache plus logits buffers)."""
+    if ctx is None:
+        return 0
+    return int(llama_cpp.llama_state_get_size(ctx))
+
+
+def prefetch_file(
+    path: Path,
+    bytes_per_second: int = 0,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> bool:
+    """
+    Pull a whole file into the page cache ahead of use.
+
+    Loading a model maps its weights; prefetching first turns the page
+    faults of the first evaluation into page cache hits instead of disk
+    reads. Without a rate limit or progress callback this only issues
+    asynchronous readahead and returns quickly; otherwise the file is
+    read in chunks, paced to ``bytes_per_second``.
+
+    Args:
+        path: File to prefetch
+        bytes_per_second: Read rate cap (0 = unlimited)
+        progress: Called with (bytes read, total bytes) after each chunk
+
+    Returns:
+        True if the file was prefetched or readahead was requested
+    """
+    try:
+        with open(path, "rb", buffering=0) as f:
+            if not bytes_per_second and progress is None:
+                if hasattr(os, "posix_fadvise"):
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+                    return True
+                if hasattr(mmap, "MADV_WILLNEED"):
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                        mapped.madvise(mmap.MADV_WILLNEED)
+                    return True
+                return False
+
+            total = os.fstat(f.fileno()).st_size
+            buffer = bytearray(PREFETCH_CHUNK_BYTES)
+            done = 0
+            start = time.monotonic()
+            while True:
+                n = f.readinto(buffer)
+                if not n:
+                    break
+                done += n
+                if progress is not None:
+                    progress(done, total)
+                if bytes_per_second:
+                    ahead = done / bytes_per_second - (time.monotonic() - start)
+                    if ahead > 0:
+                        time.sleep(ahead)
+            return True
+    except (OSError, ValueError) as e:
+        logger.debug(f"Prefetch of {path} failed: {e}")
+    return False
@@ -0,0 +1,344 @@
+"""
+Prometheus metrics for the inference server.
+
+Counters and histograms are plain Python objects updated without locks:
+every observation happens on the event loop thread, and a scrape reads
+the current values as they are. Hot paths fetch a metric's per-label
+child once per request and then only call ``inc`` / ``observe``, which
+cost a ``bisect`` and two additions. Gauges such as in-flight requests
+are not maintained at all; they are read from the scheduler when
+``/metrics`` is scraped.
+
+With ``enable_metrics`` off, ``labels`` returns a shared no-op child and
+nothing is recorded.
+"""
+
+import math
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .config import settings
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Latency buckets (seconds) from sub-millisecond inter-token gaps to multi-minute requests
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.15, 0.25, 0.5,
+    0.75, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0,
+)
+RATE_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 50, 75, 100, 200, 500, 1000, 2000, 5000)
+LOAD_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _NoOp:
+    """Child returned for every label set while metrics are disabled."""
+
+    def inc(self, amount: float = 1) -> None:
+        pass
+
+    def observe(self, value: float) -> None:
+        pass
+
+
+_NOOP = _NoOp()
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # One count per bucket plus +Inf; made cumulative when rendered
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class _Family:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), enabled: bool = True):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.enabled = enabled
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """The child for one label set, created on first use."""
+        if not self.enabled:
+            return _NOOP
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Family):
+    """Monotonic counter family."""
+
+    kind = "counter"
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild()
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for values, child in list(self._children.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}")
+        return lines
+
+
+class Histogram(_Family):
+    """Histogram family with fixed bucket bounds."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Iterable[float] = LATENCY_BUCKETS,
+        enabled: bool = True,
+    ):
+        super().__init__(name, documentation, labelnames, enabled)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.buckets)
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for values, child in list(self._children.items()):
+            counts = list(child.counts)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Gauge(_Family):
+    """Gauge family whose values are read from a callback at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str],
+        collect: Callable[[], Dict[Tuple[str, ...], float]],
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for values, value in self.collect().items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    """The server's metric families, rendered together in Prometheus text format."""
+
+    def __init__(self, enabled: bool = True, namespace: str = "nexus"):
+        self.enabled = enabled
+        self.namespace = namespace
+        self._families: List[_Family] = []
+
+    def _register(self, family: _Family) -> _Family:
+        self._families.append(family)
+        return family
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(f"{self.namespace}_{name}", documentation, labelnames, self.enabled))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Iterable[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self._register(
+            Histogram(f"{self.namespace}_{name}", documentation, labelnames, buckets, self.enabled)
+        )
+
+    def gauge(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str],
+        collect: Callable[[], Dict[Tuple[str, ...], float]],
+    ) -> Gauge:
+        return self._register(Gauge(f"{self.namespace}_{name}", documentation, labelnames, collect))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for family in self._families:
+            lines.extend(family.render())
+        return "\n".join(lines) + "\n"
+
+
+class ServerMetrics(MetricsRegistry):
+    """Metric families recorded by the server."""
+
+    def __init__(self, enabled: bool = True):
+        super().__init__(enabled)
+        self.requests = self.counter(
+            "requests_total", "Generation and embedding requests received", ("model", "endpoint")
+        )
+        self.finished = self.counter(
+            "requests_finished_total", "Generations finished, by finish reason", ("model", "finish_reason")
+        )
+        self.prompt_tokens = self.counter("prompt_tokens_total", "Prompt tokens evaluated", ("model",))
+        self.completion_tokens = self.counter("completion_tokens_total", "Tokens generated", ("model",))
+        self.request_duration = self.histogram(
+            "request_duration_seconds", "Time from admission to the end of a generation", ("model", "endpoint")
+        )
+        self.time_to_first_token = self.histogram(
+            "time_to_first_token_seconds", "Time from arrival to the first streamed token", ("model",)
+        )
+        self.inter_token_latency = self.histogram(
+            "inter_token_latency_seconds", "Gap between consecutive streamed tokens", ("model",)
+        )
+        self.prompt_eval_rate = self.histogram(
+            "prompt_eval_tokens_per_second",
+            "Prompt tokens per second from the start of generation to the first streamed token",
+            ("model",),
+            RATE_BUCKETS,
+        )
+        self.decode_rate = self.histogram(
+            "decode_tokens_per_second", "Generated tokens per second after the first token", ("model",), RATE_BUCKETS
+        )
+        self.queue_wait = self.histogram(
+            "queue_wait_seconds", "Time requests waited for an admission slot", ("model", "priority")
+        )
+        self.model_loads = self.counter("model_loads_total", "Model loads, by outcome", ("model", "outcome"))
+        self.model_load_duration = self.histogram(
+            "model_load_seconds", "Time to load a model", ("model",), LOAD_BUCKETS
+        )
+        self.model_evictions = self.counter(
+            "model_evictions_total", "Models unloaded to make room or after idling", ("model", "reason")
+        )
+        self.tokens_saved = self.counter(
+            "cancellation_tokens_saved_total",
+            "Token budget cancelled generations never had to decode, by cancel reason",
+            ("reason",),
+        )
+        self.model_cache = self.counter(
+            "model_cache_requests_total", "Model leases served from the loaded-model cache (hit) or a load (miss)",
+            ("model", "result"),
+        )
+
+    def watch_scheduler(self, collect: Callable[[], Dict[Tuple[str, ...], Tuple[int, int]]]) -> None:
+        """
+        Expose in-flight and queued requests per model, read at scrape time.
+
+        Args:
+            collect: Returns ``(model,) -> (running, waiting)``
+        """
+        self.gauge(
+            "requests_in_flight", "Requests holding an admission slot", ("model",),
+            lambda: {labels: running for labels, (running, _) in collect().items()},
+        )
+        self.gauge(
+            "requests_queued", "Requests waiting for an admission slot", ("model",),
+            lambda: {labels: waiting for labels, (_, waiting) in collect().items()},
+        )
+
+
+class StreamTimer:
+    """
+    Per-request token timing for a streamed generation.
+
+    Holds the request's histogram children so each token costs one
+    ``observe`` on the inter-token histogram.
+    """
+
+    __slots__ = ("model", "arrived", "started", "prompt_tokens", "first", "last", "tokens", "_itl")
+
+    def __init__(self, model: str, arrived: float, started: float, prompt_tokens: int):
+        """
+        Args:
+            model: Model label
+            arrived: ``time.time()`` when the request was received
+            started: ``time.time()`` when generation started
+            prompt_tokens: Prompt length
+        """
+        self.model = model
+        self.arrived = arrived
+        self.started = started
+        self.prompt_tokens = prompt_tokens
+        self.first: Optional[float] = None
+        self.last: Optional[float] = None
+        self.tokens = 0
+        self._itl = metrics.inter_token_latency.labels(model)
+
+    def token(self, timestamp: float) -> None:
+        """Record a token produced at ``timestamp`` (``time.time()``)."""
+        if self.last is None:
+            self.first = timestamp
+        else:
+            self._itl.observe(timestamp - self.last)
+        self.last = timestamp
+        self.tokens += 1
+
+    def finish(self) -> None:
+        """Record time to first token and the prompt-eval and decode rates."""
+        if self.first is None:
+            return
+        metrics.time_to_first_token.labels(self.model).observe(self.first - self.arrived)
+        if self.first > self.started:
+            metrics.prompt_eval_rate.labels(self.model).observe(self.prompt_tokens / (self.first - self.started))
+        if self.tokens > 1 and self.last > self.first:
+            metrics.decode_rate.labels(self.model).observe((self.tokens - 1) / (self.last - self.first))
+
+
+# Global metrics registry
+metrics = ServerMetrics(enabled=settings.enable_metrics)
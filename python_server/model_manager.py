@@ -7,9 +7,12 @@ with efficient memory usage and GPU acceleration support.
 
 import asyncio
 import logging
+import math
 import os
 import sys
-from typing import Optional, Dict, Any
+import time
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, AsyncIterator, Callable, FrozenSet, List, Tuple
 from pathlib import Path
 from collections import OrderedDict
 
@@ -31,27 +34,226 @@ except ImportError:
         logger.error(f"Failed to install llama-cpp-python: {e}")
 
 from .config import settings, get_model_path, ensure_cache_dir
+from .batching import batch_engines
+from .catalog import model_catalog
+from .prefix_cache import RadixPrefixCache
+from .speculative import SpeculativeDraft, build_draft, speculation_config
+from .embeddings import is_embedding_key, model_file_name
+from .kv_store import DiskStateStore, ModelStateStore, model_fingerprint
+from .executor import cpu_slice, inference_executor, process_cpus
+from .inference import InferenceEngine
+from .scheduler import request_scheduler
+from .metrics import metrics
+from .memory import available_memory, context_bytes, prefetch_file, resident_mapped_bytes, total_memory
+
+# Share of physical memory given to loaded models when no budget is configured
+MEMORY_BUDGET_FRACTION = 0.8
+
+# Assumed load throughput for a model's first load, used for Retry-After hints
+EXPECTED_LOAD_BYTES_PER_SECOND = 500 * 1024**2
+
+
+class ModelMemoryExhausted(RuntimeError):
+    """Raised when a model cannot be loaded without exceeding the memory budget."""
+    
+    def __init__(self, message: str, retry_after: float = 5):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ModelLoading(RuntimeError):
+    """Raised when a caller stops waiting for a model that is still loading."""
+    
+    def __init__(self, message: str, retry_after: float = 1, progress: Optional[Dict[str, Any]] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.progress = progress or {}
+
+
+class ModelLoad:
+    """Progress of one background model load."""
+    
+    def __init__(self, model_name: str, bytes_total: int, expected_seconds: float):
+        self.model_name = model_name
+        self.phase = "queued"
+        self.bytes_total = bytes_total
+        self.bytes_read = 0
+        self.expected_seconds = expected_seconds
+        self.started = time.monotonic()
+        self.task: Optional[asyncio.Task] = None
+    
+    def update(self, bytes_read: int, bytes_total: int) -> None:
+        """Prefetch progress callback (runs on the loader thread)."""
+        self.bytes_read = bytes_read
+        self.bytes_total = bytes_total
+    
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+    
+    def retry_after(self) -> int:
+        """Whole seconds until the load is expected to finish (at least 1)."""
+        return max(1, math.ceil(self.expected_seconds - self.elapsed()))
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "phase": self.phase,
+            "bytes_read": self.bytes_read,
+            "bytes_total": self.bytes_total,
+            "elapsed_seconds": round(self.elapsed(), 3),
+            "expected_seconds": round(self.expected_seconds, 3),
+        }
+
+
+class Replica:
+    """One Llama instance of a cached model, with its own context and CPU slice."""
+    
+    def __init__(self, model: Llama, slot: int, cpus: Optional[FrozenSet[int]] = None):
+        self.model = model
+        self.slot = slot
+        self.cpus = cpus
+        self.refs = 0
+        self.last_used = time.monotonic()
+
+
+class CachedModel:
+    """
+    A loaded model: a pool of replicas over the same GGUF file.
+    
+    Replicas share the mmap'd weights and the prefix cache; each has its
+    own llama context (KV cache) and serves requests independently.
+    """
+    
+    def __init__(self, name: str, path: Path, replica: Replica):
+        self.name = name
+        self.path = path
+        self.file_bytes = path.stat().st_size
+        self.replicas: List[Replica] = [replica]
+        self.access_count = 0
+        self.last_used = time.monotonic()
+        self.retired = False
+    
+    @property
+    def model(self) -> Llama:
+        """The primary replica's model."""
+        return self.replicas[0].model
+    
+    @property
+    def refs(self) -> int:
+        return sum(replica.refs for replica in self.replicas)
+    
+    def least_loaded(self) -> Replica:
+        """Replica with the fewest in-flight requests."""
+        return min(self.replicas, key=lambda r: (r.refs, r.last_used))
+    
+    def replica_context_bytes(self, replica: Replica) -> int:
+        """KV cache bytes held by one replica (its context plus batching engine)."""
+        total = context_bytes(replica.model._ctx.ctx)
+        if isinstance(replica.model.draft_model, SpeculativeDraft):
+            # Speculation keeps logits for every position: n_ctx x n_vocab floats
+            total += replica.model.scores.nbytes + replica.model.draft_model.context_bytes()
+        engine = batch_engines.find(self.name, replica.model)
+        if engine is not None:
+            total += context_bytes(engine._ctx.ctx)
+        return total
+    
+    def footprint(self) -> Dict[str, int]:
+        """
+        Current memory footprint in bytes.
+        
+        Weights count their resident pages when /proc is available (all of
+        them under mlock), otherwise the GGUF file size, once for all
+        replicas. Contexts count each replica's full KV cache sized from
+        n_ctx, plus batching engine contexts, speculative draft contexts and
+        the shared prefix cache; a draft model's weights count with the weights.
+        """
+        weights = resident_mapped_bytes(self.path)
+        if weights is None:
+            weights = self.file_bytes
+        draft = self.model.draft_model
+        if isinstance(draft, SpeculativeDraft) and draft.draft_path is not None:
+            draft_weights = resident_mapped_bytes(draft.draft_path)
+            weights += draft.draft_path.stat().st_size if draft_weights is None else draft_weights
+        
+        kv_cache = sum(self.replica_context_bytes(replica) for replica in self.replicas)
+        prefix_cache = self.model.cache.cache_size if isinstance(self.model.cache, RadixPrefixCache) else 0
+        
+        return {
+            "weights": weights,
+            "kv_cache": kv_cache,
+            "prefix_cache": prefix_cache,
+            "total": weights + kv_cache + prefix_cache,
+        }
+
+
+class ModelLease:
+    """
+    Reference to a cached model replica held for the duration of a request.
+    
+    A leased replica is never evicted; it must be released exactly once.
+    """
+    
+    def __init__(self, cache: "ModelCache", entry: CachedModel, replica: Replica):
+        self.cache = cache
+        self.entry = entry
+        self.replica = replica
+        self.released = False
+    
+    @property
+    def model(self) -> Llama:
+        return self.replica.model
+    
+    async def release(self) -> None:
+        """Drop the reference (idempotent)."""
+        if not self.released:
+            self.released = True
+            await self.cache.release(self.entry, self.replica)
 
 
 class ModelCache:
     """
-    LRU (Least Recently Used) cache for loaded GGUF models.
+    Memory-budgeted cache for loaded GGUF models.
     
-    Keeps frequently used models in memory and automatically evicts
-    least-used models when the cache reaches capacity to manage memory efficiently.
+    Accounts for each model's actual footprint and evicts least recently
+    used models that are idle (no outstanding leases) and not pinned once
+    the byte budget, the model count cap, or the host memory reserve would
+    be exceeded.
     """
     
-    def __init__(self, max_size: int = 2):
+    def __init__(
+        self,
+        max_size: int = 2,
+        budget_bytes: int = 0,
+        reserve_bytes: int = 0,
+        pinned: Optional[List[str]] = None,
+    ):
         """
         Initialize the model cache.
         
         Args:
             max_size: Maximum number of models to keep loaded simultaneously
+            budget_bytes: Total footprint allowed for loaded models (0 = unlimited)
+            reserve_bytes: Host MemAvailable to keep free (0 = ignore host pressure)
+            pinned: Models that are never evicted
         """
         self.max_size = max_size
-        self.cache: OrderedDict[str, Llama] = OrderedDict()
-        self.access_count: Dict[str, int] = {}
+        self.budget_bytes = budget_bytes
+        self.reserve_bytes = reserve_bytes
+        self.pinned = set(pinned or [])
+        self.entries: OrderedDict[str, CachedModel] = OrderedDict()
+        self.evictions = 0
         self.lock = asyncio.Lock()
+        # Models taken out of the cache, with their footprint, waiting to be closed outside the lock
+        self._closing: List[Tuple[CachedModel, int]] = []
+        self.closing_bytes = 0
+    
+    @asynccontextmanager
+    async def _locked(self) -> AsyncIterator[None]:
+        """Hold the cache lock; models evicted meanwhile are closed once it is released."""
+        try:
+            async with self.lock:
+                yield
+        finally:
+            await self._close_evicted()
     
     async def get(self, model_name: str) -> Optional[Llama]:
         """
@@ -63,52 +265,336 @@ class ModelCache:
         Returns:
             Llama model instance or None if not in cache
         """
-        async with self.lock:
-            if model_name in self.cache:
-                self.cache.move_to_end(model_name)
-                self.access_count[model_name] = self.access_count.get(model_name, 0) + 1
-                logger.debug(f"Model cache hit: {model_name}")
-                return self.cache[model_name]
-            
+        lease = await self.acquire(model_name)
+        if lease is None:
             return None
+        await lease.release()
+        return lease.model
     
-    async def put(self, model_name: str, model: Llama) -> None:
+    async def acquire(self, model_name: str) -> Optional[ModelLease]:
         """
-        Add or update a model in the cache.
+        Lease the least-loaded replica of a cached model, protecting it
+        from eviction until released.
+        
+        Returns:
+            Lease on the model or None if not in cache
+        """
+        async with self.lock:
+            entry = self.entries.get(model_name)
+            if entry is None:
+                return None
+            self.entries.move_to_end(model_name)
+            replica = entry.least_loaded()
+            replica.refs += 1
+            replica.last_used = entry.last_used = time.monotonic()
+            entry.access_count += 1
+            logger.debug(f"Model cache hit: {model_name} (replica {replica.slot})")
+            return ModelLease(self, entry, replica)
+    
+    async def release(self, entry: CachedModel, replica: Replica) -> None:
+        """Drop a lease; retired models are freed once their last lease ends."""
+        async with self._locked():
+            replica.refs -= 1
+            replica.last_used = entry.last_used = time.monotonic()
+            if entry.retired and entry.refs == 0:
+                self._evict(entry)
+    
+    async def put(
+        self,
+        model_name: str,
+        model: Llama,
+        model_path: Path,
+        cpus: Optional[FrozenSet[int]] = None,
+    ) -> ModelLease:
+        """
+        Add a freshly loaded model and lease it to the caller.
         
         Args:
             model_name: Name of the model
             model: Llama model instance
+            model_path: GGUF file the model was loaded from
+            cpus: CPU slice assigned to the model's first replica
         """
-        async with self.lock:
-            if model_name in self.cache:
-                self.cache.move_to_end(model_name)
-            else:
-                if len(self.cache) >= self.max_size:
-                    removed_model, removed_instance = self.cache.popitem(last=False)
-                    logger.info(f"Evicting model from cache: {removed_model}")
-                    try:
-                        del removed_instance
-                    except Exception as e:
-                        logger.warning(f"Error cleaning up evicted model: {e}")
-                
-                self.cache[model_name] = model
-                self.access_count[model_name] = 1
+        async with self._locked():
+            replica = Replica(model, slot=0, cpus=cpus)
+            replica.refs = 1
+            entry = CachedModel(model_name, model_path, replica)
+            entry.access_count = 1
+            self.entries[model_name] = entry
+            
+            # Load-time estimates miss the KV cache; settle up with real numbers
+            self._make_room(0, protect=entry)
             
             logger.debug(f"Model added to cache: {model_name}")
+            return ModelLease(self, entry, replica)
     
-    async def clear(self) -> None:
-        """Clear all models from cache and free resources."""
+    async def fits(self, incoming_bytes: int) -> bool:
+        """Whether ``incoming_bytes`` more fit without evicting anything."""
         async with self.lock:
-            for model_name, model_instance in self.cache.items():
-                try:
-                    del model_instance
-                except Exception as e:
-                    logger.warning(f"Error cleaning up model {model_name}: {e}")
+            return not self._over_limits(incoming_bytes, new_model=False)
+    
+    async def add_replica(self, model_name: str, replica: Replica) -> bool:
+        """
+        Attach a replica to a cached model.
+        
+        Returns:
+            False if the model was evicted or unloaded in the meantime
+        """
+        async with self.lock:
+            entry = self.entries.get(model_name)
+            if entry is None or entry.retired:
+                return False
+            entry.replicas.append(replica)
+            return True
+    
+    async def remove_idle_replica(self, model_name: str, idle_seconds: float) -> Optional[Replica]:
+        """
+        Detach and free the longest-idle extra replica of a model.
+        
+        The primary replica is never removed; the model as a whole is
+        subject to normal eviction instead.
+        
+        Returns:
+            The removed replica, or None if no replica was idle long enough
+        """
+        async with self.lock:
+            entry = self.entries.get(model_name)
+            if entry is None or len(entry.replicas) <= 1:
+                return None
+            now = time.monotonic()
+            idle = [
+                replica for replica in entry.replicas[1:]
+                if replica.refs == 0 and now - replica.last_used >= idle_seconds
+            ]
+            if not idle:
+                return None
+            replica = min(idle, key=lambda r: r.last_used)
+            entry.replicas.remove(replica)
+        await asyncio.to_thread(batch_engines.close, model_name, replica.model)
+        await asyncio.to_thread(self._close_replica, model_name, replica)
+        return replica
+    
+    async def reserve(self, model_name: str, size_bytes: int) -> None:
+        """
+        Evict idle models until a model of ``size_bytes`` fits.
+        
+        Raises:
+            ModelMemoryExhausted: Everything evictable is leased or pinned
+        """
+        async with self._locked():
+            if not self.entries:
+                if self._over_limits(size_bytes):
+                    logger.warning(
+                        f"Model {model_name} ({size_bytes / 1024**2:.0f} MB) exceeds memory limits; "
+                        f"loading anyway into an empty cache"
+                    )
+                return
+            if not self._make_room(size_bytes):
+                raise ModelMemoryExhausted(
+                    f"Not enough memory to load {model_name}: "
+                    f"loaded models are in use or pinned"
+                )
+    
+    async def relieve_pressure(self) -> int:
+        """
+        Respond to low host memory: drop prefix cache states, then evict
+        idle models until MemAvailable is back above the reserve.
+        
+        Returns:
+            Number of models evicted
+        """
+        async with self._locked():
+            available = available_memory()
+            if available is None or available >= self.reserve_bytes:
+                return 0
+            
+            logger.warning(
+                f"Host memory pressure: {available / 1024**2:.0f} MB available, "
+                f"reserve {self.reserve_bytes / 1024**2:.0f} MB"
+            )
+            for entry in self.entries.values():
+                if isinstance(entry.model.cache, RadixPrefixCache):
+                    entry.model.cache.clear()
             
-            self.cache.clear()
-            self.access_count.clear()
-            logger.info("Model cache cleared")
+            evicted = self.evictions
+            self._make_room(0)
+            return self.evictions - evicted
+    
+    def _over_limits(self, incoming_bytes: int, new_model: bool = True) -> bool:
+        new_models = 1 if incoming_bytes and new_model else 0
+        if len(self.entries) + new_models > self.max_size:
+            return True
+        if self.budget_bytes:
+            used = sum(entry.footprint()["total"] for entry in self.entries.values())
+            if used + incoming_bytes > self.budget_bytes:
+                return True
+        if self.reserve_bytes:
+            available = available_memory()
+            # Evicted models still being closed free their memory shortly
+            if available is not None and available + self.closing_bytes - incoming_bytes < self.reserve_bytes:
+                return True
+        return False
+    
+    def _make_room(self, incoming_bytes: int, protect: Optional[CachedModel] = None) -> bool:
+        """
+        Evict idle, unpinned models in LRU order while over any limit (lock held).
+        
+        Returns:
+            True once within limits, False if nothing more can be evicted
+        """
+        while self._over_limits(incoming_bytes):
+            victim = next(
+                (
+                    entry for entry in self.entries.values()
+                    if entry.refs == 0 and entry.name not in self.pinned and entry is not protect
+                ),
+                None,
+            )
+            if victim is None:
+                if any(entry is not protect for entry in self.entries.values()):
+                    logger.warning("Model memory limits exceeded but every loaded model is in use or pinned")
+                return False
+            logger.info(f"Evicting model from cache: {victim.name}")
+            self.entries.pop(victim.name)
+            self.evictions += 1
+            metrics.model_evictions.labels(victim.name, "memory").inc()
+            self._evict(victim)
+        return True
+    
+    async def expire_idle(self, ttl_for: Callable[[str], float]) -> List[str]:
+        """
+        Free unpinned models idle for longer than their TTL.
+        
+        Args:
+            ttl_for: Idle TTL in seconds for a model name (0 = never expires)
+        
+        Returns:
+            Names of the models freed
+        """
+        async with self._locked():
+            now = time.monotonic()
+            expired = [
+                entry for entry in self.entries.values()
+                if entry.refs == 0
+                and entry.name not in self.pinned
+                and ttl_for(entry.name) > 0
+                and now - entry.last_used >= ttl_for(entry.name)
+            ]
+            for entry in expired:
+                self.entries.pop(entry.name)
+                metrics.model_evictions.labels(entry.name, "idle").inc()
+                self._evict(entry)
+            return [entry.name for entry in expired]
+    
+    async def retire(self, model_name: str) -> bool:
+        """
+        Remove a model from the cache, freeing it now or after its last lease.
+        
+        Returns:
+            True if the model was loaded
+        """
+        async with self._locked():
+            entry = self.entries.pop(model_name, None)
+            if entry is None:
+                return False
+            entry.retired = True
+            if entry.refs == 0:
+                self._evict(entry)
+            else:
+                logger.info(f"Model {model_name} unloads after {entry.refs} in-flight request(s)")
+            return True
+    
+    def _evict(self, entry: CachedModel) -> None:
+        """Queue a model taken out of the cache for closing once the lock is released (lock held)."""
+        size = entry.footprint()["total"]
+        self._closing.append((entry, size))
+        self.closing_bytes += size
+    
+    async def _close_evicted(self) -> None:
+        """Close the models queued by ``_evict`` (lock not held)."""
+        while self._closing:
+            entry, size = self._closing.pop(0)
+            try:
+                await self._close(entry)
+            finally:
+                self.closing_bytes -= size
+    
+    @classmethod
+    async def _close(cls, entry: CachedModel) -> None:
+        """
+        Persist prefix states and free a model's weights and contexts.
+        
+        Runs without the cache lock: batching engine threads are joined and
+        models freed on worker threads, so leases and loads of other models
+        are not held up. Engines are stopped per replica, so a model
+        reloaded under the same name in the meantime keeps its own.
+        """
+        for replica in entry.replicas:
+            await asyncio.to_thread(batch_engines.close, entry.name, replica.model)
+        await persist_prefix_cache(entry.name, entry.model)
+        for replica in entry.replicas:
+            await asyncio.to_thread(cls._close_replica, entry.name, replica)
+    
+    @staticmethod
+    def _close_replica(model_name: str, replica: Replica) -> None:
+        try:
+            if isinstance(replica.model.draft_model, SpeculativeDraft):
+                replica.model.draft_model.close()
+            replica.model.close()
+        except Exception as e:
+            logger.warning(f"Error cleaning up model {model_name}: {e}")
+    
+    async def clear(self) -> None:
+        """Clear all models from cache and free resources."""
+        for model_name in list(self.entries):
+            await self.retire(model_name)
+        logger.info("Model cache cleared")
+    
+    def stats(self) -> Dict[str, Any]:
+        """Per-model footprints and limits for monitoring."""
+        models = {
+            name: {
+                "footprint_bytes": entry.footprint(),
+                "refs": entry.refs,
+                "replicas": [
+                    {
+                        "refs": replica.refs,
+                        "cpus": sorted(replica.cpus) if replica.cpus else None,
+                        "idle_seconds": time.monotonic() - replica.last_used,
+                    }
+                    for replica in entry.replicas
+                ],
+                "pinned": name in self.pinned,
+                "access_count": entry.access_count,
+                "idle_seconds": time.monotonic() - entry.last_used,
+            }
+            for name, entry in list(self.entries.items())
+        }
+        return {
+            "models": models,
+            "used_bytes": sum(m["footprint_bytes"]["total"] for m in models.values()),
+            "budget_bytes": self.budget_bytes,
+            "max_models": self.max_size,
+            "reserve_bytes": self.reserve_bytes,
+            "host_available_bytes": available_memory(),
+            "evictions": self.evictions,
+        }
+
+
+def model_idle_ttl(model_name: str) -> float:
+    """Idle seconds before a model is unloaded: its ``model_idle_ttls`` entry, else ``model_idle_ttl``."""
+    return settings.model_idle_ttls.get(model_name, settings.model_idle_ttl)
+
+
+async def persist_prefix_cache(model_name: str, model: Llama) -> None:
+    """Flush a model's resident prefix states to the snapshot store."""
+    if isinstance(model.cache, RadixPrefixCache):
+        try:
+            written = await asyncio.to_thread(model.cache.persist)
+            if written:
+                logger.info(f"Persisted {written} prefix state(s) for {model_name}")
+        except Exception as e:
+            logger.warning(f"Failed to persist prefix states for {model_name}: {e}")
 
 
 class ModelManager:
@@ -118,67 +604,406 @@ class ModelManager:
     
     def __init__(self):
         """Initialize the model manager with cache."""
-        self.cache = ModelCache(max_size=settings.max_cached_models)
-        self.loading_locks: Dict[str, asyncio.Lock] = {}
-        logger.info(f"ModelManager initialized with cache size: {settings.max_cached_models}")
+        budget = settings.model_memory_budget
+        if budget == 0:
+            total = total_memory()
+            budget = int(total * MEMORY_BUDGET_FRACTION) if total else 0
+        
+        self.cache = ModelCache(
+            max_size=settings.max_cached_models,
+            budget_bytes=budget,
+            reserve_bytes=settings.memory_reserve_bytes,
+            pinned=settings.pinned_models,
+        )
+        # Background loads in flight, and how long each model took to load last time
+        self.loads: Dict[str, ModelLoad] = {}
+        self._load_seconds: Dict[str, float] = {}
+        self._load_slots = asyncio.Semaphore(max(1, settings.max_concurrent_loads))
+        # Last measured KV footprint per model, used to size reservations on reload
+        self._kv_estimates: Dict[str, int] = {}
+        self.kv_store: Optional[DiskStateStore] = None
+        if settings.enable_cache and settings.kv_store_enabled:
+            self.kv_store = DiskStateStore(Path(settings.cache_dir) / "kv", settings.kv_store_max_bytes)
+        budget_text = f"{budget / 1024**3:.1f} GB" if budget else "unlimited"
+        logger.info(
+            f"ModelManager initialized with cache size: {settings.max_cached_models}, "
+            f"memory budget: {budget_text}"
+        )
     
     async def load_model(self, model_name: str) -> Llama:
         """
         Load a GGUF model with robust error handling.
+        
+        The model is not leased, so it may be evicted once this returns;
+        request handlers should use ``acquire_model`` instead.
+        """
+        lease = await self.acquire_model(model_name)
+        await lease.release()
+        return lease.model
+    
+    async def acquire_model(self, model_name: str, wait: Optional[float] = None) -> ModelLease:
+        """
+        Load a GGUF model if needed and lease it for the caller.
+        
+        Cold loads run as background tasks off the event loop; a caller
+        that stops waiting does not cancel the load.
+        
+        Args:
+            model_name: Name of the model
+            wait: Seconds to wait for a cold load (None waits until it finishes)
+        
+        Raises:
+            FileNotFoundError: The model file does not exist
+            ModelMemoryExhausted: The model does not fit and nothing can be evicted
+            ModelLoading: The model is still loading after ``wait`` seconds
         """
         if not LLAMA_CPP_AVAILABLE:
             raise RuntimeError("llama-cpp-python is not available")
         
-        cached_model = await self.cache.get(model_name)
-        if cached_model is not None:
-            logger.info(f"Using cached model: {model_name}")
-            return cached_model
+        missed = False
+        while True:
+            lease = await self.cache.acquire(model_name)
+            if lease is not None:
+                logger.debug(f"Using cached model: {model_name}")
+                if not missed:
+                    metrics.model_cache.labels(model_name, "hit").inc()
+                return lease
+            
+            if not missed:
+                missed = True
+                metrics.model_cache.labels(model_name, "miss").inc()
+            load = self.start_load(model_name)
+            try:
+                await asyncio.wait_for(asyncio.shield(load.task), wait)
+            except asyncio.TimeoutError:
+                raise ModelLoading(
+                    f"Model {model_name} is loading ({load.phase})",
+                    retry_after=load.retry_after(),
+                    progress=load.to_dict(),
+                ) from None
+    
+    def start_load(self, model_name: str) -> "ModelLoad":
+        """
+        Start loading a model in the background, or join the load in progress.
         
-        if model_name not in self.loading_locks:
-            self.loading_locks[model_name] = asyncio.Lock()
+        Raises:
+            FileNotFoundError: The model file does not exist
+        """
+        load = self.loads.get(model_name)
+        if load is not None:
+            return load
         
-        async with self.loading_locks[model_name]:
-            cached_model = await self.cache.get(model_name)
-            if cached_model is not None:
-                return cached_model
-            
+        model_path = get_model_path(model_file_name(model_name))
+        size_bytes = model_path.stat().st_size
+        expected = self._load_seconds.get(model_name, size_bytes / EXPECTED_LOAD_BYTES_PER_SECOND)
+        load = ModelLoad(model_name, size_bytes, expected)
+        load.task = asyncio.create_task(self._load(model_name, model_path, load))
+        load.task.add_done_callback(lambda task: self._load_finished(model_name, task))
+        self.loads[model_name] = load
+        return load
+    
+    def _load_finished(self, model_name: str, task: asyncio.Task) -> None:
+        self.loads.pop(model_name, None)
+        # Mark the outcome retrieved: callers that gave up waiting never await it
+        if not task.cancelled():
+            task.exception()
+    
+    async def _load(self, model_name: str, model_path: Path, load: "ModelLoad") -> None:
+        """Load a model into the cache; at most ``max_concurrent_loads`` run at once."""
+        async with self._load_slots:
+            load.phase = "reserving"
             logger.info(f"Loading model from disk: {model_name}")
-            model_path = get_model_path(model_name)
+            await self.cache.reserve(model_name, load.bytes_total + self._kv_estimate(model_name))
             
             try:
-                model = Llama(
-                    model_path=str(model_path),
-                    n_gpu_layers=settings.n_gpu_layers,
-                    n_ctx=settings.context_length,
-                    n_threads=settings.n_threads,
-                    n_batch=settings.batch_size,
-                    verbose=settings.verbose,
-                    use_mlock=True,
-                    use_mmap=True,
-                )
+                if settings.prefetch_weights:
+                    load.phase = "prefetching"
+                    await asyncio.to_thread(
+                        prefetch_file, model_path, settings.load_io_bytes_per_second, load.update
+                    )
+                
+                load.phase = "initializing"
+                cpus = self._cpu_slice(0)
+                model = await asyncio.to_thread(self._create_model, model_path, cpus, is_embedding_key(model_name))
                 
-                logger.info(f"Model loaded successfully: {model_name}")
-                await self.cache.put(model_name, model)
-                return model
+                if settings.enable_cache and not is_embedding_key(model_name):
+                    disk_store = None
+                    if self.kv_store is not None:
+                        disk_store = ModelStateStore(self.kv_store, model_fingerprint(model_path))
+                    model.set_cache(
+                        RadixPrefixCache(
+                            capacity_bytes=settings.prefix_cache_bytes,
+                            policy=settings.prefix_cache_policy,
+                            min_prefix_tokens=settings.prefix_cache_min_tokens,
+                            disk_store=disk_store,
+                        )
+                    )
+                
+                lease = await self.cache.put(model_name, model, model_path, cpus)
+                self._kv_estimates[model_name] = lease.entry.footprint()["kv_cache"]
+                await lease.release()
+                self._load_seconds[model_name] = load.elapsed()
+                metrics.model_loads.labels(model_name, "loaded").inc()
+                metrics.model_load_duration.labels(model_name).observe(load.elapsed())
+                logger.info(f"Model loaded successfully: {model_name} ({load.elapsed():.1f}s)")
             
             except Exception as e:
+                metrics.model_loads.labels(model_name, "failed").inc()
                 logger.error(f"Failed to load model {model_name}: {e}", exc_info=True)
                 raise RuntimeError(f"Model loading failed: {str(e)}") from e
     
-    async def unload_model(self, model_name: str) -> None:
-        """Unload a specific model from cache."""
-        logger.info(f"Unloading model: {model_name}")
-        async with self.cache.lock:
-            if model_name in self.cache.cache:
-                model_instance = self.cache.cache.pop(model_name)
+    def load_progress(self) -> Dict[str, Dict[str, Any]]:
+        """Progress of every load in flight."""
+        return {model_name: load.to_dict() for model_name, load in list(self.loads.items())}
+    
+    def _kv_estimate(self, model_name: str) -> int:
+        """
+        KV cache bytes a fresh load will allocate.
+        
+        Uses the size measured on the last load, else the GGUF header
+        (layers x KV heads x head size x context) from the catalog.
+        """
+        if model_name in self._kv_estimates:
+            return self._kv_estimates[model_name]
+        metadata = model_catalog.get(model_file_name(model_name))
+        if metadata is None:
+            return 0
+        n_ctx = settings.embedding_batch_tokens if is_embedding_key(model_name) else settings.context_length
+        return metadata.kv_cache_bytes(n_ctx) or 0
+    
+    @staticmethod
+    def _cpu_slice(slot: int) -> Optional[FrozenSet[int]]:
+        """
+        Disjoint CPUs for replica ``slot``: ``n_threads`` cores per replica.
+        
+        Only used when replicas are enabled; returns None (any CPU) if the
+        host has too few cores for the slot to get its own slice.
+        """
+        if settings.max_replicas <= 1:
+            return None
+        return cpu_slice(slot, settings.n_threads)
+    
+    @staticmethod
+    def _create_model(model_path: Path, cpus: Optional[FrozenSet[int]] = None, embedding: bool = False) -> Llama:
+        """
+        Construct a Llama instance; pinned replicas also batch on their own cores only.
+        
+        Models configured in ``speculative_models`` keep logits for every
+        position (needed to verify drafted tokens) and get their own draft.
+        Embedding-mode instances get a context, batch and ubatch that hold
+        exactly one ``embedding_batch_tokens`` batch.
+        """
+        extra = {"n_threads_batch": len(cpus)} if cpus else {}
+        speculative = not embedding and speculation_config(model_path.name) is not None
+        if speculative:
+            extra["logits_all"] = True
+        if embedding:
+            # Non-causal embedding models must see each sequence within one ubatch
+            extra.update(embedding=True, n_ubatch=settings.embedding_batch_tokens)
+        n_ctx = settings.embedding_batch_tokens if embedding else settings.context_length
+        model = Llama(
+            model_path=str(model_path),
+            n_gpu_layers=settings.n_gpu_layers,
+            n_ctx=n_ctx,
+            n_threads=settings.n_threads,
+            n_batch=settings.embedding_batch_tokens if embedding else settings.batch_size,
+            verbose=settings.verbose,
+            use_mlock=settings.use_mlock,
+            use_mmap=True,
+            **extra,
+        )
+        if speculative:
+            try:
+                model.draft_model = build_draft(model_path.name, model.n_vocab())
+            except Exception as e:
+                logger.error(f"Speculative decoding disabled for {model_path.name}: {e}")
+        inference_executor.set_affinity(model, cpus)
+        return model
+    
+    async def _scale_up(self, entry: CachedModel) -> bool:
+        """Load one more replica of a cached model if it fits the memory budget."""
+        if not await self.cache.fits(entry.replica_context_bytes(entry.replicas[0])):
+            logger.info(f"Not scaling {entry.name}: another replica would exceed memory limits")
+            return False
+        
+        used = {replica.slot for replica in entry.replicas}
+        slot = next(i for i in range(len(used) + 1) if i not in used)
+        cpus = self._cpu_slice(slot)
+        model = await asyncio.to_thread(self._create_model, entry.path, cpus, is_embedding_key(entry.name))
+        # Replicas share one prefix cache: states restore into any context of the same model
+        if entry.model.cache is not None:
+            model.set_cache(entry.model.cache)
+        
+        if not await self.cache.add_replica(entry.name, Replica(model, slot, cpus)):
+            model.close()
+            return False
+        logger.info(
+            f"Scaled {entry.name} up to {len(entry.replicas)} replicas"
+            + (f" (replica {slot} on CPUs {sorted(cpus)})" if cpus else "")
+        )
+        return True
+    
+    async def watch_replica_demand(self) -> None:
+        """Grow replica pools while requests queue up; shrink them once idle."""
+        if settings.max_replicas <= 1:
+            return
+        if settings.max_replicas * settings.n_threads > len(process_cpus()):
+            logger.warning(
+                f"{settings.max_replicas} replicas x {settings.n_threads} threads exceeds "
+                f"{len(process_cpus())} CPUs; extra replicas will share cores"
+            )
+        while True:
+            await asyncio.sleep(settings.replica_scale_interval)
+            for model_name, entry in list(self.cache.entries.items()):
                 try:
-                    del model_instance
+                    queued = request_scheduler.queue_depth(model_name)
+                    if queued >= settings.replica_scale_up_queue and len(entry.replicas) < settings.max_replicas:
+                        await self._scale_up(entry)
+                    elif queued == 0:
+                        removed = await self.cache.remove_idle_replica(model_name, settings.replica_idle_seconds)
+                        if removed is not None:
+                            logger.info(f"Scaled {model_name} down to {len(entry.replicas)} replicas")
+                    request_scheduler.set_replicas(model_name, len(entry.replicas))
                 except Exception as e:
-                    logger.warning(f"Error unloading model {model_name}: {e}")
+                    logger.error(f"Replica scaling failed for {model_name}: {e}", exc_info=True)
+    
+    @staticmethod
+    def _warm_up(model: Llama, tokens: list[int]) -> None:
+        """Evaluate a few tokens so weights are faulted in and kernels set up, then discard them."""
+        model.reset()
+        model.eval(tokens)
+        model.reset()
+    
+    async def preload(self, model_name: str) -> None:
+        """
+        Load a model ahead of traffic and make it hot.
+        
+        Loads the model (which prefetches its weights into the page
+        cache) and runs a short warmup evaluation, so the first real
+        request pays neither page faults nor first-inference setup.
+        """
+        lease = await self.acquire_model(model_name)
+        try:
+            model = lease.model
+            tokens = await InferenceEngine.tokenize(model, settings.warmup_prompt)
+            await inference_executor.run(model, self._warm_up, model, tokens)
+        finally:
+            await lease.release()
+    
+    def is_loaded(self, model_name: str) -> bool:
+        """Whether the model is resident in the cache."""
+        return model_name in self.cache.entries
+    
+    @staticmethod
+    def _evaluate_prefix(model: Llama, tokens: list[int]):
+        """Evaluate ``tokens`` from an empty context and return the resulting state."""
+        model.reset()
+        model.eval(tokens)
+        return model.save_state()
+    
+    async def warm_prompt_states(self, only_model: Optional[str] = None) -> None:
+        """
+        Evaluate and snapshot the configured warm prompts.
+        
+        Runs as a startup task so the first real request sharing one of
+        these prefixes gets a prefix hit, even right after a restart.
+        Prompts already snapshotted on disk are skipped.
+        
+        Args:
+            only_model: Warm only the prompts targeting this model
+        """
+        for spec in settings.kv_warm_prompts:
+            name = spec.get("name", "unnamed")
+            model_name = spec.get("model") or settings.default_model
+            if only_model is not None and model_name != only_model:
+                continue
+            lease = None
+            try:
+                lease = await self.acquire_model(model_name)
+                model = lease.model
+                prefix_cache = model.cache
+                if not isinstance(prefix_cache, RadixPrefixCache) or prefix_cache.disk_store is None:
+                    logger.warning(f"Skipping warm prompt '{name}': KV snapshot store disabled")
+                    continue
+                
+                tokens = await InferenceEngine.tokenize(model, spec["prompt"])
+                if prefix_cache.disk_store.contains(tokens):
+                    logger.info(f"Warm prompt '{name}' already snapshotted for {model_name}")
+                    continue
+                
+                state = await inference_executor.run(model, self._evaluate_prefix, model, tokens)
+                prefix_cache[tokens] = state
+                await asyncio.to_thread(prefix_cache.persist)
+                logger.info(f"Warm prompt '{name}' snapshotted: {len(tokens)} tokens for {model_name}")
+            
+            except Exception as e:
+                logger.error(f"Failed to warm prompt '{name}': {e}", exc_info=True)
+            finally:
+                if lease is not None:
+                    await lease.release()
+    
+    async def watch_memory_pressure(self) -> None:
+        """Poll host memory and shed idle models before the OOM killer does."""
+        if available_memory() is None:
+            logger.info("Host memory pressure monitoring unavailable (no /proc/meminfo)")
+            return
+        while True:
+            await asyncio.sleep(settings.memory_poll_interval)
+            try:
+                evicted = await self.cache.relieve_pressure()
+                if evicted:
+                    logger.warning(f"Evicted {evicted} idle model(s) under host memory pressure")
+            except Exception as e:
+                logger.error(f"Memory pressure check failed: {e}", exc_info=True)
+    
+    async def watch_idle_models(self) -> None:
+        """Unload models whose idle TTL (``model_idle_ttl`` / ``model_idle_ttls``) has passed."""
+        if not settings.model_idle_ttl and not settings.model_idle_ttls:
+            return
+        while True:
+            await asyncio.sleep(settings.memory_poll_interval)
+            try:
+                for model_name in await self.cache.expire_idle(model_idle_ttl):
+                    logger.info(f"Unloaded idle model: {model_name}")
+            except Exception as e:
+                logger.error(f"Idle model check failed: {e}", exc_info=True)
+    
+    async def unload_model(self, model_name: str) -> None:
+        """Unload a specific model from cache, once its in-flight requests finish."""
+        logger.info(f"Unloading model: {model_name}")
+        await self.cache.retire(model_name)
+    
+    def pin_model(self, model_name: str) -> None:
+        """Exempt a model from eviction."""
+        self.cache.pinned.add(model_name)
+    
+    def unpin_model(self, model_name: str) -> None:
+        """Make a pinned model evictable again."""
+        self.cache.pinned.discard(model_name)
+    
+    def memory_stats(self) -> Dict[str, Any]:
+        """Loaded model footprints and memory limits."""
+        return self.cache.stats()
+    
+    def prefix_cache_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Prefix KV cache counters for every loaded model."""
+        return {
+            model_name: entry.model.cache.stats()
+            for model_name, entry in list(self.cache.entries.items())
+            if isinstance(entry.model.cache, RadixPrefixCache)
+        }
+    
+    def kv_store_stats(self) -> Optional[Dict[str, Any]]:
+        """On-disk KV snapshot store counters, if the store is enabled."""
+        return self.kv_store.stats() if self.kv_store is not None else None
     
     async def shutdown(self) -> None:
         """Gracefully shutdown the model manager."""
         logger.info("Shutting down ModelManager")
+        loads = [load.task for load in self.loads.values()]
+        for task in loads:
+            task.cancel()
+        await asyncio.gather(*loads, return_exceptions=True)
         await self.cache.clear()
 
 
@@ -0,0 +1,316 @@
+"""
+Cross-request prefix KV cache for GGUF models.
+
+Stores llama.cpp states keyed by the token ids they were evaluated on,
+indexed by a token-level radix tree, so a new request can restore the
+state of its longest cached prefix and evaluate only the remaining
+suffix. Plugs into ``Llama.set_cache`` via llama-cpp-python's
+``BaseLlamaCache`` interface, optionally backed by the on-disk
+snapshot store for prefixes that are not resident in RAM.
+"""
+
+import itertools
+import logging
+import threading
+from typing import Dict, Optional, Sequence, Tuple
+
+from llama_cpp.llama import LlamaState
+from llama_cpp.llama_cache import BaseLlamaCache
+
+from .kv_store import ModelStateStore, compact_state
+
+logger = logging.getLogger(__name__)
+
+EVICTION_POLICIES = ("lru", "lfu")
+
+
+class _Entry:
+    """A cached llama state plus its bookkeeping."""
+
+    def __init__(self, key: Tuple[int, ...], state: LlamaState, tick: int):
+        self.key = key
+        self.state = state
+        self.size_bytes = state.llama_state_size + state.scores.nbytes + state.input_ids.nbytes
+        self.last_access = tick
+        self.hits = 0
+        self.on_disk = False
+
+
+class _Node:
+    """Radix tree node; ``edge`` is the token run leading into this node."""
+
+    __slots__ = ("edge", "children", "entry", "parent")
+
+    def __init__(self, edge: Tuple[int, ...] = (), parent: Optional["_Node"] = None):
+        self.edge = edge
+        self.children: Dict[int, "_Node"] = {}
+        self.entry: Optional[_Entry] = None
+        self.parent = parent
+
+
+def _common_length(a: Sequence[int], b: Sequence[int]) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+class RadixPrefixCache(BaseLlamaCache):
+    """
+    Byte-budgeted llama state cache indexed by a token radix tree.
+
+    Lookups walk the tree along the query tokens, so finding the longest
+    cached prefix costs O(prompt length) regardless of how many states
+    are cached. Any state stored at or below the point where the walk
+    stops shares that prefix and can be restored.
+    """
+
+    def __init__(
+        self,
+        capacity_bytes: int = (2 << 30),
+        policy: str = "lru",
+        min_prefix_tokens: int = 32,
+        disk_store: Optional[ModelStateStore] = None,
+    ):
+        """
+        Initialize the cache.
+
+        Args:
+            capacity_bytes: Maximum total size of cached states
+            policy: Eviction policy, ``"lru"`` or ``"lfu"``
+            min_prefix_tokens: Shortest shared prefix worth restoring a state for
+            disk_store: Snapshot store consulted when RAM has a shorter prefix
+        """
+        if policy not in EVICTION_POLICIES:
+            raise ValueError(f"Unknown prefix cache eviction policy: {policy}")
+
+        super().__init__(capacity_bytes)
+        self.policy = policy
+        self.min_prefix_tokens = max(1, min_prefix_tokens)
+        self.disk_store = disk_store
+        self._root = _Node()
+        self._entries: Dict[Tuple[int, ...], _Entry] = {}
+        self._size_bytes = 0
+        self._clock = itertools.count()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.saved_tokens = 0
+        self.evictions = 0
+        self.disk_hits = 0
+
+    @property
+    def cache_size(self) -> int:
+        return self._size_bytes
+
+    # ------------------------------------------------------------------
+    # Radix tree
+    # ------------------------------------------------------------------
+
+    def _walk(self, key: Tuple[int, ...]) -> Tuple[_Node, int]:
+        """
+        Follow ``key`` down the tree as far as it matches.
+
+        Returns:
+            The deepest node whose subtree shares the matched prefix, and
+            the number of matched tokens
+        """
+        node = self._root
+        matched = 0
+        while matched < len(key):
+            child = node.children.get(key[matched])
+            if child is None:
+                break
+            common = _common_length(child.edge, key[matched:])
+            matched += common
+            node = child
+            if common < len(child.edge):
+                break
+        return node, matched
+
+    def _insert(self, key: Tuple[int, ...]) -> _Node:
+        """Return the node for ``key``, splitting edges as needed."""
+        node = self._root
+        i = 0
+        while i < len(key):
+            child = node.children.get(key[i])
+            if child is None:
+                leaf = _Node(key[i:], node)
+                node.children[key[i]] = leaf
+                return leaf
+            common = _common_length(child.edge, key[i:])
+            if common < len(child.edge):
+                # Split the edge at the divergence point
+                middle = _Node(child.edge[:common], node)
+                node.children[key[i]] = middle
+                child.edge = child.edge[common:]
+                child.parent = middle
+                middle.children[child.edge[0]] = child
+                child = middle
+            node = child
+            i += common
+        return node
+
+    def _remove(self, entry: _Entry) -> None:
+        """Detach an entry and prune nodes that no longer lead anywhere."""
+        node, matched = self._walk(entry.key)
+        if matched != len(entry.key) or node.entry is not entry:
+            return
+        node.entry = None
+        while node is not self._root and node.entry is None and not node.children:
+            parent = node.parent
+            del parent.children[node.edge[0]]
+            node = parent
+        # Merge a pass-through node into its only child to keep the tree compact
+        if node is not self._root and node.entry is None and len(node.children) == 1:
+            (child,) = node.children.values()
+            child.edge = node.edge + child.edge
+            child.parent = node.parent
+            node.parent.children[child.edge[0]] = child
+
+    @staticmethod
+    def _any_entry(node: _Node) -> Optional[_Entry]:
+        """Most recently used entry in a subtree."""
+        best = None
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            if current.entry is not None and (best is None or current.entry.last_access > best.last_access):
+                best = current.entry
+            stack.extend(current.children.values())
+        return best
+
+    # ------------------------------------------------------------------
+    # BaseLlamaCache interface
+    # ------------------------------------------------------------------
+
+    def _find_longest_prefix_key(self, key: Tuple[int, ...]) -> Optional[Tuple[int, ...]]:
+        with self._lock:
+            node, matched = self._walk(tuple(key))
+            if matched < self.min_prefix_tokens:
+                return None
+            entry = self._any_entry(node)
+            return entry.key if entry is not None else None
+
+    def __getitem__(self, key: Sequence[int]) -> LlamaState:
+        key = tuple(key)
+        with self._lock:
+            node, matched = self._walk(key)
+            entry = self._any_entry(node) if matched >= self.min_prefix_tokens else None
+
+            if self.disk_store is not None and matched < len(key) - 1:
+                found = self.disk_store.lookup(key, min_length=max(matched + 1, self.min_prefix_tokens))
+                if found is not None:
+                    disk_matched, state = found
+                    disk_entry = self._store(tuple(state.input_ids[:state.n_tokens]), state)
+                    if disk_entry is not None:
+                        disk_entry.on_disk = True
+                    self.hits += 1
+                    self.disk_hits += 1
+                    self.saved_tokens += disk_matched
+                    return state
+
+            if entry is None:
+                self.misses += 1
+                raise KeyError("Key not found")
+
+            entry.last_access = next(self._clock)
+            entry.hits += 1
+            self.hits += 1
+            self.saved_tokens += min(matched, len(entry.key))
+            return entry.state
+
+    def __contains__(self, key: Sequence[int]) -> bool:
+        return self._find_longest_prefix_key(tuple(key)) is not None
+
+    def __setitem__(self, key: Sequence[int], value: LlamaState) -> None:
+        with self._lock:
+            self._store(tuple(key), compact_state(value))
+
+    def _store(self, key: Tuple[int, ...], state: LlamaState) -> Optional[_Entry]:
+        """Insert a state under ``key`` and evict down to budget (lock held)."""
+        existing = self._entries.pop(key, None)
+        if existing is not None:
+            self._size_bytes -= existing.size_bytes
+            self._remove(existing)
+
+        entry = _Entry(key, state, next(self._clock))
+        if entry.size_bytes > self.capacity_bytes:
+            logger.debug(f"Prefix state of {entry.size_bytes} bytes exceeds cache budget; not cached")
+            return None
+
+        self._insert(key).entry = entry
+        self._entries[key] = entry
+        self._size_bytes += entry.size_bytes
+
+        while self._size_bytes > self.capacity_bytes:
+            self._evict_one(protect=entry)
+        return entry
+
+    def _evict_one(self, protect: _Entry) -> None:
+        if self.policy == "lfu":
+            rank = lambda e: (e.hits, e.last_access)
+        else:
+            rank = lambda e: e.last_access
+        victim = min((e for e in self._entries.values() if e is not protect), key=rank)
+        del self._entries[victim.key]
+        self._size_bytes -= victim.size_bytes
+        self._remove(victim)
+        self.evictions += 1
+
+    # ------------------------------------------------------------------
+    # Reporting
+    # ------------------------------------------------------------------
+
+    def persist(self) -> int:
+        """
+        Write resident states that are not yet on disk to the snapshot store.
+
+        Returns:
+            Number of snapshots written
+        """
+        if self.disk_store is None:
+            return 0
+        with self._lock:
+            pending = sorted(
+                (e for e in self._entries.values() if not e.on_disk),
+                key=lambda e: e.last_access,
+                reverse=True,
+            )
+        written = 0
+        for entry in pending:
+            state = entry.state
+            if self.disk_store.contains(state.input_ids[:state.n_tokens].tolist()):
+                entry.on_disk = True
+                continue
+            if self.disk_store.save(state) is not None:
+                entry.on_disk = True
+                written += 1
+        return written
+
+    def clear(self) -> None:
+        """Drop all cached states."""
+        with self._lock:
+            self._root = _Node()
+            self._entries.clear()
+            self._size_bytes = 0
+
+    def stats(self) -> dict:
+        """Counters for monitoring."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "size_bytes": self._size_bytes,
+                "capacity_bytes": self.capacity_bytes,
+                "policy": self.policy,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "saved_tokens": self.saved_tokens,
+                "evictions": self.evictions,
+                "disk_hits": self.disk_hits,
+            }
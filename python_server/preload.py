@@ -0,0 +1,83 @@
+"""
+Startup preloading and readiness.
+
+Loads the configured ``preload_models`` in the background at startup,
+prefetching weights and running a warmup evaluation for each, and tracks
+per-model readiness for the ``/ready`` endpoint so load balancers only
+route traffic once the models are hot.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List
+
+from .config import settings
+from .model_manager import model_manager
+from .workers import worker_pool
+
+logger = logging.getLogger(__name__)
+
+PENDING, LOADING, READY, FAILED = "pending", "loading", "ready", "failed"
+
+
+class Preloader:
+    """Preloads models one at a time and records their readiness."""
+
+    def __init__(self, model_names: List[str]):
+        """
+        Initialize the preloader.
+
+        Args:
+            model_names: Models to load at startup, in order
+        """
+        self.model_names = list(dict.fromkeys(model_names))
+        self.states: Dict[str, Dict[str, Any]] = {
+            model_name: {"state": PENDING} for model_name in self.model_names
+        }
+
+    @staticmethod
+    def _target():
+        return worker_pool if settings.worker_processes else model_manager
+
+    async def run(self) -> None:
+        """
+        Preload every configured model.
+
+        Models load sequentially so they do not compete for disk bandwidth;
+        a failure is recorded and does not stop the remaining preloads.
+        """
+        for model_name in self.model_names:
+            state = self.states[model_name]
+            state.update(state=LOADING, started_at=time.time())
+            start = time.perf_counter()
+            try:
+                await self._target().preload(model_name)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                state.update(state=FAILED, error=str(e))
+                logger.error(f"Preload of {model_name} failed: {e}")
+                continue
+            state.update(state=READY, load_seconds=round(time.perf_counter() - start, 3))
+            logger.info(f"✓ Preloaded and warmed {model_name} in {state['load_seconds']:.1f}s")
+
+    def status(self) -> Dict[str, Any]:
+        """
+        Readiness of each preloaded model.
+
+        A model that finished preloading but has since been evicted or
+        whose worker is down reports ``loaded: false`` and is not ready.
+        """
+        target = self._target()
+        models = {}
+        for model_name, state in self.states.items():
+            entry = dict(state)
+            entry["loaded"] = target.is_loaded(model_name)
+            models[model_name] = entry
+        ready = all(entry["state"] == READY and entry["loaded"] for entry in models.values())
+        return {"ready": ready, "models": models}
+
+
+# Global preloader instance
+preloader = Preloader(settings.preload_models)
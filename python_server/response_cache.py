@@ -0,0 +1,314 @@
+"""
+Exact-match cache of deterministic completion responses.
+
+Greedy (``temperature=0``) and fixed-seed requests always produce the
+same output for the same model file, prompt and sampling parameters, so
+repeated requests, as batch jobs and CI pipelines send them, are
+answered from this cache without admission, model load or generation.
+Entries live in an in-memory LRU with a TTL and, optionally, spill to
+``cache_dir/responses`` when evicted from memory.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from .config import settings, get_model_path
+from .kv_store import model_fingerprint
+
+logger = logging.getLogger(__name__)
+
+ENTRY_SUFFIX = ".json"
+
+
+def cache_policy(cache_control: Optional[str]) -> Tuple[bool, bool]:
+    """
+    Read a request's ``Cache-Control`` header.
+
+    ``no-cache`` skips the lookup but stores the fresh result; ``no-store``
+    bypasses the cache entirely.
+
+    Returns:
+        (look up, store)
+    """
+    if not cache_control:
+        return True, True
+    directives = {part.strip().lower() for part in cache_control.split(",")}
+    if "no-store" in directives:
+        return False, False
+    if "no-cache" in directives:
+        return False, True
+    return True, True
+
+
+def is_deterministic(temperature: float, seed: Optional[int]) -> bool:
+    """
+    Whether a request's output is fully determined by its inputs.
+
+    Greedy decoding always is. A fixed seed is only honored by the
+    per-request engine; the continuous batching engine samples all
+    sequences from one shared generator.
+    """
+    if temperature <= 0:
+        return True
+    return seed is not None and not settings.enable_continuous_batching
+
+
+class _Entry:
+    """One cached response."""
+
+    def __init__(self, model_name: str, value: Dict[str, Any], expires_at: float):
+        self.model_name = model_name
+        self.value = value
+        self.expires_at = expires_at
+
+    def to_json(self) -> bytes:
+        return json.dumps({"model": self.model_name, "expires_at": self.expires_at, "value": self.value}).encode()
+
+    @classmethod
+    def from_json(cls, data: bytes) -> "_Entry":
+        entry = json.loads(data)
+        return cls(entry["model"], entry["value"], entry["expires_at"])
+
+
+class ResponseCache:
+    """
+    LRU + TTL cache of generation results keyed by model identity, prompt and parameters.
+
+    The memory tier is touched only from the event loop. The disk tier
+    holds entries evicted from memory, one JSON file per entry, and is
+    evicted least-recently-used once it exceeds ``disk_max_bytes``.
+    """
+
+    def __init__(self, max_entries: int, ttl: float, disk_dir: Optional[Path] = None, disk_max_bytes: int = 0):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries: Responses kept in memory (0 disables the cache)
+            ttl: Seconds a response stays valid (0 = until evicted)
+            disk_dir: Directory for spilled entries (None = memory only)
+            disk_max_bytes: Size cap of the disk tier
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = Path(disk_dir) if disk_dir is not None and disk_max_bytes > 0 else None
+        self.disk_max_bytes = disk_max_bytes
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        # Disk index: key -> size in bytes, least recently written first; built lazily
+        self._disk: Optional["OrderedDict[str, int]"] = None
+        self._disk_bytes = 0
+        self._disk_lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _model_stats(self, model_name: str) -> Dict[str, int]:
+        return self._stats.setdefault(
+            model_name,
+            {"hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0},
+        )
+
+    # ------------------------------------------------------------------
+    # Keys
+    # ------------------------------------------------------------------
+
+    async def key(
+        self,
+        model_name: str,
+        kind: str,
+        prompt: Union[str, List[int], List[dict]],
+        params: Dict[str, Any],
+    ) -> Optional[str]:
+        """
+        Cache key of a request, or None when the model file does not exist.
+
+        The model is identified by its file fingerprint, so replacing a
+        GGUF under the same name never serves stale responses.
+
+        Args:
+            model_name: Model serving the request
+            kind: ``completion`` or ``chat``
+            prompt: Prompt text, token ids, or chat messages as role/content dicts
+            params: Every parameter that affects the output
+        """
+        try:
+            model_path = get_model_path(model_name)
+            fingerprint = await asyncio.to_thread(model_fingerprint, model_path)
+        except (FileNotFoundError, OSError):
+            return None
+        material = json.dumps(
+            [fingerprint, kind, prompt, sorted(params.items())],
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+        return hashlib.sha256(material.encode()).hexdigest()
+
+    # ------------------------------------------------------------------
+    # Lookup / store
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _expired(entry: _Entry) -> bool:
+        return bool(entry.expires_at) and time.time() >= entry.expires_at
+
+    async def get(self, model_name: str, key: str) -> Optional[Dict[str, Any]]:
+        """Cached response for ``key``, counted as a hit or miss for ``model_name``."""
+        stats = self._model_stats(model_name)
+        entry = self._entries.get(key)
+        if entry is not None:
+            if self._expired(entry):
+                del self._entries[key]
+                stats["expired"] += 1
+            else:
+                self._entries.move_to_end(key)
+                stats["hits"] += 1
+                return entry.value
+
+        if self.disk_dir is not None:
+            entry = await asyncio.to_thread(self._disk_read, key)
+            if entry is not None and self._expired(entry):
+                stats["expired"] += 1
+            elif entry is not None:
+                stats["disk_hits"] += 1
+                await self._remember(key, entry)
+                return entry.value
+
+        stats["misses"] += 1
+        return None
+
+    async def put(self, model_name: str, key: str, value: Dict[str, Any]) -> None:
+        """Store a finished response."""
+        expires_at = time.time() + self.ttl if self.ttl > 0 else 0
+        self._model_stats(model_name)["stores"] += 1
+        await self._remember(key, _Entry(model_name, value, expires_at))
+
+    async def _remember(self, key: str, entry: _Entry) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        spilled = []
+        while len(self._entries) > self.max_entries:
+            victim_key, victim = self._entries.popitem(last=False)
+            self._model_stats(victim.model_name)["evictions"] += 1
+            if self.disk_dir is not None and not self._expired(victim):
+                spilled.append((victim_key, victim))
+        for victim_key, victim in spilled:
+            await asyncio.to_thread(self._disk_write, victim_key, victim)
+
+    async def clear(self) -> None:
+        """Drop every cached response, including spilled ones."""
+        self._entries.clear()
+        if self.disk_dir is not None:
+            await asyncio.to_thread(self._disk_clear)
+
+    # ------------------------------------------------------------------
+    # Disk tier (runs on worker threads; helpers expect the lock held)
+    # ------------------------------------------------------------------
+
+    def _disk_index(self) -> "OrderedDict[str, int]":
+        if self._disk is None:
+            self._disk = OrderedDict()
+            self._disk_bytes = 0
+            if self.disk_dir.exists():
+                paths = sorted(self.disk_dir.glob(f"*{ENTRY_SUFFIX}"), key=lambda p: p.stat().st_mtime)
+                for path in paths:
+                    size = path.stat().st_size
+                    self._disk[path.stem] = size
+                    self._disk_bytes += size
+        return self._disk
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / f"{key}{ENTRY_SUFFIX}"
+
+    def _disk_read(self, key: str) -> Optional[_Entry]:
+        """Take an entry out of the disk tier (it returns to memory)."""
+        with self._disk_lock:
+            if key not in self._disk_index():
+                return None
+            try:
+                entry = _Entry.from_json(self._disk_path(key).read_bytes())
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Dropping unreadable cached response {key}: {e}")
+                entry = None
+            self._disk_delete(key)
+            return entry
+
+    def _disk_write(self, key: str, entry: _Entry) -> None:
+        """Spill an entry evicted from memory, evicting the oldest spilled ones over the cap."""
+        data = entry.to_json()
+        if len(data) > self.disk_max_bytes:
+            return
+        with self._disk_lock:
+            index = self._disk_index()
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            path = self._disk_path(key)
+            tmp_path = path.with_suffix(".tmp")
+            try:
+                tmp_path.write_bytes(data)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logger.warning(f"Could not spill cached response to {path}: {e}")
+                return
+            self._disk_bytes += len(data) - index.pop(key, 0)
+            index[key] = len(data)
+            while self._disk_bytes > self.disk_max_bytes and index:
+                self._disk_delete(next(iter(index)))
+
+    def _disk_clear(self) -> None:
+        with self._disk_lock:
+            for key in list(self._disk_index()):
+                self._disk_delete(key)
+
+    def _disk_delete(self, key: str) -> None:
+        index = self._disk_index()
+        size = index.pop(key, None)
+        if size is None:
+            return
+        self._disk_bytes -= size
+        try:
+            self._disk_path(key).unlink()
+        except OSError:
+            pass
+
+    # ------------------------------------------------------------------
+    # Monitoring
+    # ------------------------------------------------------------------
+
+    def stats(self) -> Dict[str, Any]:
+        """Per-model hit rates plus tier sizes."""
+        models = {}
+        for model_name, counters in self._stats.items():
+            hits = counters["hits"] + counters["disk_hits"]
+            lookups = hits + counters["misses"]
+            models[model_name] = {
+                **counters,
+                "entries": sum(1 for entry in self._entries.values() if entry.model_name == model_name),
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            }
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "disk_entries": len(self._disk) if self._disk is not None else None,
+            "disk_bytes": self._disk_bytes if self._disk is not None else None,
+            "models": models,
+        }
+
+
+# Global response cache instance
+response_cache = ResponseCache(
+    settings.response_cache_size,
+    settings.response_cache_ttl,
+    Path(settings.cache_dir) / "responses",
+    settings.response_cache_disk_bytes,
+)
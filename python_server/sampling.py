@@ -0,0 +1,68 @@
+"""
+Parallel sampling helpers (``n`` / ``best_of``).
+
+Both engines sample several choices from one prompt evaluation: the
+continuous batching engine forks the prompt's KV cells into one sequence
+per choice, the per-request engine decodes the choices back to back on a
+context that keeps the prompt. For ``best_of`` every choice tracks the
+sum of its tokens' log probabilities under the model, and the ``n``
+highest-scoring choices are returned.
+"""
+
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+
+def log_normalizer(logits: np.ndarray) -> float:
+    """``log(sum(exp(logits)))`` computed without overflow."""
+    peak = float(logits.max())
+    return peak + float(np.log(np.exp(logits - peak).sum()))
+
+
+class ChoiceLogprob:
+    """
+    ``llama_cpp`` logits processor summing the log probability of each sampled token.
+
+    Sees the raw logits right before each token is sampled; ``accept``
+    then adds the sampled token's log probability. It never modifies
+    the logits.
+    """
+
+    def __init__(self):
+        self.total = 0.0
+        self._logits: Optional[np.ndarray] = None
+        self._normalizer = 0.0
+
+    def reset(self) -> None:
+        self.total = 0.0
+        self._logits = None
+
+    def __call__(self, input_ids: Any, scores: np.ndarray) -> np.ndarray:
+        self._logits = scores.copy()
+        self._normalizer = log_normalizer(self._logits)
+        return scores
+
+    def accept(self, token: int) -> None:
+        if self._logits is not None:
+            self.total += float(self._logits[token]) - self._normalizer
+            self._logits = None
+
+
+def select_choices(choices: List[Dict[str, Any]], n: int) -> List[Dict[str, Any]]:
+    """
+    The ``n`` choices to return, re-indexed from 0.
+
+    With more sampled choices than requested (``best_of``), the ones
+    with the highest cumulative log probability win.
+    """
+    if len(choices) > n:
+        choices = sorted(choices, key=lambda choice: choice.get("logprob", 0.0), reverse=True)[:n]
+    return [{**choice, "index": index} for index, choice in enumerate(choices)]
+
+
+def result_choices(result: Dict[str, Any], n: int) -> List[Dict[str, Any]]:
+    """The ``n`` choices of a finished generation; the most likely ones when more were sampled."""
+    if "choices" not in result:
+        return [{"index": 0, "text": result["text"], "finish_reason": result["finish_reason"]}]
+    return select_choices(result["choices"], n)
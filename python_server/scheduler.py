@@ -0,0 +1,313 @@
+"""
+Admission control for inference requests.
+
+Keeps a bounded FIFO queue and a concurrency cap per model, enforces
+request deadlines, and sheds load early (with a Retry-After hint) when
+the queue is full or the estimated wait would exceed the deadline.
+Background work (batch jobs) waits in a separate queue that is served
+only while no interactive request is waiting.
+"""
+
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+from .config import settings
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Weight of the newest sample in the tokens/second moving average
+THROUGHPUT_EWMA_ALPHA = 0.3
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed instead of being queued."""
+
+    def __init__(self, status_code: int, message: str, retry_after: float):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class Ticket:
+    """
+    Admission slot held by a single request.
+
+    Tracks the request deadline and the token budget it reserved, and
+    must be released exactly once when the request finishes.
+    """
+
+    def __init__(self, scheduler: "RequestScheduler", model_name: str, max_tokens: int, deadline: float):
+        self.scheduler = scheduler
+        self.model_name = model_name
+        self.max_tokens = max_tokens
+        self.deadline = deadline
+        self.arrived = time.time()
+        self.future: Optional[asyncio.Future] = None
+        self.released = False
+
+    def remaining(self) -> float:
+        """Seconds left before the request deadline."""
+        return self.deadline - asyncio.get_running_loop().time()
+
+    def record(self, tokens: int, elapsed: float) -> None:
+        """Report generated tokens so the scheduler can refine wait estimates."""
+        self.scheduler.record_throughput(self.model_name, tokens, elapsed)
+
+    def release(self) -> None:
+        """Return the slot to the scheduler (idempotent)."""
+        if not self.released:
+            self.released = True
+            self.scheduler.release(self)
+
+
+class _ModelQueue:
+    """Per-model admission state."""
+
+    def __init__(self):
+        self.active = 0
+        self.replicas = 1
+        self.waiters: Deque[Ticket] = deque()
+        self.background: Deque[Ticket] = deque()
+        self.reserved_tokens = 0
+        self.tokens_per_second: Optional[float] = None
+
+    def estimated_wait(self) -> Optional[float]:
+        """Seconds until a newly queued request would start, if throughput is known."""
+        if not self.tokens_per_second:
+            return None
+        # Replicas drain the queue in parallel
+        return self.reserved_tokens / (self.tokens_per_second * self.replicas)
+
+
+class RequestScheduler:
+    """
+    Per-model admission controller.
+
+    Each model admits ``max_concurrency`` requests per loaded replica;
+    requests beyond that wait in a FIFO queue of at most
+    ``max_queue_depth`` entries. All bookkeeping happens on the event
+    loop, so no locking is required.
+    """
+
+    def __init__(self, max_concurrency: int = 1, max_queue_depth: int = 16, default_timeout: float = 600):
+        """
+        Initialize the scheduler.
+
+        Args:
+            max_concurrency: Requests allowed to run concurrently per model replica
+            max_queue_depth: Requests allowed to wait per model
+            default_timeout: Deadline in seconds when the client sets none
+        """
+        self.max_concurrency = max_concurrency
+        self.max_queue_depth = max_queue_depth
+        self.default_timeout = default_timeout
+        self._queues: Dict[str, _ModelQueue] = {}
+
+    def _queue(self, model_name: str) -> _ModelQueue:
+        queue = self._queues.get(model_name)
+        if queue is None:
+            queue = _ModelQueue()
+            self._queues[model_name] = queue
+        return queue
+
+    async def acquire(self, model_name: str, max_tokens: int, timeout: Optional[float] = None) -> Ticket:
+        """
+        Admit a request, waiting for a free slot if necessary.
+
+        Args:
+            model_name: Model the request targets
+            max_tokens: Token budget of the request (used for wait estimates)
+            timeout: Client deadline in seconds (capped at ``default_timeout``)
+
+        Returns:
+            Ticket that must be released when the request finishes
+
+        Raises:
+            AdmissionRejected: Queue full (429) or deadline unreachable (503)
+        """
+        loop = asyncio.get_running_loop()
+        if timeout is None or timeout <= 0:
+            timeout = self.default_timeout
+        timeout = min(timeout, self.default_timeout)
+
+        queue = self._queue(model_name)
+        ticket = Ticket(self, model_name, max_tokens, loop.time() + timeout)
+
+        if queue.active < self._limit(queue) and not queue.waiters:
+            queue.active += 1
+            queue.reserved_tokens += max_tokens
+            metrics.queue_wait.labels(model_name, "interactive").observe(0.0)
+            return ticket
+
+        estimated_wait = queue.estimated_wait()
+
+        if len(queue.waiters) >= self.max_queue_depth:
+            logger.warning(f"Shedding request for {model_name}: queue full ({len(queue.waiters)} waiting)")
+            raise AdmissionRejected(
+                429,
+                f"Too many queued requests for model {model_name}",
+                retry_after=estimated_wait or 1,
+            )
+
+        if estimated_wait is not None and estimated_wait > timeout:
+            logger.warning(
+                f"Shedding request for {model_name}: estimated wait {estimated_wait:.1f}s "
+                f"exceeds deadline {timeout:.1f}s"
+            )
+            raise AdmissionRejected(
+                503,
+                f"Estimated wait for model {model_name} exceeds request deadline",
+                retry_after=estimated_wait,
+            )
+
+        ticket.future = loop.create_future()
+        queue.waiters.append(ticket)
+        queue.reserved_tokens += max_tokens
+
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.future), timeout)
+        except asyncio.TimeoutError:
+            self._abandon(queue, ticket)
+            raise AdmissionRejected(
+                503,
+                f"Request for model {model_name} timed out in queue",
+                retry_after=queue.estimated_wait() or 1,
+            )
+        except asyncio.CancelledError:
+            self._abandon(queue, ticket)
+            raise
+
+        metrics.queue_wait.labels(model_name, "interactive").observe(time.time() - ticket.arrived)
+        return ticket
+
+    async def acquire_background(self, model_name: str, max_tokens: int) -> Ticket:
+        """
+        Admit a background request at the lowest priority.
+
+        Background requests get a slot only when no interactive request is
+        waiting for the model, are never shed, and their deadline
+        (``default_timeout``) starts once admitted.
+
+        Args:
+            model_name: Model the request targets
+            max_tokens: Token budget of the request (used for wait estimates)
+
+        Returns:
+            Ticket that must be released when the request finishes
+        """
+        loop = asyncio.get_running_loop()
+        queue = self._queue(model_name)
+        ticket = Ticket(self, model_name, max_tokens, loop.time() + self.default_timeout)
+
+        if queue.active < self._limit(queue) and not queue.waiters and not queue.background:
+            queue.active += 1
+            queue.reserved_tokens += max_tokens
+            metrics.queue_wait.labels(model_name, "background").observe(0.0)
+            return ticket
+
+        ticket.future = loop.create_future()
+        queue.background.append(ticket)
+        try:
+            await asyncio.shield(ticket.future)
+        except asyncio.CancelledError:
+            if ticket.future.done() and not ticket.future.cancelled():
+                ticket.release()
+            else:
+                ticket.future.cancel()
+                ticket.released = True
+                queue.background.remove(ticket)
+            raise
+
+        ticket.deadline = loop.time() + self.default_timeout
+        metrics.queue_wait.labels(model_name, "background").observe(time.time() - ticket.arrived)
+        return ticket
+
+    def _abandon(self, queue: _ModelQueue, ticket: Ticket) -> None:
+        """Drop a waiting ticket, handing its slot on if it was already granted."""
+        if ticket.future.done() and not ticket.future.cancelled():
+            ticket.release()
+            return
+        ticket.future.cancel()
+        ticket.released = True
+        try:
+            queue.waiters.remove(ticket)
+        except ValueError:
+            pass
+        queue.reserved_tokens -= ticket.max_tokens
+
+    def release(self, ticket: Ticket) -> None:
+        """Free a slot and wake the next waiter for the same model."""
+        queue = self._queue(ticket.model_name)
+        queue.active -= 1
+        queue.reserved_tokens -= ticket.max_tokens
+
+        self._wake(queue)
+
+    def _limit(self, queue: _ModelQueue) -> int:
+        return self.max_concurrency * queue.replicas
+
+    def _wake(self, queue: _ModelQueue) -> None:
+        """Grant free slots to waiters in FIFO order, background requests last."""
+        while queue.waiters and queue.active < self._limit(queue):
+            waiter = queue.waiters.popleft()
+            if waiter.future.done():
+                continue
+            queue.active += 1
+            waiter.future.set_result(True)
+        while queue.background and not queue.waiters and queue.active < self._limit(queue):
+            waiter = queue.background.popleft()
+            if waiter.future.done():
+                continue
+            queue.active += 1
+            # Background tokens count toward estimates only once running
+            queue.reserved_tokens += waiter.max_tokens
+            waiter.future.set_result(True)
+
+    def set_replicas(self, model_name: str, replicas: int) -> None:
+        """Scale a model's concurrency to its number of loaded replicas."""
+        queue = self._queue(model_name)
+        queue.replicas = max(1, replicas)
+        self._wake(queue)
+
+    def queue_depth(self, model_name: str) -> int:
+        """Requests currently waiting for a slot on a model."""
+        queue = self._queues.get(model_name)
+        return len(queue.waiters) if queue is not None else 0
+
+    def occupancy(self) -> Dict[Tuple[str], Tuple[int, int]]:
+        """``(model,) -> (running, waiting)`` for every model seen, waiting including background requests."""
+        return {
+            (model_name,): (queue.active, len(queue.waiters) + len(queue.background))
+            for model_name, queue in list(self._queues.items())
+        }
+
+    def record_throughput(self, model_name: str, tokens: int, elapsed: float) -> None:
+        """Fold a completed generation into the model's tokens/second estimate."""
+        if tokens <= 0 or elapsed <= 0:
+            return
+        queue = self._queue(model_name)
+        sample = tokens / elapsed
+        if queue.tokens_per_second is None:
+            queue.tokens_per_second = sample
+        else:
+            queue.tokens_per_second = (
+                THROUGHPUT_EWMA_ALPHA * sample + (1 - THROUGHPUT_EWMA_ALPHA) * queue.tokens_per_second
+            )
+
+
+request_scheduler = RequestScheduler(
+    max_concurrency=(
+        settings.batch_max_sequences
+        if settings.enable_continuous_batching
+        else settings.max_concurrent_requests
+    ),
+    max_queue_depth=settings.max_queue_depth,
+    default_timeout=settings.request_timeout,
+)
+metrics.watch_scheduler(request_scheduler.occupancy)
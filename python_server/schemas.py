@@ -5,8 +5,8 @@ Defines Pydantic models for API contracts, ensuring type safety
 and automatic validation/documentation.
 """
 
-from typing import Optional, List, Dict, Any
-from pydantic import BaseModel, Field
+from typing import Optional, List, Dict, Any, Literal, Union
+from pydantic import BaseModel, Field, conlist
 
 
 class CompletionRequest(BaseModel):
@@ -17,9 +17,9 @@ class CompletionRequest(BaseModel):
     model behavior during inference.
     """
     
-    prompt: str = Field(
+    prompt: Union[str, conlist(int, min_length=1)] = Field(
         ...,
-        description="Input text prompt for generation"
+        description="Input text prompt for generation, or pre-tokenized prompt as token ids"
     )
     
     model: Optional[str] = Field(
@@ -60,6 +60,23 @@ class CompletionRequest(BaseModel):
         description="Repeat penalty to avoid redundant tokens"
     )
     
+    seed: Optional[int] = Field(
+        None,
+        description="Sampling seed; makes sampled output reproducible (and cacheable)"
+    )
+    
+    n: int = Field(
+        1,
+        ge=1,
+        description="Number of choices to return; all share one prompt evaluation"
+    )
+    
+    best_of: Optional[int] = Field(
+        None,
+        ge=1,
+        description="Choices to sample, returning the n with the highest log probability (>= n)"
+    )
+    
     stream: bool = Field(
         False,
         description="Enable streaming response"
@@ -81,6 +98,7 @@ class ChatCompletionRequest(BaseModel):
     
     messages: List[ChatMessage] = Field(
         ...,
+        min_length=1,
         description="Conversation history"
     )
     
@@ -116,10 +134,62 @@ class ChatCompletionRequest(BaseModel):
         description="Top-K sampling"
     )
     
+    seed: Optional[int] = Field(
+        None,
+        description="Sampling seed; makes sampled output reproducible (and cacheable)"
+    )
+    
+    n: int = Field(
+        1,
+        ge=1,
+        description="Number of choices to return; all share one prompt evaluation"
+    )
+    
+    best_of: Optional[int] = Field(
+        None,
+        ge=1,
+        description="Choices to sample, returning the n with the highest log probability (>= n)"
+    )
+    
     stream: bool = Field(
         False,
         description="Enable streaming response"
     )
+    
+    session_id: Optional[str] = Field(
+        None,
+        min_length=1,
+        max_length=256,
+        description="Chat session id; the server keeps the session's KV state so each turn evaluates only new messages"
+    )
+
+
+class EmbeddingRequest(BaseModel):
+    """
+    Embedding request schema (OpenAI-compatible).
+    
+    Accepts one input or an array of inputs, each text or token ids.
+    """
+    
+    input: Union[str, List[str], List[int], List[List[int]]] = Field(
+        ...,
+        description="Text or token ids to embed, or an array of them"
+    )
+    
+    model: Optional[str] = Field(
+        None,
+        description="Model name (if None, uses default)"
+    )
+    
+    encoding_format: Literal["float", "base64"] = Field(
+        "float",
+        description="Return vectors as float arrays or base64-encoded little-endian float32"
+    )
+    
+    normalize: bool = Field(
+        True,
+        description="Scale vectors to unit length"
+    )
 
 
 class CompletionChoice(BaseModel):
@@ -141,7 +211,7 @@ class CompletionResponse(BaseModel):
     created: int = Field(..., description="Unix timestamp")
     model: str = Field(..., description="Model used")
     choices: List[CompletionChoice] = Field(..., description="Generated completions")
-    usage: Dict[str, int] = Field(..., description="Token usage statistics")
+    usage: Dict[str, Any] = Field(..., description="Token usage statistics")
 
 
 class ChatCompletionChoice(BaseModel):
@@ -163,7 +233,7 @@ class ChatCompletionResponse(BaseModel):
     created: int = Field(..., description="Unix timestamp")
     model: str = Field(..., description="Model used")
     choices: List[ChatCompletionChoice] = Field(..., description="Generated choices")
-    usage: Dict[str, int] = Field(..., description="Token usage statistics")
+    usage: Dict[str, Any] = Field(..., description="Token usage statistics")
 
 
 class StreamedCompletion(BaseModel):
@@ -181,6 +251,15 @@ class ModelInfo(BaseModel):
     size_bytes: int
     type: str = "gguf"
     created: int
+    architecture: Optional[str] = None
+    display_name: Optional[str] = None
+    parameter_count: Optional[int] = None
+    quantization: Optional[str] = None
+    context_length: Optional[int] = None
+    vocab_size: Optional[int] = None
+    chat_template: Optional[str] = None
+    kv_bytes_per_token: Optional[int] = None
+    error: Optional[str] = Field(None, description="Why the GGUF header could not be read")
 
 
 class AvailableModels(BaseModel):
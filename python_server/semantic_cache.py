@@ -0,0 +1,373 @@
+"""
+Semantic cache of chat answers for near-duplicate questions.
+
+The exact-match response cache only helps when a request repeats byte
+for byte. This cache embeds the last user turn of a chat request and
+searches the answers cached for the same model and the same preceding
+conversation; when the best cosine similarity reaches the model's
+threshold, the stored answer is returned instead of decoding a new one.
+
+Each model has one index: a float32 NumPy matrix of unit-length question
+embeddings searched with a single matrix-vector product, plus parallel
+arrays of context ids, expiry and last-use times. Indexes are bounded by
+``semantic_cache_size`` (expired entries are replaced first, then the
+least recently used) and are saved to ``cache_dir/semantic``.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .config import settings, get_model_path
+from .kv_store import model_fingerprint
+
+logger = logging.getLogger(__name__)
+
+INDEX_SUFFIX = ".npz"
+INITIAL_ROWS = 64
+
+
+class SemanticProbe:
+    """A looked-up question: where to store its answer on a miss."""
+
+    def __init__(self, embedding_model: str, context: int, vector: np.ndarray):
+        self.embedding_model = embedding_model
+        self.context = context
+        self.vector = vector
+
+
+class _SemanticIndex:
+    """Cached answers of one model, as parallel arrays."""
+
+    def __init__(self, embedding_model: str):
+        self.embedding_model = embedding_model
+        self.size = 0
+        self.vectors: Optional[np.ndarray] = None
+        self.contexts = np.empty(0, dtype=np.int64)
+        self.expires = np.empty(0, dtype=np.float64)
+        self.last_used = np.empty(0, dtype=np.float64)
+        self.answers: List[Dict[str, Any]] = []
+        self.dirty = False
+
+    def _live(self, now: float) -> np.ndarray:
+        expires = self.expires[:self.size]
+        return (expires == 0) | (expires > now)
+
+    def search(self, context: int, vector: np.ndarray, now: float) -> Tuple[Optional[int], float]:
+        """
+        Most similar live entry asked in the same context.
+
+        Returns:
+            (row, cosine similarity), or (None, 0.0) without candidates
+        """
+        if self.size == 0 or self.vectors.shape[1] != vector.shape[0]:
+            return None, 0.0
+        candidates = np.flatnonzero((self.contexts[:self.size] == context) & self._live(now))
+        if candidates.size == 0:
+            return None, 0.0
+        scores = self.vectors[candidates] @ vector
+        best = int(np.argmax(scores))
+        return int(candidates[best]), float(scores[best])
+
+    def _slot(self, capacity: int, now: float) -> Tuple[int, bool]:
+        """Row for a new entry: the next free one, else expired or least recently used."""
+        if self.size < capacity:
+            if self.size == len(self.contexts):
+                rows = min(capacity, max(INITIAL_ROWS, 2 * self.size))
+                self.vectors = np.resize(self.vectors, (rows, self.vectors.shape[1]))
+                self.contexts = np.resize(self.contexts, rows)
+                self.expires = np.resize(self.expires, rows)
+                self.last_used = np.resize(self.last_used, rows)
+            self.size += 1
+            self.answers.append({})
+            return self.size - 1, False
+        expired = np.flatnonzero(~self._live(now))
+        if expired.size:
+            return int(expired[0]), False
+        return int(np.argmin(self.last_used[:self.size])), True
+
+    def add(self, capacity: int, probe: SemanticProbe, answer: Dict[str, Any], expires_at: float) -> bool:
+        """
+        Store an answer.
+
+        Returns:
+            Whether a live entry was evicted for it
+        """
+        now = time.time()
+        if self.vectors is None or self.vectors.shape[1] != probe.vector.shape[0]:
+            # First entry, or the embedding model changed dimension
+            self.size = 0
+            self.answers = []
+            self.vectors = np.empty((0, probe.vector.shape[0]), dtype=np.float32)
+            self.contexts = np.empty(0, dtype=np.int64)
+            self.expires = np.empty(0, dtype=np.float64)
+            self.last_used = np.empty(0, dtype=np.float64)
+        row, evicted = self._slot(capacity, now)
+        self.vectors[row] = probe.vector
+        self.contexts[row] = probe.context
+        self.expires[row] = expires_at
+        self.last_used[row] = now
+        self.answers[row] = answer
+        self.dirty = True
+        return evicted
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+
+    def snapshot(self) -> Dict[str, np.ndarray]:
+        """Copy of the live rows for saving off the event loop."""
+        n = self.size
+        return {
+            "vectors": self.vectors[:n].copy() if self.vectors is not None else np.empty((0, 0), np.float32),
+            "contexts": self.contexts[:n].copy(),
+            "expires": self.expires[:n].copy(),
+            "last_used": self.last_used[:n].copy(),
+            "answers": np.array(json.dumps(self.answers[:n])),
+            "embedding_model": np.array(self.embedding_model),
+        }
+
+    @classmethod
+    def from_snapshot(cls, data: Dict[str, np.ndarray]) -> "_SemanticIndex":
+        index = cls(str(data["embedding_model"]))
+        index.answers = json.loads(str(data["answers"]))
+        index.size = len(index.answers)
+        if index.size:
+            index.vectors = data["vectors"].astype(np.float32, copy=False)
+            index.contexts = data["contexts"].astype(np.int64, copy=False)
+            index.expires = data["expires"].astype(np.float64, copy=False)
+            index.last_used = data["last_used"].astype(np.float64, copy=False)
+        return index
+
+
+class SemanticCache:
+    """
+    Per-model semantic indexes of chat answers, keyed by question embedding.
+
+    Indexes are touched only from the event loop; loading and saving run
+    on worker threads.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl: float,
+        threshold: float,
+        thresholds: Optional[Dict[str, float]] = None,
+        disk_dir: Optional[Path] = None,
+    ):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries: Answers kept per model (0 disables the cache)
+            ttl: Seconds an answer stays valid (0 = until evicted)
+            threshold: Default minimum cosine similarity for a hit
+            thresholds: Per-model threshold overrides
+            disk_dir: Directory the indexes are saved to (None = memory only)
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.thresholds = thresholds or {}
+        self.disk_dir = Path(disk_dir) if disk_dir is not None else None
+        self._indexes: Dict[str, _SemanticIndex] = {}
+        self._stats: Dict[str, Dict[str, Any]] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def threshold_for(self, model_name: str) -> float:
+        return self.thresholds.get(model_name, self.threshold)
+
+    def _model_stats(self, model_name: str) -> Dict[str, Any]:
+        return self._stats.setdefault(
+            model_name,
+            {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "similarity_sum": 0.0},
+        )
+
+    # ------------------------------------------------------------------
+    # Lookup / store
+    # ------------------------------------------------------------------
+
+    async def context_id(self, model_name: str, messages: List[dict]) -> Optional[int]:
+        """
+        Identify everything a chat answer depends on besides the last user turn.
+
+        Hashes the model file's fingerprint and the preceding messages, so
+        the same question asked after a different system prompt or history
+        never matches. None when the model file does not exist.
+        """
+        try:
+            fingerprint = await asyncio.to_thread(model_fingerprint, get_model_path(model_name))
+        except (FileNotFoundError, OSError):
+            return None
+        material = json.dumps([fingerprint, messages[:-1]], ensure_ascii=False, separators=(",", ":"))
+        return int.from_bytes(hashlib.sha256(material.encode()).digest()[:8], "little", signed=True)
+
+    async def _index(self, model_name: str, embedding_model: str) -> _SemanticIndex:
+        index = self._indexes.get(model_name)
+        if index is None:
+            index = await asyncio.to_thread(self._load, model_name)
+        if index is None or index.embedding_model != embedding_model:
+            index = _SemanticIndex(embedding_model)
+        self._indexes[model_name] = index
+        return index
+
+    async def lookup(
+        self,
+        model_name: str,
+        embedding_model: str,
+        context: int,
+        vector: np.ndarray,
+        search: bool = True,
+    ) -> Tuple[SemanticProbe, Optional[Dict[str, Any]], float]:
+        """
+        Find a cached answer to a question.
+
+        Args:
+            model_name: Chat model serving the request
+            embedding_model: Model that embedded ``vector``
+            context: ``context_id`` of the conversation
+            vector: Unit-length embedding of the last user turn
+            search: False to only prepare storing the answer (``Cache-Control: no-cache``)
+
+        Returns:
+            (probe to store the answer with, the cached answer on a hit, its similarity)
+        """
+        probe = SemanticProbe(embedding_model, context, vector)
+        index = await self._index(model_name, embedding_model)
+        if not search:
+            return probe, None, 0.0
+        stats = self._model_stats(model_name)
+        now = time.time()
+        row, similarity = index.search(context, vector, now)
+        if row is None or similarity < self.threshold_for(model_name):
+            stats["misses"] += 1
+            return probe, None, similarity
+        index.last_used[row] = now
+        stats["hits"] += 1
+        stats["similarity_sum"] += similarity
+        return probe, index.answers[row], similarity
+
+    async def put(self, model_name: str, probe: SemanticProbe, answer: Dict[str, Any]) -> None:
+        """Store the answer to a question that missed."""
+        index = await self._index(model_name, probe.embedding_model)
+        expires_at = time.time() + self.ttl if self.ttl > 0 else 0
+        stats = self._model_stats(model_name)
+        stats["stores"] += 1
+        if index.add(self.max_entries, probe, answer, expires_at):
+            stats["evictions"] += 1
+
+    async def clear(self) -> None:
+        """Drop every cached answer, including saved indexes."""
+        self._indexes.clear()
+        if self.disk_dir is not None:
+            await asyncio.to_thread(self._delete_all)
+
+    # ------------------------------------------------------------------
+    # Persistence (runs on worker threads)
+    # ------------------------------------------------------------------
+
+    def _path(self, model_name: str) -> Path:
+        return self.disk_dir / f"{model_name}{INDEX_SUFFIX}"
+
+    def _load(self, model_name: str) -> Optional[_SemanticIndex]:
+        if self.disk_dir is None:
+            return None
+        path = self._path(model_name)
+        if not path.exists():
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                index = _SemanticIndex.from_snapshot(dict(data))
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Dropping unreadable semantic cache {path}: {e}")
+            return None
+        logger.info(f"Loaded {index.size} semantic cache entries for {model_name}")
+        return index
+
+    def _save(self, model_name: str, snapshot: Dict[str, np.ndarray]) -> None:
+        self.disk_dir.mkdir(parents=True, exist_ok=True)
+        path = self._path(model_name)
+        tmp_path = path.with_suffix(".tmp")
+        try:
+            with open(tmp_path, "wb") as f:
+                np.savez(f, **snapshot)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not save semantic cache to {path}: {e}")
+
+    def _delete_all(self) -> None:
+        if self.disk_dir.exists():
+            for path in self.disk_dir.glob(f"*{INDEX_SUFFIX}"):
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+    async def save(self) -> None:
+        """Write indexes changed since the last save."""
+        if self.disk_dir is None:
+            return
+        for model_name, index in list(self._indexes.items()):
+            if index.dirty:
+                index.dirty = False
+                await asyncio.to_thread(self._save, model_name, index.snapshot())
+
+    async def persist_periodically(self, interval: float) -> None:
+        """Save changed indexes every ``interval`` seconds until cancelled."""
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                await self.save()
+        except asyncio.CancelledError:
+            await self.save()
+            raise
+
+    # ------------------------------------------------------------------
+    # Monitoring
+    # ------------------------------------------------------------------
+
+    def stats(self) -> Dict[str, Any]:
+        """Per-model hit rates, mean hit similarity and index sizes."""
+        models = {}
+        for model_name, counters in self._stats.items():
+            lookups = counters["hits"] + counters["misses"]
+            index = self._indexes.get(model_name)
+            models[model_name] = {
+                "hits": counters["hits"],
+                "misses": counters["misses"],
+                "stores": counters["stores"],
+                "evictions": counters["evictions"],
+                "entries": index.size if index is not None else 0,
+                "threshold": self.threshold_for(model_name),
+                "hit_rate": round(counters["hits"] / lookups, 4) if lookups else 0.0,
+                "mean_hit_similarity": (
+                    round(counters["similarity_sum"] / counters["hits"], 4) if counters["hits"] else None
+                ),
+            }
+        return {
+            "enabled": self.enabled,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "models": models,
+        }
+
+
+# Global semantic cache instance
+semantic_cache = SemanticCache(
+    settings.semantic_cache_size if settings.semantic_cache_enabled else 0,
+    settings.semantic_cache_ttl,
+    settings.semantic_cache_threshold,
+    settings.semantic_cache_thresholds,
+    Path(settings.cache_dir) / "semantic",
+)
@@ -0,0 +1,187 @@
+"""
+Speculative decoding for the per-request inference path.
+
+A draft proposes several tokens ahead; the target model verifies them in
+a single batched evaluation and keeps the prefix it agrees with, so each
+target forward pass can emit more than one token. Two drafting modes are
+configured per model in ``speculative_models``:
+
+- ``prompt_lookup``: n-gram lookup in the prompt and output so far
+  (``LlamaPromptLookupDecoding``); free, and strong when outputs copy
+  from the prompt, as code edits do
+- ``draft``: greedy continuation from a small GGUF sharing the target's
+  vocabulary
+
+Drafting is hooked in through ``Llama(draft_model=...)``, so it applies to
+generation through ``InferenceEngine``; the continuous batching engine
+decodes without speculation.
+"""
+
+import logging
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import numpy as np
+from llama_cpp import Llama
+from llama_cpp.llama_speculative import LlamaDraftModel, LlamaPromptLookupDecoding
+
+from .config import settings, get_model_path
+from .memory import context_bytes
+
+logger = logging.getLogger(__name__)
+
+PROMPT_LOOKUP, DRAFT = "prompt_lookup", "draft"
+
+
+class SpeculationStats:
+    """Draft acceptance counters for one generation."""
+
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.steps = 0
+        self.drafted = 0
+        self.accepted = 0
+        # Proposal awaiting verification: its size and the sequence length it extended
+        self._pending = 0
+        self._length = 0
+
+    def record(self, length: int, proposed: int) -> None:
+        """
+        Account for a draft call on a sequence of ``length`` tokens.
+
+        The target emits the accepted draft tokens plus one token of its
+        own between two draft calls, so growth of the sequence since the
+        previous call gives that proposal's accepted count. The final
+        proposal of a generation is never verified and is not counted.
+        """
+        if self._pending:
+            self.drafted += self._pending
+            self.accepted += min(self._pending, max(0, length - self._length - 1))
+        self.steps += 1
+        self._pending = proposed
+        self._length = length
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "draft_steps": self.steps,
+            "drafted_tokens": self.drafted,
+            "accepted_tokens": self.accepted,
+            "acceptance_rate": round(self.accepted / self.drafted, 4) if self.drafted else 0.0,
+        }
+
+
+class GreedyDraftModel(LlamaDraftModel):
+    """Drafts by greedy decoding on a small model with the target's vocabulary."""
+
+    def __init__(self, draft: Llama, num_pred_tokens: int = 4):
+        self.draft = draft
+        self.num_pred_tokens = num_pred_tokens
+
+    def __call__(self, input_ids: np.ndarray, /, **kwargs: Any) -> np.ndarray:
+        tokens = []
+        # Llama.generate reuses the draft's KV cache for the shared prefix
+        for token in self.draft.generate(input_ids.tolist(), top_k=1, temp=0.0, repeat_penalty=1.0):
+            if token == self.draft.token_eos():
+                break
+            tokens.append(token)
+            if len(tokens) >= self.num_pred_tokens:
+                break
+        return np.array(tokens, dtype=np.intc)
+
+
+class SpeculativeDraft(LlamaDraftModel):
+    """
+    Draft model attached to one target replica, with per-generation stats.
+
+    ``InferenceEngine`` installs a fresh ``SpeculationStats`` in ``stats``
+    on the inference thread right before each generation; the executor
+    runs one generation per model at a time, so counts never mix.
+    """
+
+    def __init__(self, mode: str, inner: LlamaDraftModel, draft_path: Optional[Path] = None):
+        self.mode = mode
+        self.inner = inner
+        self.draft_path = draft_path
+        self.stats = SpeculationStats(mode)
+
+    def __call__(self, input_ids: np.ndarray, /, **kwargs: Any) -> np.ndarray:
+        proposal = self.inner(input_ids, **kwargs)
+        self.stats.record(len(input_ids), len(proposal))
+        return proposal
+
+    def begin(self) -> SpeculationStats:
+        """Start counting a new generation."""
+        self.stats = SpeculationStats(self.mode)
+        return self.stats
+
+    def context_bytes(self) -> int:
+        """KV cache bytes held by the draft model's context."""
+        if isinstance(self.inner, GreedyDraftModel):
+            return context_bytes(self.inner.draft._ctx.ctx)
+        return 0
+
+    def close(self) -> None:
+        if isinstance(self.inner, GreedyDraftModel):
+            self.inner.draft.close()
+
+
+def speculation_config(model_name: str) -> Optional[Dict[str, Any]]:
+    """The ``speculative_models`` entry for a model, if speculation is enabled for it."""
+    config = settings.speculative_models.get(model_name)
+    if not config or config.get("mode", PROMPT_LOOKUP) in ("", "off", "none"):
+        return None
+    return config
+
+
+def build_draft(model_name: str, n_vocab: Optional[int] = None) -> Optional[SpeculativeDraft]:
+    """
+    Create the draft for one replica of ``model_name`` from its configuration.
+
+    Args:
+        model_name: Target model name
+        n_vocab: Target vocabulary size, checked against a draft model's
+
+    Returns:
+        The draft, or None if speculation is not configured for the model
+
+    Raises:
+        ValueError: Unknown mode, missing draft model, or mismatched vocabulary
+    """
+    config = speculation_config(model_name)
+    if config is None:
+        return None
+
+    mode = config.get("mode", PROMPT_LOOKUP)
+    if mode == PROMPT_LOOKUP:
+        inner = LlamaPromptLookupDecoding(
+            max_ngram_size=int(config.get("max_ngram_size", 2)),
+            num_pred_tokens=int(config.get("num_pred_tokens", 10)),
+        )
+        return SpeculativeDraft(mode, inner)
+
+    if mode == DRAFT:
+        draft_name = config.get("draft_model")
+        if not draft_name:
+            raise ValueError(f"Speculative draft mode for {model_name} needs a draft_model")
+        draft_path = get_model_path(draft_name)
+        draft = Llama(
+            model_path=str(draft_path),
+            n_gpu_layers=settings.n_gpu_layers,
+            n_ctx=settings.context_length,
+            n_threads=settings.n_threads,
+            n_batch=settings.batch_size,
+            verbose=settings.verbose,
+            use_mmap=True,
+        )
+        if n_vocab is not None and draft.n_vocab() != n_vocab:
+            draft.close()
+            raise ValueError(
+                f"Draft model {draft_name} has a vocabulary of {draft.n_vocab()} tokens, "
+                f"target {model_name} has {n_vocab}"
+            )
+        inner = GreedyDraftModel(draft, num_pred_tokens=int(config.get("num_pred_tokens", 4)))
+        logger.info(f"Speculative decoding for {model_name} drafts with {draft_name}")
+        return SpeculativeDraft(mode, inner, draft_path)
+
+    raise ValueError(f"Unknown speculative decoding mode for {model_name}: {mode}")
@@ -0,0 +1,204 @@
+"""
+Server-Sent Events streaming in the OpenAI chunk format.
+
+Builds ``text_completion`` and ``chat.completion.chunk`` events with a
+per-stream pre-encoded envelope, so each event costs one JSON string
+encoding of the token text, and coalesces tokens into fewer, larger
+events by count (``stream_chunk_size``) and time (``stream_flush_interval``).
+Streams end with a final chunk carrying ``finish_reason``, usage and
+server-side timing, then ``data: [DONE]``. Requests sampling several
+choices (``n``) interleave chunks tagged with each choice's ``index``.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Union
+
+try:
+    import orjson
+
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj)
+except ImportError:
+    import json
+
+    def dumps(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+logger = logging.getLogger(__name__)
+
+DONE_EVENT = b"data: [DONE]\n\n"
+
+
+def sse_event(obj: Any) -> bytes:
+    """Encode one object as an SSE ``data:`` event."""
+    return b"data: " + dumps(obj) + b"\n\n"
+
+
+class StreamFormatter:
+    """
+    Renders the events of one streamed completion.
+
+    The fixed part of every content chunk (id, model, created, index) is
+    encoded once per stream and choice; only the token text is encoded
+    per event.
+    """
+
+    def __init__(self, request_id: str, model: str, chat: bool):
+        """
+        Initialize the formatter.
+
+        Args:
+            request_id: Completion id shared by all chunks
+            model: Model name reported in each chunk
+            chat: Emit ``chat.completion.chunk`` deltas instead of ``text_completion`` text
+        """
+        self.request_id = request_id
+        self.model = model
+        self.chat = chat
+        self.created = int(time.time())
+        self.started = time.perf_counter()
+        self.first_chunk_at: Optional[float] = None
+
+        head = {
+            "id": request_id,
+            "object": "chat.completion.chunk" if chat else "text_completion",
+            "created": self.created,
+            "model": model,
+        }
+        self._envelope = b"data: " + dumps(head)[:-1]
+        if chat:
+            self._suffix = b'},"finish_reason":null}]}\n\n'
+        else:
+            self._suffix = b',"logprobs":null,"finish_reason":null}]}\n\n'
+        self._prefixes: Dict[int, bytes] = {}
+        self._head = head
+
+    def _prefix(self, index: int) -> bytes:
+        prefix = self._prefixes.get(index)
+        if prefix is None:
+            field = b'"delta":{"content":' if self.chat else b'"text":'
+            prefix = self._prefixes[index] = (
+                self._envelope + b',"choices":[{"index":' + str(index).encode() + b"," + field
+            )
+        return prefix
+
+    def role(self, choices: int = 1) -> bytes:
+        """Opening chat chunk announcing the assistant role of every choice."""
+        return sse_event({
+            **self._head,
+            "choices": [
+                {"index": index, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}
+                for index in range(choices)
+            ],
+        })
+
+    def content(self, text: str, index: int = 0) -> bytes:
+        """Chunk carrying generated text of choice ``index``."""
+        if self.first_chunk_at is None:
+            self.first_chunk_at = time.perf_counter()
+        return self._prefix(index) + dumps(text) + self._suffix
+
+    def final(
+        self,
+        finish_reason: Union[str, List[str]],
+        usage: Dict[str, Any],
+        trace: Optional[Dict[str, Any]] = None,
+    ) -> bytes:
+        """
+        Closing chunk with the finish reason, usage and server-side timing.
+
+        ``finish_reason`` is a list, one per choice, when several were
+        sampled. A request ``trace`` is added under ``trace``.
+        """
+        now = time.perf_counter()
+        completion_tokens = usage.get("completion_tokens", 0)
+        decode_seconds = now - self.first_chunk_at if self.first_chunk_at is not None else 0.0
+        timing = {
+            "time_to_first_chunk_ms": (
+                round((self.first_chunk_at - self.started) * 1000, 2) if self.first_chunk_at is not None else None
+            ),
+            "total_ms": round((now - self.started) * 1000, 2),
+            "tokens_per_second": round(completion_tokens / decode_seconds, 2) if decode_seconds > 0 else 0.0,
+        }
+        reasons = [finish_reason] if isinstance(finish_reason, str) else finish_reason
+        if self.chat:
+            choices = [{"index": i, "delta": {}, "finish_reason": reason} for i, reason in enumerate(reasons)]
+        else:
+            choices = [
+                {"index": i, "text": "", "logprobs": None, "finish_reason": reason}
+                for i, reason in enumerate(reasons)
+            ]
+        event = {**self._head, "choices": choices, "usage": usage, "timing": timing}
+        if trace is not None:
+            event["trace"] = trace
+        return sse_event(event)
+
+    @staticmethod
+    def error(message: str) -> bytes:
+        """Error event; the stream ends without ``[DONE]`` so clients can tell it failed."""
+        return sse_event({"error": {"message": message, "type": "server_error"}})
+
+
+async def coalesce(
+    source: AsyncIterator[dict],
+    max_tokens: int,
+    interval: float,
+) -> AsyncIterator[List[dict]]:
+    """
+    Group streamed token dicts into batches.
+
+    A batch is emitted once it holds ``max_tokens`` tokens or its first
+    token has waited ``interval`` seconds, whichever comes first, so a
+    slow decode never holds text back longer than the interval.
+
+    Args:
+        source: Async iterator of token dictionaries
+        max_tokens: Tokens per batch (1 = no coalescing)
+        interval: Longest time a token waits for its batch to fill (0 = no limit)
+
+    Yields:
+        Lists of token dictionaries
+    """
+    loop = asyncio.get_running_loop()
+    buffer: List[dict] = []
+    deadline = 0.0
+    pending: Optional[asyncio.Future] = None
+    try:
+        if max_tokens <= 1:
+            async for item in source:
+                yield [item]
+            return
+
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(source.__anext__())
+            timeout = max(0.0, deadline - loop.time()) if buffer and interval > 0 else None
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                yield buffer
+                buffer = []
+                continue
+
+            future, pending = pending, None
+            try:
+                item = future.result()
+            except StopAsyncIteration:
+                break
+            if not buffer:
+                deadline = loop.time() + interval
+            buffer.append(item)
+            if len(buffer) >= max_tokens:
+                yield buffer
+                buffer = []
+        if buffer:
+            yield buffer
+    finally:
+        # Stop generation promptly when the consumer leaves early
+        if pending is not None:
+            pending.cancel()
+            await asyncio.gather(pending, return_exceptions=True)
+        aclose = getattr(source, "aclose", None)
+        if aclose is not None:
+            await aclose()
@@ -19,6 +19,7 @@ from typing import Optional, AsyncGenerator
 # Server configuration
 BASE_URL = "http://localhost:8000"
 TIMEOUT = 60
+HEALTH_LATENCY_BUDGET = 0.25  # Max /health latency (seconds) while generation is saturated
 
 
 class GGUFServerClient:
@@ -57,6 +58,7 @@ class GGUFServerClient:
         temperature: float = 0.7,
         top_p: float = 0.9,
         stream: bool = False,
+        n: int = 1,
     ) -> dict:
         """Generate text completion."""
         payload = {
@@ -65,6 +67,7 @@ class GGUFServerClient:
             "temperature": temperature,
             "top_p": top_p,
             "stream": stream,
+            "n": n,
         }
         
         if model:
@@ -86,6 +89,7 @@ class GGUFServerClient:
         max_tokens: int = 100,
         temperature: float = 0.7,
         stream: bool = False,
+        session_id: Optional[str] = None,
     ) -> dict:
         """Generate chat completion."""
         payload = {
@@ -97,6 +101,8 @@ class GGUFServerClient:
         
         if model:
             payload["model"] = model
+        if session_id:
+            payload["session_id"] = session_id
         
         async with httpx.AsyncClient() as client:
             response = await client.post(
@@ -126,13 +132,33 @@ class GGUFServerClient:
             response.raise_for_status()
             return response.json()
     
+    async def embeddings(
+        self,
+        inputs,
+        model: Optional[str] = None,
+        encoding_format: str = "float",
+    ) -> dict:
+        """Embed a string or a list of strings."""
+        payload = {"input": inputs, "encoding_format": encoding_format}
+        if model:
+            payload["model"] = model
+        
+        async with httpx.AsyncClient() as client:
+            response = await client.post(
+                f"{self.base_url}/v1/embeddings",
+                json=payload,
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+            return response.json()
+    
     async def stream_completions(
         self,
         prompt: str,
         max_tokens: int = 100,
         model: Optional[str] = None,
     ) -> AsyncGenerator[dict, None]:
-        """Stream text completion."""
+        """Stream text completion as OpenAI ``text_completion`` chunks until ``[DONE]``."""
         payload = {
             "prompt": prompt,
             "max_tokens": max_tokens,
@@ -153,11 +179,478 @@ class GGUFServerClient:
                 async for line in response.aiter_lines():
                     if line.startswith("data: "):
                         data = line[6:]
+                        if data == "[DONE]":
+                            return
+                        if data:
+                            yield json.loads(data)
+    
+    async def stream_chat_completions(
+        self,
+        messages: list,
+        max_tokens: int = 100,
+        model: Optional[str] = None,
+    ) -> AsyncGenerator[dict, None]:
+        """Stream chat completion as OpenAI ``chat.completion.chunk`` chunks until ``[DONE]``."""
+        payload = {
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "stream": True,
+        }
+        
+        if model:
+            payload["model"] = model
+        
+        async with httpx.AsyncClient() as client:
+            async with client.stream(
+                "POST",
+                f"{self.base_url}/v1/chat/completions",
+                json=payload,
+                timeout=self.timeout,
+            ) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if line.startswith("data: "):
+                        data = line[6:]
+                        if data == "[DONE]":
+                            return
                         if data:
-                            try:
-                                yield json.loads(data)
-                            except json.JSONDecodeError:
-                                pass
+                            yield json.loads(data)
+
+
+async def measure_health_latency_under_load(
+    client: GGUFServerClient,
+    model: Optional[str] = None,
+    concurrent_requests: int = 8,
+    max_tokens: int = 200,
+    samples: int = 20,
+    interval: float = 0.05,
+) -> dict:
+    """
+    Measure /health latency while the server is saturated with generation.
+    
+    Starts several long completions concurrently and samples /health
+    while they decode. With inference running on the executor thread
+    pool the event loop stays free, so health latency should remain flat.
+    
+    Returns:
+        Dictionary with median and max health latency in seconds
+    """
+    generation = [
+        asyncio.create_task(
+            client.completions(
+                prompt="Write a long story about a lighthouse keeper.",
+                model=model,
+                max_tokens=max_tokens,
+            )
+        )
+        for _ in range(concurrent_requests)
+    ]
+    
+    # Give the server a moment to start decoding before sampling
+    await asyncio.sleep(1.0)
+    
+    latencies = []
+    try:
+        for _ in range(samples):
+            start = time.perf_counter()
+            await client.health_check()
+            latencies.append(time.perf_counter() - start)
+            await asyncio.sleep(interval)
+    finally:
+        for task in generation:
+            task.cancel()
+        await asyncio.gather(*generation, return_exceptions=True)
+    
+    latencies.sort()
+    return {
+        "median_seconds": latencies[len(latencies) // 2],
+        "max_seconds": latencies[-1],
+        "samples": len(latencies),
+    }
+
+
+async def measure_aggregate_throughput(
+    client: GGUFServerClient,
+    model: Optional[str] = None,
+    users: int = 8,
+    max_tokens: int = 64,
+) -> dict:
+    """
+    Measure aggregate completion tokens/second across concurrent chat users.
+    
+    Compare runs with ENABLE_CONTINUOUS_BATCHING on and off to see the
+    effect of the batching engine.
+    
+    Returns:
+        Dictionary with total tokens, wall time and aggregate tokens/second
+    """
+    messages = [{"role": "user", "content": "Tell me about the ocean."}]
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *[
+            client.chat_completions(messages=messages, model=model, max_tokens=max_tokens)
+            for _ in range(users)
+        ],
+        return_exceptions=True,
+    )
+    elapsed = time.perf_counter() - start
+    
+    tokens = sum(r["usage"]["completion_tokens"] for r in results if isinstance(r, dict))
+    return {
+        "users": users,
+        "completion_tokens": tokens,
+        "elapsed_seconds": elapsed,
+        "tokens_per_second": tokens / elapsed if elapsed > 0 else 0,
+        "errors": sum(1 for r in results if not isinstance(r, dict)),
+    }
+
+
+def benchmark_stream_encoding(tokens: int = 100_000, chunk_size: int = 4) -> dict:
+    """
+    Per-token cost of SSE event encoding, previous implementation vs current.
+    
+    The previous handlers formatted each token dict with ``f"data: {chunk}\\n\\n"``
+    (a Python repr, one event per token). The current ``StreamFormatter``
+    pre-encodes the chunk envelope and JSON-encodes only the text; with
+    coalescing, ``chunk_size`` tokens share one event.
+    
+    Returns:
+        Microseconds per token and events per token for each variant
+    """
+    from .streaming import StreamFormatter
+    
+    pieces = [" token" if i % 7 else ' "quoted"\n' for i in range(tokens)]
+    
+    start = time.perf_counter()
+    for i, piece in enumerate(pieces):
+        chunk = {"token": piece, "tokens_so_far": i + 1, "timestamp": time.time()}
+        f"data: {chunk}\n\n".encode()
+    legacy = time.perf_counter() - start
+    
+    formatter = StreamFormatter("cmpl-bench", "bench.gguf", chat=True)
+    start = time.perf_counter()
+    for piece in pieces:
+        formatter.content(piece)
+    per_token = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    for i in range(0, tokens, chunk_size):
+        formatter.content("".join(pieces[i:i + chunk_size]))
+    coalesced = time.perf_counter() - start
+    
+    return {
+        "legacy_us_per_token": legacy / tokens * 1e6,
+        "openai_json_us_per_token": per_token / tokens * 1e6,
+        "coalesced_us_per_token": coalesced / tokens * 1e6,
+        "coalesced_events_per_token": 1 / chunk_size,
+    }
+
+
+def benchmark_chat_template_rendering(turns: tuple = (8, 64, 256)) -> list:
+    """
+    Per-request cost of rendering a chat prompt with a GGUF chat template.
+    
+    Compares one full render against segmenting a conversation the first
+    time it is seen and on its next turn, when earlier segments come from
+    the cache. Both should stay close to two full renders however long
+    the history. Uses a ChatML template.
+    
+    Returns:
+        One dictionary per conversation length with milliseconds per request
+    """
+    from .chat_templates import ChatTemplate
+    
+    chatml = (
+        "{% for message in messages %}{{'<|im_start|>' + message['role'] + '\\n' + message['content'] "
+        "+ '<|im_end|>' + '\\n'}}{% endfor %}{% if add_generation_prompt %}{{ '<|im_start|>assistant\\n' }}{% endif %}"
+    )
+    results = []
+    for n in turns:
+        messages = [{"role": "system", "content": "You are a helpful assistant."}]
+        for i in range(n):
+            messages.append({"role": "user", "content": f"Question {i} about the ocean. " * 10})
+            messages.append({"role": "assistant", "content": f"Answer {i} about the ocean. " * 20})
+        messages.append({"role": "user", "content": "One more question."})
+        
+        template = ChatTemplate(chatml, "<s>", "</s>")
+        start = time.perf_counter()
+        template.render(messages)
+        full = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        template.segments(messages[:-2])
+        first = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        template.segments(messages)
+        next_turn = time.perf_counter() - start
+        
+        results.append({
+            "turns": n,
+            "full_render_ms": full * 1000,
+            "first_request_ms": first * 1000,
+            "next_turn_ms": next_turn * 1000,
+        })
+    return results
+
+
+async def measure_stream_overhead(
+    client: GGUFServerClient,
+    model: Optional[str] = None,
+    max_tokens: int = 200,
+) -> dict:
+    """
+    Events, bytes and server timing for one live streamed completion.
+    
+    Run against servers with different STREAM_CHUNK_SIZE values to see how
+    coalescing trades events per token against time to first chunk.
+    """
+    events = 0
+    text_bytes = 0
+    usage = {}
+    timing = {}
+    start = time.perf_counter()
+    async for chunk in client.stream_completions(
+        prompt="Write a long story about a lighthouse keeper.",
+        model=model,
+        max_tokens=max_tokens,
+    ):
+        events += 1
+        text_bytes += len(chunk["choices"][0]["text"].encode())
+        usage = chunk.get("usage", usage)
+        timing = chunk.get("timing", timing)
+    elapsed = time.perf_counter() - start
+    
+    tokens = usage.get("completion_tokens", 0)
+    return {
+        "events": events,
+        "completion_tokens": tokens,
+        "events_per_token": events / tokens if tokens else 0,
+        "text_bytes": text_bytes,
+        "elapsed_seconds": elapsed,
+        "server_timing": timing,
+    }
+
+
+async def measure_embedding_throughput(
+    client: GGUFServerClient,
+    model: Optional[str] = None,
+    batch_sizes: tuple = (1, 8, 64, 256, 1024),
+    total_inputs: int = 1024,
+) -> list:
+    """
+    Embeddings per second at different inputs-per-call.
+    
+    Embeds ``total_inputs`` sentences of varying length with
+    ``batch_size`` inputs per request. Larger calls let the server pack
+    inputs into full decode batches.
+    
+    Returns:
+        One dictionary per batch size with embeddings/second
+    """
+    sentences = [
+        " ".join(["The quick brown fox jumps over the lazy dog."] * (1 + i % 5))
+        for i in range(total_inputs)
+    ]
+    # Warm up the embedding instance so model load is not measured
+    await client.embeddings(sentences[0], model=model)
+    
+    results = []
+    for batch_size in batch_sizes:
+        start = time.perf_counter()
+        for i in range(0, total_inputs, batch_size):
+            await client.embeddings(sentences[i:i + batch_size], model=model)
+        elapsed = time.perf_counter() - start
+        results.append({
+            "batch_size": batch_size,
+            "elapsed_seconds": elapsed,
+            "embeddings_per_second": total_inputs / elapsed if elapsed > 0 else 0,
+        })
+    return results
+
+
+async def measure_session_turns(
+    client: GGUFServerClient,
+    model: Optional[str] = None,
+    turns: int = 12,
+    max_tokens: int = 32,
+) -> dict:
+    """
+    Per-turn latency of a growing conversation, with and without a chat session.
+    
+    Both runs send the full history every turn. With a ``session_id`` the
+    server restores the previous turn's KV state, so late turns should
+    cost about as much as early ones instead of growing with the history.
+    Greedy decoding keeps both conversations identical.
+    
+    Returns:
+        Dictionary with per-turn seconds for each run and the last turn's
+        reused prompt tokens
+    """
+    filler = "Please keep the following notes in mind for later questions. " * 8
+    results = {}
+    reused = 0
+    for label, session_id in (("stateless", None), ("session", f"bench-{time.time_ns()}")):
+        messages = [{"role": "system", "content": "You are a concise assistant."}]
+        latencies = []
+        for turn in range(turns):
+            messages.append({"role": "user", "content": f"Turn {turn}: {filler}"})
+            start = time.perf_counter()
+            result = await client.chat_completions(
+                messages=messages,
+                model=model,
+                max_tokens=max_tokens,
+                temperature=0.0,
+                session_id=session_id,
+            )
+            latencies.append(time.perf_counter() - start)
+            messages.append(result["choices"][0]["message"])
+            if session_id:
+                reused = result["usage"].get("session", {}).get("reused_tokens", 0)
+        results[label] = latencies
+        if session_id:
+            async with httpx.AsyncClient() as http:
+                await http.delete(f"{client.base_url}/v1/sessions/{session_id}", timeout=client.timeout)
+    return {**results, "last_turn_reused_tokens": reused}
+
+
+async def measure_parallel_sampling(
+    client: GGUFServerClient,
+    model: Optional[str] = None,
+    choices: int = 4,
+    max_tokens: int = 32,
+) -> dict:
+    """
+    One request for ``choices`` completions versus as many single requests.
+    
+    Uses a long prompt so the saving from evaluating it only once for
+    all choices is visible.
+    
+    Returns:
+        Dictionary with seconds for the ``n`` request and for the
+        sequential single requests
+    """
+    prompt = "Summarize the following notes in one sentence. " * 40
+    start = time.perf_counter()
+    result = await client.completions(prompt=prompt, model=model, max_tokens=max_tokens, n=choices)
+    parallel = time.perf_counter() - start
+    assert len(result["choices"]) == choices
+    
+    start = time.perf_counter()
+    for _ in range(choices):
+        await client.completions(prompt=prompt, model=model, max_tokens=max_tokens)
+    sequential = time.perf_counter() - start
+    return {"choices": choices, "parallel_seconds": parallel, "sequential_seconds": sequential}
+
+
+async def measure_batch_job(
+    client: GGUFServerClient,
+    model: Optional[str] = None,
+    requests: int = 16,
+    max_tokens: int = 32,
+) -> dict:
+    """
+    Submit a small batch job of chat requests sharing a system prompt and wait for it.
+    
+    Returns:
+        The finished job's status, with its request counts and throughput
+    """
+    system = {"role": "system", "content": "You answer in one short sentence. " * 10}
+    lines = [
+        json.dumps({
+            "custom_id": f"q{i}",
+            "url": "/v1/chat/completions",
+            "body": {"messages": [system, {"role": "user", "content": f"Name a fact about the number {i}."}],
+                     "max_tokens": max_tokens},
+        })
+        for i in range(requests)
+    ]
+    params = {"model": model} if model else {}
+    async with httpx.AsyncClient(base_url=client.base_url, timeout=client.timeout) as http:
+        response = await http.post("/v1/batches", content="\n".join(lines), params=params)
+        response.raise_for_status()
+        job = response.json()
+        while job["status"] in ("queued", "running"):
+            await asyncio.sleep(1.0)
+            job = (await http.get(f"/v1/batches/{job['id']}")).json()
+    return job
+
+
+def benchmark_metrics_overhead(tokens: int = 1_000_000) -> dict:
+    """
+    Per-token cost of recording streamed token timings for ``/metrics``.
+    
+    Times ``StreamTimer.token`` (one inter-token histogram observation)
+    against the same loop without it; the difference should stay well
+    under a microsecond per token.
+    
+    Returns:
+        Nanoseconds per token for the bare loop and the recording overhead
+    """
+    from .metrics import StreamTimer
+    
+    timestamps = [1000.0 + i * 0.02 for i in range(tokens)]
+    
+    start = time.perf_counter()
+    for timestamp in timestamps:
+        pass
+    baseline = time.perf_counter() - start
+    
+    timer = StreamTimer("bench.gguf", 999.0, 999.5, 512)
+    start = time.perf_counter()
+    for timestamp in timestamps:
+        timer.token(timestamp)
+    recorded = time.perf_counter() - start
+    timer.finish()
+    
+    return {
+        "loop_ns_per_token": baseline / tokens * 1e9,
+        "overhead_ns_per_token": (recorded - baseline) / tokens * 1e9,
+    }
+
+
+async def measure_metrics_scrape(client: GGUFServerClient, model: Optional[str] = None) -> dict:
+    """
+    Stream one completion, then scrape ``/metrics``.
+    
+    Returns:
+        Scrape time, exposition size and the number of time-to-first-token observations
+    """
+    async for _ in client.stream_completions("Count from one to ten:", max_tokens=32, model=model):
+        pass
+    async with httpx.AsyncClient(base_url=client.base_url, timeout=client.timeout) as http:
+        start = time.perf_counter()
+        response = await http.get("/metrics")
+        elapsed = time.perf_counter() - start
+        response.raise_for_status()
+    ttft_count = sum(
+        float(line.rsplit(" ", 1)[1])
+        for line in response.text.splitlines()
+        if line.startswith("nexus_time_to_first_token_seconds_count")
+    )
+    return {"scrape_ms": elapsed * 1000, "bytes": len(response.content), "ttft_observations": int(ttft_count)}
+
+
+async def measure_request_trace(client: GGUFServerClient, model: Optional[str] = None) -> dict:
+    """
+    Request a completion's trace, then read the trace buffer.
+    
+    Returns:
+        The completion's ``Server-Timing`` phases and the slowest buffered request
+    """
+    payload = {"prompt": "Explain caching in one sentence.", "max_tokens": 32}
+    if model:
+        payload["model"] = model
+    async with httpx.AsyncClient(base_url=client.base_url, timeout=client.timeout) as http:
+        response = await http.post("/v1/completions", json=payload, headers={"X-Request-Trace": "1"})
+        response.raise_for_status()
+        debug = (await http.get("/debug/requests", params={"limit": 1})).json()
+    phases = {}
+    for entry in response.headers.get("server-timing", "").split(","):
+        name, _, duration = entry.strip().partition(";dur=")
+        if duration:
+            phases[name] = float(duration)
+    return {"server_timing_ms": phases, "slowest": debug["slowest"][0] if debug["slowest"] else None}
 
 
 async def main():
@@ -239,21 +732,23 @@ async def main():
         print(f"   Prompt: {prompt}")
         print("   Response: ", end="", flush=True)
         
-        token_count = 0
         start_time = time.time()
         
-        async for chunk in await client.stream_completions(
+        usage = {}
+        timing = {}
+        async for chunk in client.stream_completions(
             prompt=prompt,
             max_tokens=50,
             model=model_name,
         ):
-            if "token" in chunk:
-                print(chunk["token"], end="", flush=True)
-                token_count += 1
+            print(chunk["choices"][0]["text"], end="", flush=True)
+            usage = chunk.get("usage", usage)
+            timing = chunk.get("timing", timing)
         
         elapsed = time.time() - start_time
         print(f"\n   ✓ Stream completed")
-        print(f"     Tokens: {token_count}")
+        print(f"     Tokens: {usage.get('completion_tokens')}")
+        print(f"     Server timing: {timing}")
         print(f"     Time: {elapsed:.2f}s")
     except Exception as e:
         print(f"\n   ✗ Streaming failed: {e}")
@@ -284,6 +779,129 @@ async def main():
     except Exception as e:
         print(f"   ✗ Chat completion failed: {e}")
     
+    # Test 7: Health latency under saturated generation
+    print("\n7. Testing /health latency under saturated generation...")
+    try:
+        stats = await measure_health_latency_under_load(client, model=model_name)
+        passed = stats["max_seconds"] < HEALTH_LATENCY_BUDGET
+        print(f"   {'✓' if passed else '✗'} Health stayed responsive during generation")
+        print(f"     Median: {stats['median_seconds'] * 1000:.1f} ms")
+        print(f"     Max: {stats['max_seconds'] * 1000:.1f} ms (budget {HEALTH_LATENCY_BUDGET * 1000:.0f} ms)")
+    except Exception as e:
+        print(f"   ✗ Health latency test failed: {e}")
+    
+    # Test 8: Aggregate throughput with concurrent chat users
+    print("\n8. Measuring aggregate throughput with concurrent chat users...")
+    for users in (8, 16, 32):
+        try:
+            stats = await measure_aggregate_throughput(client, model=model_name, users=users)
+            print(
+                f"   ✓ {users} users: {stats['tokens_per_second']:.1f} tok/s "
+                f"({stats['completion_tokens']} tokens in {stats['elapsed_seconds']:.2f}s, "
+                f"{stats['errors']} errors)"
+            )
+        except Exception as e:
+            print(f"   ✗ Throughput test with {users} users failed: {e}")
+    
+    # Test 9: Streaming overhead
+    print("\n9. Benchmarking streaming encoding overhead...")
+    bench = benchmark_stream_encoding()
+    print(f"   ✓ Previous repr events: {bench['legacy_us_per_token']:.2f} µs/token")
+    print(f"     OpenAI JSON chunks: {bench['openai_json_us_per_token']:.2f} µs/token")
+    print(
+        f"     Coalesced chunks: {bench['coalesced_us_per_token']:.2f} µs/token "
+        f"({bench['coalesced_events_per_token']:.2f} events/token)"
+    )
+    try:
+        stats = await measure_stream_overhead(client, model=model_name)
+        print(
+            f"   ✓ Live stream: {stats['events']} events for {stats['completion_tokens']} tokens "
+            f"({stats['events_per_token']:.2f} events/token), timing {stats['server_timing']}"
+        )
+    except Exception as e:
+        print(f"   ✗ Live stream measurement failed: {e}")
+    
+    # Test 10: Embedding throughput
+    print("\n10. Measuring embedding throughput by inputs per call...")
+    try:
+        for stats in await measure_embedding_throughput(client, model=model_name):
+            print(
+                f"   ✓ {stats['batch_size']:>4} inputs/call: "
+                f"{stats['embeddings_per_second']:.1f} embeddings/s ({stats['elapsed_seconds']:.2f}s)"
+            )
+    except Exception as e:
+        print(f"   ✗ Embedding throughput test failed: {e}")
+    
+    # Test 11: Chat template rendering cost
+    print("\n11. Benchmarking chat template rendering...")
+    for stats in benchmark_chat_template_rendering():
+        print(
+            f"   ✓ {stats['turns']:>3} turns: full render {stats['full_render_ms']:.2f} ms, "
+            f"first request {stats['first_request_ms']:.2f} ms, next turn {stats['next_turn_ms']:.2f} ms"
+        )
+    
+    # Test 12: Chat sessions
+    print("\n12. Measuring multi-turn latency with and without a chat session...")
+    try:
+        stats = await measure_session_turns(client, model=model_name)
+        print(
+            f"   ✓ Last turn: stateless {stats['stateless'][-1]:.2f}s, "
+            f"session {stats['session'][-1]:.2f}s ({stats['last_turn_reused_tokens']} prompt tokens reused)"
+        )
+    except Exception as e:
+        print(f"   ✗ Chat session test failed: {e}")
+    
+    # Test 13: Parallel sampling
+    print("\n13. Measuring n=4 sampling against four single requests...")
+    try:
+        stats = await measure_parallel_sampling(client, model=model_name)
+        print(
+            f"   ✓ n={stats['choices']}: {stats['parallel_seconds']:.2f}s, "
+            f"{stats['choices']} requests: {stats['sequential_seconds']:.2f}s"
+        )
+    except Exception as e:
+        print(f"   ✗ Parallel sampling test failed: {e}")
+    
+    # Test 14: Batch job
+    print("\n14. Running a 16-request batch job...")
+    try:
+        job = await measure_batch_job(client, model=model_name)
+        counts = job["request_counts"]
+        print(
+            f"   ✓ {job['status']}: {counts['completed']}/{counts['total']} completed, "
+            f"{job['requests_per_second']:.2f} req/s, {job['tokens_per_second']:.2f} tok/s"
+        )
+    except Exception as e:
+        print(f"   ✗ Batch job test failed: {e}")
+    
+    # Test 15: Metrics
+    print("\n15. Benchmarking metrics overhead and scraping /metrics...")
+    bench = benchmark_metrics_overhead()
+    print(
+        f"   ✓ Token timing: {bench['overhead_ns_per_token']:.0f} ns/token "
+        f"(bare loop {bench['loop_ns_per_token']:.0f} ns/token)"
+    )
+    try:
+        stats = await measure_metrics_scrape(client, model=model_name)
+        print(
+            f"   ✓ Scrape: {stats['bytes']} bytes in {stats['scrape_ms']:.1f} ms, "
+            f"{stats['ttft_observations']} TTFT observations"
+        )
+    except Exception as e:
+        print(f"   ✗ Metrics scrape failed: {e}")
+    
+    # Test 16: Request traces
+    print("\n16. Tracing a completion and reading /debug/requests...")
+    try:
+        stats = await measure_request_trace(client, model=model_name)
+        phases = ", ".join(f"{name} {ms:.1f} ms" for name, ms in stats["server_timing_ms"].items())
+        print(f"   ✓ Server-Timing: {phases}")
+        if stats["slowest"]:
+            slowest = stats["slowest"]
+            print(f"   ✓ Slowest buffered: {slowest['endpoint']} {slowest['total_ms']} ms {slowest['phases_ms']}")
+    except Exception as e:
+        print(f"   ✗ Request trace test failed: {e}")
+    
     print("\n" + "=" * 80)
     print("Test suite completed!")
     print("=" * 80)
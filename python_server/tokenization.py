@@ -0,0 +1,81 @@
+"""
+Tokenization cache for GGUF models.
+
+Caches token ids per model keyed by a hash of the text, so chat requests
+that resend a growing conversation only tokenize the newest turn.
+"""
+
+import hashlib
+import logging
+import weakref
+from collections import OrderedDict
+from typing import Any, List, Optional
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(text: str) -> bytes:
+    """Compact digest of a text segment used as a cache key."""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+class TokenizationCache:
+    """
+    Per-model LRU cache of tokenized text segments.
+
+    Only touched from the event loop (tokenization itself runs on the
+    inference executor), so no locking is needed.
+    """
+
+    def __init__(self, max_entries: int = 4096):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries: Maximum cached segments per model
+        """
+        self.max_entries = max_entries
+        self._caches: "weakref.WeakKeyDictionary[Any, OrderedDict[bytes, List[int]]]" = weakref.WeakKeyDictionary()
+        self._bos: "weakref.WeakKeyDictionary[Any, List[int]]" = weakref.WeakKeyDictionary()
+        self.hits = 0
+        self.misses = 0
+
+    def _model_cache(self, model: Any) -> "OrderedDict[bytes, List[int]]":
+        cache = self._caches.get(model)
+        if cache is None:
+            cache = OrderedDict()
+            self._caches[model] = cache
+        return cache
+
+    def get(self, model: Any, text: str) -> Optional[List[int]]:
+        """Return cached token ids for ``text``, or None."""
+        cache = self._model_cache(model)
+        key = content_hash(text)
+        tokens = cache.get(key)
+        if tokens is None:
+            self.misses += 1
+            return None
+        cache.move_to_end(key)
+        self.hits += 1
+        return tokens
+
+    def put(self, model: Any, text: str, tokens: List[int]) -> None:
+        """Store token ids for ``text``, evicting the oldest segment if full."""
+        cache = self._model_cache(model)
+        cache[content_hash(text)] = tokens
+        cache.move_to_end(content_hash(text))
+        while len(cache) > self.max_entries:
+            cache.popitem(last=False)
+
+    def bos(self, model: Any) -> List[int]:
+        """The model's BOS prefix (empty for models that do not add one)."""
+        tokens = self._bos.get(model)
+        if tokens is None:
+            tokens = list(model.tokenize(b"", add_bos=True))
+            self._bos[model] = tokens
+        return tokens
+
+
+token_cache = TokenizationCache(max_entries=settings.tokenization_cache_size)
@@ -0,0 +1,117 @@
+"""
+Per-request phase timings and the recent-request trace buffer.
+
+Every completion, chat and embedding request carries a ``RequestTrace``
+whose phases (cache lookup, queueing, model load, tokenization, prompt
+evaluation, decode) are timed with ``time.perf_counter``. Generation is
+split into prompt evaluation and decode using llama.cpp's own perf
+counters when the per-request engine ran it, otherwise at the first
+generated token. Finished traces go to a bounded ring buffer served by
+``/debug/requests``; clients sending ``X-Request-Trace: 1`` get theirs
+back in a ``Server-Timing`` header, or as ``trace`` in the final chunk
+of a stream.
+"""
+
+import heapq
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+from .config import settings
+
+
+class RequestTrace:
+    """Phase timings and outcome of one request."""
+
+    def __init__(self, request_id: str, model: str, endpoint: str):
+        self.request_id = request_id
+        self.model = model
+        self.endpoint = endpoint
+        self.started_at = time.time()
+        self.status: Optional[int] = None
+        self.total: Optional[float] = None
+        # Phase name -> seconds, in the order the phases ran
+        self.phases: Dict[str, float] = {}
+        self.info: Dict[str, Any] = {}
+        self._start = time.perf_counter()
+        self._mark = self._start
+
+    def phase(self, name: str) -> None:
+        """End the phase running since the previous mark as ``name``."""
+        now = time.perf_counter()
+        self.phases[name] = self.phases.get(name, 0.0) + now - self._mark
+        self._mark = now
+
+    def generation(self, first_token: Optional[float] = None, perf: Optional[Dict[str, Any]] = None) -> None:
+        """
+        End the generation phase, split into prompt evaluation and decode.
+
+        Args:
+            first_token: Seconds from the start of generation to its first token
+            perf: llama.cpp perf counters of the generation (``prompt_eval_ms`` etc.)
+        """
+        now = time.perf_counter()
+        elapsed = now - self._mark
+        self._mark = now
+        if perf is not None:
+            self.info["llama_perf"] = perf
+            first_token = perf["prompt_eval_ms"] / 1000
+        if first_token is None:
+            self.phases["generate"] = elapsed
+            return
+        prompt_eval = min(max(first_token, 0.0), elapsed)
+        self.phases["prompt_eval"] = prompt_eval
+        self.phases["decode"] = elapsed - prompt_eval
+
+    def finish(self, status: int = 200, **info: Any) -> "RequestTrace":
+        """Close the trace; time since the last phase counts as ``respond``."""
+        if self.total is None:
+            self.phase("respond")
+            self.total = self._mark - self._start
+            self.status = status
+        self.info.update(info)
+        return self
+
+    def server_timing(self) -> str:
+        """The phases as a ``Server-Timing`` header value (milliseconds)."""
+        entries = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.phases.items()]
+        if self.total is not None:
+            entries.append(f"total;dur={self.total * 1000:.2f}")
+        return ", ".join(entries)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.request_id,
+            "model": self.model,
+            "endpoint": self.endpoint,
+            "status": self.status,
+            "started_at": self.started_at,
+            "total_ms": round(self.total * 1000, 2) if self.total is not None else None,
+            "phases_ms": {name: round(seconds * 1000, 2) for name, seconds in self.phases.items()},
+            **self.info,
+        }
+
+
+class TraceBuffer:
+    """The most recent finished request traces, in a fixed-size ring."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._traces: deque = deque(maxlen=size)
+
+    def add(self, trace: RequestTrace) -> None:
+        self._traces.append(trace)
+
+    def recent(self, n: int) -> List[Dict[str, Any]]:
+        """The ``n`` latest traces, newest first."""
+        traces = list(self._traces)[-n:] if n > 0 else []
+        return [trace.to_dict() for trace in reversed(traces)]
+
+    def slowest(self, n: int) -> List[Dict[str, Any]]:
+        """The ``n`` traces in the buffer with the longest total time, slowest first."""
+        traces = heapq.nlargest(n, self._traces, key=lambda trace: trace.total)
+        return [trace.to_dict() for trace in traces]
+
+
+# Global trace buffer
+request_traces = TraceBuffer(settings.request_trace_buffer)
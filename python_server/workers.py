@@ -0,0 +1,774 @@
+"""
+Multi-process worker mode for the GGUF inference server.
+
+Each loaded model lives in its own worker process pinned to a CPU set,
+so llama.cpp calls never contend with the HTTP front end for the GIL.
+Requests reach a worker over a pipe as small JSON messages; generated
+tokens come back as raw UTF-8 frames, with no per-token JSON or pickling.
+A worker that crashes fails only its in-flight requests and is restarted
+in the background while the front end keeps serving.
+"""
+
+import asyncio
+import base64
+import itertools
+import json
+import logging
+import multiprocessing
+import struct
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing.connection import Connection
+from typing import AsyncGenerator, Callable, Dict, FrozenSet, List, Optional, Tuple, Union
+
+import numpy as np
+
+from .backends import LocalBackend, check_token_ids
+from .batching import batch_engines
+from .cancellation import DISCONNECT, CancelToken
+from .chat_sessions import chat_sessions
+from .config import settings, get_model_path
+from .embeddings import embedding_key
+from .executor import cpu_slice, inference_executor, restrict_process_cpus
+from .metrics import metrics
+from .model_manager import (
+    EXPECTED_LOAD_BYTES_PER_SECOND,
+    ModelLoad,
+    ModelLoading,
+    ModelMemoryExhausted,
+    model_idle_ttl,
+    model_manager,
+)
+
+logger = logging.getLogger(__name__)
+
+# Worker -> front end frames: request id, frame kind, payload
+FRAME_HEADER = struct.Struct("<IB")
+READY, TOKEN, RESULT, ERROR, END, CHOICE_TOKEN = range(6)
+
+# CHOICE_TOKEN payload prefix: index of the choice the token belongs to
+CHOICE_INDEX = struct.Struct("<H")
+
+# Request id used for worker lifecycle frames (READY / startup ERROR)
+CONTROL_ID = 0
+
+# Longest wait between restarts of a repeatedly crashing worker
+MAX_RESTART_BACKOFF = 30.0
+
+# Spawned, not forked: forking a process that holds llama.cpp threads is unsafe
+_context = multiprocessing.get_context("spawn")
+
+
+class WorkerCrashed(RuntimeError):
+    """Raised for requests in flight on a worker process that died."""
+
+
+def _encode_error(error: BaseException) -> bytes:
+    return json.dumps({"type": type(error).__name__, "message": str(error)}).encode()
+
+
+def _decode_error(payload: bytes) -> Exception:
+    """Rebuild a worker-side exception with a type the endpoints map to a status code."""
+    error = json.loads(payload)
+    error_type = {
+        "FileNotFoundError": FileNotFoundError,
+        "ValueError": ValueError,
+        "ModelMemoryExhausted": ModelMemoryExhausted,
+        "WorkerCrashed": WorkerCrashed,
+    }.get(error["type"], RuntimeError)
+    return error_type(error["message"])
+
+
+# ----------------------------------------------------------------------
+# Worker process
+# ----------------------------------------------------------------------
+
+def _worker_main(model_name: str, conn: Connection, cpus: Optional[FrozenSet[int]]) -> None:
+    """Entry point of a worker process: load one model and serve requests for it."""
+    logging.basicConfig(
+        level=logging.DEBUG if settings.debug else logging.INFO,
+        format=f'%(asctime)s - worker[{model_name}] - %(name)s - %(levelname)s - %(message)s'
+    )
+    # Serve in-process inside the worker
+    settings.worker_processes = False
+    if cpus:
+        restrict_process_cpus(cpus)
+    try:
+        asyncio.run(_serve(model_name, conn))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _serve(model_name: str, conn: Connection) -> None:
+    loop = asyncio.get_running_loop()
+    inbox: asyncio.Queue = asyncio.Queue()
+
+    def _read() -> None:
+        while True:
+            try:
+                data = conn.recv_bytes()
+            except (EOFError, OSError):
+                data = None
+            loop.call_soon_threadsafe(inbox.put_nowait, data)
+            if data is None:
+                return
+
+    def send(request_id: int, kind: int, payload: bytes = b"") -> None:
+        # Only called from the event loop thread, so frames never interleave
+        try:
+            conn.send_bytes(FRAME_HEADER.pack(request_id, kind) + payload)
+        except (BrokenPipeError, OSError):
+            pass
+
+    threading.Thread(target=_read, name="worker-inbox", daemon=True).start()
+
+    try:
+        if model_name in settings.preload_models:
+            await model_manager.preload(model_name)
+        else:
+            await model_manager.load_model(model_name)
+    except Exception as e:
+        logger.error(f"Worker failed to load {model_name}: {e}")
+        send(CONTROL_ID, ERROR, _encode_error(e))
+        return
+    # The front end checks client-supplied token ids against the vocabulary
+    lease = await model_manager.acquire_model(model_name)
+    send(CONTROL_ID, READY, json.dumps({"n_vocab": lease.model.n_vocab()}).encode())
+    await lease.release()
+
+    background = [asyncio.create_task(model_manager.watch_memory_pressure())]
+    if chat_sessions.enabled:
+        background.append(asyncio.create_task(chat_sessions.sweep_periodically(settings.memory_poll_interval)))
+    if settings.kv_warm_prompts:
+        background.append(asyncio.create_task(model_manager.warm_prompt_states(only_model=model_name)))
+
+    tasks: Dict[int, asyncio.Task] = {}
+    cancels: Dict[int, CancelToken] = {}
+    while True:
+        data = await inbox.get()
+        if data is None:
+            break
+        message = json.loads(data)
+        request_id = message["id"]
+        if message["op"] == "shutdown":
+            break
+        if message["op"] == "cancel":
+            # With a reason the generation stops and still returns what it has;
+            # without one the front end has left and the request is dropped
+            reason = message.get("reason")
+            token = cancels.get(request_id)
+            if token is not None:
+                token.cancel(reason or DISCONNECT)
+            task = tasks.get(request_id)
+            if task is not None and reason is None:
+                task.cancel()
+            continue
+        task = asyncio.create_task(_handle(model_name, message, send, cancels))
+        tasks[request_id] = task
+        task.add_done_callback(lambda _, request_id=request_id: tasks.pop(request_id, None))
+
+    logger.info(f"Worker for {model_name} shutting down")
+    pending = list(tasks.values()) + background
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    await model_manager.shutdown()
+    batch_engines.close_all()
+    inference_executor.shutdown()
+    chat_sessions.close()
+
+
+async def _handle(
+    model_name: str,
+    message: dict,
+    send: Callable[..., None],
+    cancels: Dict[int, CancelToken],
+) -> None:
+    """Run one front-end request against the worker's model."""
+    request_id = message["id"]
+    op = message["op"]
+    args = message.get("args", {})
+    backend = None
+    if "cancel" in args:
+        # The front end's cancel token, rebuilt here so decoding checks it per token
+        args["cancel"] = cancels[request_id] = CancelToken(**args["cancel"])
+    try:
+        if op == "stats":
+            result = {
+                "memory": model_manager.memory_stats(),
+                "prefix_cache": model_manager.prefix_cache_stats(),
+                "disk": model_manager.kv_store_stats(),
+                "chat_sessions": chat_sessions.stats(),
+            }
+            send(request_id, RESULT, json.dumps(result).encode())
+            return
+        if op == "delete_session":
+            send(request_id, RESULT, json.dumps(chat_sessions.delete(args["session_id"])).encode())
+            return
+
+        model_key = embedding_key(model_name) if op == "embed" else model_name
+        backend = LocalBackend(model_name, await model_manager.acquire_model(model_key))
+
+        if op == "generate" and args.get("stream"):
+            multiple = args.get("choices", 1) > 1
+            stream = await backend.generate(**args)
+            try:
+                finals = []
+                async for chunk in stream:
+                    if "finish_reason" in chunk:
+                        finals.append(chunk)
+                    elif multiple:
+                        send(request_id, CHOICE_TOKEN, CHOICE_INDEX.pack(chunk["index"]) + chunk["token"].encode())
+                    else:
+                        send(request_id, TOKEN, chunk["token"].encode())
+            finally:
+                await stream.aclose()
+            # One summary per choice: a list when several were sampled
+            final = finals if multiple else finals[0] if finals else None
+            send(request_id, END, json.dumps(final).encode() if final else b"")
+            return
+
+        if op == "generate":
+            result = await backend.generate(**args)
+        elif op == "tokenize":
+            result = await backend.tokenize(args["text"])
+        elif op == "tokenize_chat":
+            result = await backend.tokenize_chat(args["messages"])
+        elif op == "count_tokens":
+            result = await backend.count_tokens(args["text"])
+        elif op == "embed":
+            # Vectors travel as raw float32 bytes rather than JSON numbers
+            vectors, tokens = await backend.embed(args["inputs"], args.get("normalize", True))
+            result = {
+                "vectors": base64.b64encode(vectors.tobytes()).decode("ascii"),
+                "shape": list(vectors.shape),
+                "tokens": tokens,
+            }
+        else:
+            raise ValueError(f"Unknown worker operation: {op}")
+        send(request_id, RESULT, json.dumps(result).encode())
+
+    except asyncio.CancelledError:
+        # The front end dropped the request; nobody is waiting for a reply
+        pass
+    except Exception as e:
+        logger.error(f"Worker request {op} failed: {e}", exc_info=True)
+        send(request_id, ERROR, _encode_error(e))
+    finally:
+        cancels.pop(request_id, None)
+        if backend is not None:
+            await backend.release()
+
+
+# ----------------------------------------------------------------------
+# Front end
+# ----------------------------------------------------------------------
+
+class WorkerHandle:
+    """Front-end side of one worker process and its pipe."""
+
+    def __init__(
+        self,
+        model_name: str,
+        slot: int,
+        cpus: Optional[FrozenSet[int]],
+        on_crash: Callable[["WorkerHandle"], None],
+    ):
+        self.model_name = model_name
+        self.slot = slot
+        self.cpus = cpus
+        self.on_crash = on_crash
+        self.process: Optional[multiprocessing.Process] = None
+        self.conn: Optional[Connection] = None
+        self.alive = False
+        self.stopping = False
+        self.restarts = 0
+        self.failures = 0
+        self.sessions = 0
+        self.last_used = time.monotonic()
+        # Vocabulary size of the worker's model, reported when it is ready
+        self.n_vocab: Optional[int] = None
+        self._ready: Optional[asyncio.Future] = None
+        self._pending: Dict[int, asyncio.Queue] = {}
+        self._ids = itertools.count(CONTROL_ID + 1)
+        self._send_lock = threading.Lock()
+
+    async def start(self) -> None:
+        """Spawn the worker process and wait until its model is loaded."""
+        loop = asyncio.get_running_loop()
+        parent, child = _context.Pipe()
+        process = _context.Process(
+            target=_worker_main,
+            args=(self.model_name, child, self.cpus),
+            name=f"llama-worker-{self.model_name}",
+            daemon=True,
+        )
+        process.start()
+        child.close()
+
+        self.process = process
+        self.conn = parent
+        self._ready = loop.create_future()
+        threading.Thread(
+            target=self._read,
+            args=(loop, parent, process),
+            name=f"worker-reader-{process.pid}",
+            daemon=True,
+        ).start()
+
+        await self._ready
+        self.alive = True
+        self.failures = 0
+        logger.info(
+            f"Worker for {self.model_name} ready (pid {process.pid}"
+            + (f", CPUs {sorted(self.cpus)})" if self.cpus else ")")
+        )
+
+    def _read(self, loop: asyncio.AbstractEventLoop, conn: Connection, process) -> None:
+        """Reader thread: hand frames to the event loop until the pipe closes."""
+        while True:
+            try:
+                data = conn.recv_bytes()
+            except (EOFError, OSError):
+                break
+            try:
+                loop.call_soon_threadsafe(self._dispatch, data)
+            except RuntimeError:
+                return
+        try:
+            loop.call_soon_threadsafe(self._on_exit, process)
+        except RuntimeError:
+            pass
+
+    def _dispatch(self, data: bytes) -> None:
+        request_id, kind = FRAME_HEADER.unpack_from(data)
+        payload = data[FRAME_HEADER.size:]
+        if request_id == CONTROL_ID:
+            if not self._ready.done():
+                if kind == READY:
+                    self.n_vocab = json.loads(payload)["n_vocab"]
+                    self._ready.set_result(True)
+                else:
+                    self._ready.set_exception(_decode_error(payload))
+            return
+        queue = self._pending.get(request_id)
+        if queue is not None:
+            queue.put_nowait((kind, payload))
+
+    def _on_exit(self, process) -> None:
+        """Pipe closed: fail in-flight requests and report a crash."""
+        if process is not self.process:
+            return
+        self.alive = False
+        crashed = WorkerCrashed(f"Worker for {self.model_name} exited unexpectedly")
+        if self._ready is not None and not self._ready.done():
+            self._ready.set_exception(crashed)
+        for queue in self._pending.values():
+            queue.put_nowait((ERROR, _encode_error(crashed)))
+        if not self.stopping:
+            logger.error(str(crashed))
+            self.on_crash(self)
+
+    def _send(self, message: dict, require_alive: bool = True) -> None:
+        if require_alive and not self.alive:
+            raise WorkerCrashed(f"Worker for {self.model_name} is not running")
+        data = json.dumps(message).encode()
+        try:
+            with self._send_lock:
+                self.conn.send_bytes(data)
+        except (BrokenPipeError, OSError) as e:
+            raise WorkerCrashed(f"Worker for {self.model_name} is unreachable: {e}") from e
+
+    def _cancel(self, request_id: int, reason: Optional[str] = None) -> None:
+        try:
+            self._send({"id": request_id, "op": "cancel", "reason": reason})
+        except WorkerCrashed:
+            pass
+
+    def _forward_cancel(self, request_id: int, cancel: Optional[CancelToken]) -> None:
+        """Relay a front-end cancellation to the worker generating the request."""
+        if cancel is not None:
+            cancel.on_cancel(lambda reason: self._cancel(request_id, reason))
+
+    async def request(self, op: str, args: Optional[dict] = None, cancel: Optional[CancelToken] = None):
+        """Send one request and wait for its result."""
+        request_id = next(self._ids)
+        queue: asyncio.Queue = asyncio.Queue()
+        self._pending[request_id] = queue
+        self._forward_cancel(request_id, cancel)
+        done = False
+        try:
+            self._send({"id": request_id, "op": op, "args": args or {}})
+            kind, payload = await queue.get()
+            done = True
+            if kind == ERROR:
+                raise _decode_error(payload)
+            return json.loads(payload)
+        finally:
+            self._pending.pop(request_id, None)
+            if not done:
+                self._cancel(request_id)
+
+    async def stream(
+        self,
+        op: str,
+        args: dict,
+        cancel: Optional[CancelToken] = None,
+    ) -> AsyncGenerator[Union[str, Tuple[int, str], dict], None]:
+        """
+        Send one request and yield its token frames, then the final summary dicts if any.
+
+        Tokens arrive as text, or as ``(choice index, text)`` when several
+        choices are sampled.
+        """
+        request_id = next(self._ids)
+        queue: asyncio.Queue = asyncio.Queue()
+        self._pending[request_id] = queue
+        self._forward_cancel(request_id, cancel)
+        done = False
+        try:
+            self._send({"id": request_id, "op": op, "args": args})
+            while True:
+                kind, payload = await queue.get()
+                if kind == TOKEN:
+                    yield payload.decode("utf-8", errors="replace")
+                elif kind == CHOICE_TOKEN:
+                    (index,) = CHOICE_INDEX.unpack_from(payload)
+                    yield index, payload[CHOICE_INDEX.size:].decode("utf-8", errors="replace")
+                elif kind == END:
+                    done = True
+                    if payload:
+                        final = json.loads(payload)
+                        for summary in final if isinstance(final, list) else [final]:
+                            yield summary
+                    return
+                else:
+                    done = True
+                    raise _decode_error(payload)
+        finally:
+            self._pending.pop(request_id, None)
+            if not done:
+                # Consumer left early: stop generating in the worker
+                self._cancel(request_id)
+
+    async def stop(self, timeout: float = 30.0) -> None:
+        """Ask the worker to shut down gracefully, terminating it if it hangs."""
+        self.stopping = True
+        self.alive = False
+        if self.process is None:
+            return
+        try:
+            self._send({"id": CONTROL_ID, "op": "shutdown"}, require_alive=False)
+        except WorkerCrashed:
+            pass
+        await asyncio.to_thread(self.process.join, timeout)
+        if self.process.is_alive():
+            logger.warning(f"Worker for {self.model_name} did not exit; terminating")
+            self.process.terminate()
+            await asyncio.to_thread(self.process.join, 5)
+        self.conn.close()
+
+    def stats(self) -> dict:
+        return {
+            "pid": self.process.pid if self.process is not None else None,
+            "alive": self.alive,
+            "cpus": sorted(self.cpus) if self.cpus else None,
+            "sessions": self.sessions,
+            "in_flight": len(self._pending),
+            "restarts": self.restarts,
+            "idle_seconds": time.monotonic() - self.last_used,
+        }
+
+
+class WorkerBackend:
+    """Serves a request from a model's worker process (same interface as ``LocalBackend``)."""
+
+    def __init__(self, handle: WorkerHandle):
+        self.handle = handle
+        self.released = False
+
+    async def tokenize(self, text: str) -> List[int]:
+        return await self.handle.request("tokenize", {"text": text})
+
+    async def tokenize_chat(self, messages: List[dict]) -> List[int]:
+        return await self.handle.request("tokenize_chat", {"messages": messages})
+
+    async def count_tokens(self, text: str) -> int:
+        return await self.handle.request("count_tokens", {"text": text})
+
+    def check_tokens(self, tokens: List[int]) -> None:
+        check_token_ids(tokens, self.handle.n_vocab)
+
+    async def embed(self, inputs: List[Union[str, List[int]]], normalize: bool = True) -> Tuple[np.ndarray, int]:
+        """Embed in the worker's embedding-mode instance of its model."""
+        result = await self.handle.request("embed", {"inputs": inputs, "normalize": normalize})
+        vectors = np.frombuffer(base64.b64decode(result["vectors"]), dtype=np.float32)
+        return vectors.reshape(result["shape"]), result["tokens"]
+
+    async def generate(
+        self,
+        prompt: Union[str, List[int]],
+        cancel: Optional[CancelToken] = None,
+        **kwargs,
+    ):
+        """Generate in the worker; returns a result dict or an async generator when streaming."""
+        args = {"prompt": prompt, **kwargs}
+        if cancel is not None:
+            args["cancel"] = {
+                "request_id": cancel.request_id,
+                "max_tokens": cancel.max_tokens,
+                "timeout": cancel.remaining(),
+            }
+        if kwargs.get("stream"):
+            return self._stream(args, cancel)
+        return await self.handle.request("generate", args, cancel)
+
+    async def _stream(self, args: dict, cancel: Optional[CancelToken]) -> AsyncGenerator[dict, None]:
+        tokens: Dict[int, int] = {}
+        async for item in self.handle.stream("generate", args, cancel):
+            if isinstance(item, dict):
+                yield item
+                continue
+            index, text = item if isinstance(item, tuple) else (0, item)
+            tokens[index] = tokens.get(index, 0) + 1
+            yield {"token": text, "index": index, "tokens_so_far": tokens[index], "timestamp": time.time()}
+
+    async def release(self) -> None:
+        """End the session on the worker (idempotent)."""
+        if not self.released:
+            self.released = True
+            self.handle.sessions -= 1
+            self.handle.last_used = time.monotonic()
+
+
+class WorkerPool:
+    """
+    One worker process per loaded model.
+
+    At most ``max_workers`` workers run at once; starting another stops
+    the least recently used worker without active sessions. Each worker
+    gets a disjoint CPU slice of ``cpus_per_worker`` CPUs when the host
+    has enough of them.
+    """
+
+    def __init__(self, max_workers: int = 2, cpus_per_worker: int = 4):
+        """
+        Initialize the pool.
+
+        Args:
+            max_workers: Maximum worker processes (models) running at once
+            cpus_per_worker: CPUs pinned to each worker
+        """
+        self.max_workers = max_workers
+        self.cpus_per_worker = cpus_per_worker
+        self.workers: OrderedDict[str, WorkerHandle] = OrderedDict()
+        self.pinned = set(settings.pinned_models)
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._restart_tasks: Dict[str, asyncio.Task] = {}
+        # Worker starts in flight; at most max_concurrent_loads read weights at once
+        self.loads: Dict[str, ModelLoad] = {}
+        self._load_seconds: Dict[str, float] = {}
+        self._start_slots = asyncio.Semaphore(max(1, settings.max_concurrent_loads))
+
+    async def session(self, model_name: str, wait: Optional[float] = None) -> WorkerBackend:
+        """
+        Open a request session on the model's worker, starting it if needed.
+
+        Args:
+            model_name: Model to serve
+            wait: Seconds to wait for a worker that is starting (None waits until ready)
+
+        Raises:
+            ModelLoading: The worker is still loading its model after ``wait`` seconds
+        """
+        handle = self.workers.get(model_name)
+        cached = handle is not None and handle.alive
+        metrics.model_cache.labels(model_name, "hit" if cached else "miss").inc()
+        if not cached:
+            load = self._start_in_background(model_name)
+            try:
+                handle = await asyncio.wait_for(asyncio.shield(load.task), wait)
+            except asyncio.TimeoutError:
+                raise ModelLoading(
+                    f"Model {model_name} is loading ({load.phase})",
+                    retry_after=load.retry_after(),
+                    progress=load.to_dict(),
+                ) from None
+        handle.sessions += 1
+        handle.last_used = time.monotonic()
+        self.workers.move_to_end(model_name)
+        return WorkerBackend(handle)
+
+    def _start_in_background(self, model_name: str) -> ModelLoad:
+        """Start the model's worker as a task that outlives callers who stop waiting."""
+        load = self.loads.get(model_name)
+        if load is not None:
+            return load
+        size_bytes = get_model_path(model_name).stat().st_size
+        expected = self._load_seconds.get(model_name, size_bytes / EXPECTED_LOAD_BYTES_PER_SECOND)
+        load = ModelLoad(model_name, size_bytes, expected)
+        load.phase = "starting"
+        load.task = asyncio.create_task(self._ensure(model_name))
+        load.task.add_done_callback(lambda task: self._start_finished(load, task))
+        self.loads[model_name] = load
+        return load
+
+    def _start_finished(self, load: ModelLoad, task: asyncio.Task) -> None:
+        self.loads.pop(load.model_name, None)
+        if task.cancelled():
+            return
+        if task.exception() is None:
+            self._load_seconds[load.model_name] = load.elapsed()
+            metrics.model_loads.labels(load.model_name, "loaded").inc()
+            metrics.model_load_duration.labels(load.model_name).observe(load.elapsed())
+        else:
+            metrics.model_loads.labels(load.model_name, "failed").inc()
+
+    def load_progress(self) -> Dict[str, dict]:
+        """Progress of worker starts in flight."""
+        return {model_name: load.to_dict() for model_name, load in list(self.loads.items())}
+
+    async def _ensure(self, model_name: str) -> WorkerHandle:
+        handle = self.workers.get(model_name)
+        if handle is not None and handle.alive:
+            return handle
+
+        lock = self._locks.setdefault(model_name, asyncio.Lock())
+        async with lock:
+            handle = self.workers.get(model_name)
+            if handle is not None and handle.alive:
+                return handle
+            if handle is None:
+                get_model_path(model_name)
+                await self._make_room()
+                slot = self._free_slot()
+                handle = WorkerHandle(
+                    model_name,
+                    slot,
+                    cpu_slice(slot, self.cpus_per_worker),
+                    self._on_crash,
+                )
+                self.workers[model_name] = handle
+            try:
+                async with self._start_slots:
+                    await handle.start()
+            except Exception:
+                if self.workers.get(model_name) is handle and handle.restarts == 0:
+                    self.workers.pop(model_name, None)
+                raise
+            return handle
+
+    async def preload(self, model_name: str) -> None:
+        """Start the model's worker; it prefetches and warms preloaded models before reporting ready."""
+        await self._start_in_background(model_name).task
+
+    def is_loaded(self, model_name: str) -> bool:
+        """Whether the model's worker is running."""
+        handle = self.workers.get(model_name)
+        return handle is not None and handle.alive
+
+    def _free_slot(self) -> int:
+        used = {handle.slot for handle in self.workers.values()}
+        return next(i for i in range(len(used) + 1) if i not in used)
+
+    async def _make_room(self) -> None:
+        """Stop idle workers until another one may start."""
+        while len(self.workers) >= self.max_workers:
+            victim = next(
+                (
+                    handle for name, handle in self.workers.items()
+                    if handle.sessions == 0 and name not in self.pinned
+                ),
+                None,
+            )
+            if victim is None:
+                raise ModelMemoryExhausted(
+                    f"All {len(self.workers)} worker processes are busy or pinned"
+                )
+            logger.info(f"Stopping idle worker: {victim.model_name}")
+            metrics.model_evictions.labels(victim.model_name, "memory").inc()
+            await self.stop(victim.model_name)
+
+    def _on_crash(self, handle: WorkerHandle) -> None:
+        if handle.model_name not in self._restart_tasks:
+            self._restart_tasks[handle.model_name] = asyncio.create_task(self._restart(handle))
+
+    async def _restart(self, handle: WorkerHandle) -> None:
+        """Restart a crashed worker with exponential backoff."""
+        try:
+            while self.workers.get(handle.model_name) is handle and not handle.alive:
+                delay = min(MAX_RESTART_BACKOFF, 2.0 ** handle.failures)
+                handle.failures += 1
+                handle.restarts += 1
+                logger.warning(f"Restarting worker for {handle.model_name} in {delay:.0f}s")
+                await asyncio.sleep(delay)
+                try:
+                    await self._ensure(handle.model_name)
+                except Exception as e:
+                    logger.error(f"Worker restart for {handle.model_name} failed: {e}")
+        finally:
+            self._restart_tasks.pop(handle.model_name, None)
+
+    async def watch_idle_workers(self) -> None:
+        """Stop workers whose model has been idle past its TTL (``model_idle_ttl`` / ``model_idle_ttls``)."""
+        if not settings.model_idle_ttl and not settings.model_idle_ttls:
+            return
+        while True:
+            await asyncio.sleep(settings.memory_poll_interval)
+            now = time.monotonic()
+            for model_name, handle in list(self.workers.items()):
+                ttl = model_idle_ttl(model_name)
+                if (
+                    ttl > 0
+                    and handle.alive
+                    and handle.sessions == 0
+                    and model_name not in self.pinned
+                    and now - handle.last_used >= ttl
+                ):
+                    logger.info(f"Stopping idle worker: {model_name}")
+                    metrics.model_evictions.labels(model_name, "idle").inc()
+                    await self.stop(model_name)
+
+    async def stop(self, model_name: str) -> bool:
+        """Stop a model's worker; returns False if none was running."""
+        handle = self.workers.pop(model_name, None)
+        if handle is None:
+            return False
+        await handle.stop()
+        return True
+
+    async def stop_all(self) -> None:
+        for task in list(self._restart_tasks.values()):
+            task.cancel()
+        for load in list(self.loads.values()):
+            load.task.cancel()
+        for model_name in list(self.workers):
+            await self.stop(model_name)
+
+    async def delete_chat_session(self, session_id: str) -> bool:
+        """Forget a chat session in every running worker; returns whether any worker had it."""
+        found = False
+        for handle in list(self.workers.values()):
+            if handle.alive:
+                found = await handle.request("delete_session", {"session_id": session_id}) or found
+        return found
+
+    async def stats(self) -> Dict[str, dict]:
+        """Process-level state of every worker plus its in-worker model stats."""
+        result = {}
+        for model_name, handle in list(self.workers.items()):
+            entry = handle.stats()
+            if handle.alive:
+                try:
+                    entry.update(await asyncio.wait_for(handle.request("stats"), timeout=5))
+                except Exception as e:
+                    entry["error"] = str(e)
+            result[model_name] = entry
+        return result
+
+
+worker_pool = WorkerPool(
+    max_workers=settings.max_cached_models,
+    cpus_per_worker=settings.n_threads * settings.max_replicas,
+)